@@ -0,0 +1,106 @@
+"""Compares the linear and automaton encodings of the consecutive-shift rules.
+
+Usage:
+    python benchmark_encodings.py --nurses 20 --runs 3 --time-limit 30
+    python benchmark_encodings.py --payload saved_request.json
+
+Each payload is solved with every encoding and the model size, build time, solve time, objective and
+best bound (a tighter bound at the same time limit means stronger propagation) are printed per run.
+"""
+import argparse
+import calendar
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+
+os.environ.setdefault('SCHEDULE_STORE_PATH', ':memory:')
+
+
+@contextlib.contextmanager
+def silenced_stdout():
+    """The solver writes its search log straight to fd 1, so redirect at the descriptor level."""
+    sys.stdout.flush()
+    saved_fd = os.dup(1)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved_fd, 1)
+            os.close(saved_fd)
+
+
+def synthetic_payload(num_nurses, num_gov, year, month, seed, time_limit):
+    rnd = random.Random(seed)
+    constraint_types = ['no_night_shifts', 'no_mondays', 'no_night_afternoon_double', 'no_sundays', 'no_morning_shifts']
+    nurses = []
+    for i in range(num_nurses):
+        constraints = []
+        if i >= num_gov and rnd.random() < 0.3:
+            constraints.append({'type': rnd.choice(constraint_types), 'strength': rnd.choice(['hard', 'soft'])})
+        nurses.append({'id': f'nurse{i}', 'isGovernmentOfficial': i < num_gov, 'constraints': constraints})
+    last_day = calendar.monthrange(year, month)[1]
+    monthly_requests = {}
+    for nurse in nurses[num_gov:]:
+        if rnd.random() < 0.4:
+            monthly_requests[nurse['id']] = [{'type': 'no_specific_days', 'value': [str(rnd.randint(1, last_day))], 'is_high_priority': rnd.random() < 0.3}]
+    per_shift = max(1, (num_nurses - num_gov) // 5)
+    return {
+        'nurses': nurses,
+        'schedule': {'startDate': f'{year}-{month:02d}-01', 'endDate': f'{year}-{month:02d}-{last_day}'},
+        'requiredNursesMorning': per_shift + 1, 'requiredNursesAfternoon': per_shift, 'requiredNursesNight': per_shift,
+        'maxConsecutiveShiftsWorked': 6, 'targetOffDays': 8, 'solverTimeLimit': time_limit,
+        'monthly_soft_requests': monthly_requests, 'holidays': [],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark consecutive-rule encodings")
+    parser.add_argument('--payload', action='append', default=[], help="JSON request body to solve (repeatable)")
+    parser.add_argument('--nurses', type=int, default=15)
+    parser.add_argument('--gov', type=int, default=1)
+    parser.add_argument('--year', type=int, default=2025)
+    parser.add_argument('--month', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=1, help="Solves per payload and encoding")
+    parser.add_argument('--time-limit', type=float, default=20.0)
+    parser.add_argument('--encodings', default='linear,automaton')
+    args = parser.parse_args()
+
+    with silenced_stdout():
+        import server
+
+    payloads = []
+    for path in args.payload:
+        with open(path, encoding='utf-8') as f:
+            payloads.append((os.path.basename(path), json.load(f)))
+    if not payloads:
+        payloads.append((f'synthetic-{args.nurses}n-seed{args.seed}', synthetic_payload(args.nurses, args.gov, args.year, args.month, args.seed, args.time_limit)))
+
+    encodings = args.encodings.split(',')
+    print(f"{'payload':<28} {'encoding':<10} {'vars':>7} {'cons':>7} {'buildMs':>8} {'solveS':>7} {'status':>9} {'objective':>10} {'bound':>8} {'conflicts':>10}")
+    for name, payload in payloads:
+        summary = {}
+        for encoding in encodings:
+            for run in range(args.runs):
+                # Runs share the store, so turn off warm starts and stored history to keep runs independent.
+                data = dict(payload, consecutiveEncoding=encoding, solverTimeLimit=args.time_limit, warmStart=False, useStoredFairnessHistory=False)
+                with silenced_stdout():
+                    body, status_code = server.solve_schedule_request(data)
+                if status_code != 200:
+                    print(f"{name:<28} {encoding:<10} failed: {body.get('error')}")
+                    continue
+                model_stats, solver_stats = body['modelStats'], body['solverStats']
+                summary.setdefault(encoding, []).append(solver_stats['wallTime'])
+                print(f"{name:<28} {encoding:<10} {model_stats['variables']:>7} {model_stats['constraints']:>7} {model_stats['buildMs']:>8.1f} "
+                      f"{solver_stats['wallTime']:>7.2f} {solver_stats['status']:>9} {solver_stats['objective']:>10.0f} {solver_stats['bestBound']:>8.0f} {solver_stats['conflicts']:>10}")
+        for encoding, times in summary.items():
+            print(f"{name:<28} {encoding:<10} median solve time {statistics.median(times):.2f}s over {len(times)} runs")
+
+
+if __name__ == '__main__':
+    main()
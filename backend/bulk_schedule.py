@@ -0,0 +1,235 @@
+"""Offline bulk scheduling: solve many /generate-schedule payloads from files without the HTTP server.
+
+Usage:
+    python bulk_schedule.py payloads.jsonl --output results.jsonl --timings timings.csv
+    python bulk_schedule.py payload_dir/ --processes 4 --baseline last_timings.csv
+
+Inputs are JSONL files (one payload per line, or {"id": ..., "payload": {...}}) and directories of
+*.json payloads. Payloads are grouped by 'ward'; each ward runs in its own worker process with its
+months solved in date order, feeding each result into the next month as previousMonthSchedule,
+fairnessHistory and carry_over_flags unless the payload already sets them. Payloads without a ward are
+solved independently. Wards are solved in parallel.
+
+When a month fails, the ward's later months can no longer be chained from the real previous result:
+they are still solved, but their rows get chain_broken=1 in the timings CSV and are listed in the
+summary, and baseline comparison skips them.
+
+Results are written as compact JSONL (one line per payload) and timings as CSV. With --baseline, the
+timings are compared with an earlier CSV and the command exits with status 1 on regressions.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+TIMING_COLUMNS = [
+    'payload_id', 'ward', 'start_date', 'end_date', 'nurses', 'days', 'http_status', 'solver_status', 'objective',
+    'best_bound', 'build_ms', 'solve_s', 'total_s', 'num_workers', 'peak_rss_mb', 'chained_from', 'chain_broken',
+]
+SOLVER_STATUS_RANK = {'OPTIMAL': 2, 'FEASIBLE': 1}
+
+
+def load_payloads(paths):
+    """Returns [(payload id, payload)] from JSONL files and directories of JSON files, in input order."""
+    payloads = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.json'):
+                    with open(os.path.join(path, name), encoding='utf-8') as f:
+                        payloads.append((os.path.splitext(name)[0], json.load(f)))
+                elif name.endswith('.jsonl'):
+                    payloads.extend(load_payloads([os.path.join(path, name)]))
+            continue
+        stem = os.path.splitext(os.path.basename(path))[0]
+        with open(path, encoding='utf-8') as f:
+            if path.endswith('.json'):
+                payloads.append((stem, json.load(f)))
+                continue
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if 'payload' in record:
+                    payloads.append((str(record.get('id', f'{stem}:{line_no}')), record['payload']))
+                else:
+                    payloads.append((f'{stem}:{line_no}', record))
+    return payloads
+
+
+def group_by_ward(payloads):
+    """Wards keep their months together in start-date order; payloads without a ward each form their own group."""
+    groups, by_ward = [], {}
+    for payload_id, payload in payloads:
+        ward = payload.get('ward')
+        if not ward:
+            groups.append([(payload_id, payload)])
+        elif ward in by_ward:
+            by_ward[ward].append((payload_id, payload))
+        else:
+            by_ward[ward] = [(payload_id, payload)]
+            groups.append(by_ward[ward])
+    for group in groups:
+        group.sort(key=lambda item: item[1].get('schedule', {}).get('startDate', ''))
+    return groups
+
+
+def _init_worker(log_dir, store_path, solver_workers, use_firestore):
+    os.environ['SCHEDULE_STORE_PATH'] = store_path
+    os.environ['SOLVER_NUM_WORKERS'] = str(solver_workers)
+    # The solver writes its search log to fd 1, so point the descriptor itself at the log.
+    log_path = os.path.join(log_dir, f'worker-{os.getpid()}.log') if log_dir else os.devnull
+    log_file = open(log_path, 'a')
+    sys.stdout.flush()
+    os.dup2(log_file.fileno(), 1)
+    import server
+    if not use_firestore:
+        server.db_admin = None
+
+
+def chain_from_previous(payload, previous_body):
+    """Fills next-month state from the previous result without overriding anything the payload sets."""
+    chained = dict(payload)
+    if 'previousMonthSchedule' not in chained:
+        chained['previousMonthSchedule'] = {'days': previous_body['days'], 'nurseSchedules': previous_body['nurseSchedules']}
+    if 'fairnessHistory' not in chained and previous_body.get('fairnessHistoryNext'):
+        chained['fairnessHistory'] = previous_body['fairnessHistoryNext']
+    if 'carry_over_flags' not in chained and previous_body.get('nextCarryOverFlags'):
+        chained['carry_over_flags'] = previous_body['nextCarryOverFlags']
+    return chained
+
+
+def solve_group(group, chain, time_limit, include_schedules):
+    import server
+    rows = []
+    previous_id, previous_body = None, None
+    chain_broken = False
+    for payload_id, payload in group:
+        chained_from = previous_id if chain and previous_body else None
+        data = chain_from_previous(payload, previous_body) if chained_from else dict(payload)
+        if not chain:
+            # The worker's store keeps earlier results; replays must not warm-start from them or read
+            # aggregates they wrote, or results would depend on batch order.
+            data.update(warmStart=False, useStoredFairnessHistory=False)
+        if time_limit is not None:
+            data['solverTimeLimit'] = time_limit
+        started = time.time()
+        body, status_code = server.solve_schedule_request(data)
+        total_s = time.time() - started
+        previous_id, previous_body = (payload_id, body) if status_code == 200 else (None, None)
+        row_chain_broken = chain_broken
+        # Every later month of the ward starts from a different state than a full chain would give it.
+        chain_broken = chain_broken or (chain and status_code != 200)
+        solver_stats, model_stats = body.get('solverStats', {}), body.get('modelStats', {})
+        schedule_info = payload.get('schedule', {})
+        timing = {
+            'payload_id': payload_id, 'ward': payload.get('ward', ''),
+            'start_date': schedule_info.get('startDate', ''), 'end_date': schedule_info.get('endDate', ''),
+            'nurses': len(payload.get('nurses', [])), 'days': len(body.get('days', [])), 'http_status': status_code,
+            'solver_status': solver_stats.get('status', ''), 'objective': solver_stats.get('objective', ''),
+            'best_bound': solver_stats.get('bestBound', ''), 'build_ms': model_stats.get('buildMs', ''),
+            'solve_s': solver_stats.get('wallTime', ''), 'total_s': round(total_s, 3),
+            'num_workers': solver_stats.get('numWorkers', ''), 'peak_rss_mb': solver_stats.get('peakRssMb', ''),
+            'chained_from': chained_from or '', 'chain_broken': int(row_chain_broken),
+        }
+        result = {'id': payload_id, 'ward': payload.get('ward', ''), 'httpStatus': status_code, 'chainedFrom': chained_from,
+                  'chainBroken': row_chain_broken}
+        if status_code == 200:
+            result.update({k: body.get(k) for k in ('startDate', 'endDate', 'solverStatus', 'penaltyValue', 'fairnessReport', 'nextCarryOverFlags', 'solverStats', 'modelStats')})
+            if include_schedules:
+                result.update(days=body['days'], nurseSchedules=body['nurseSchedules'])
+        else:
+            result.update(error=body.get('error'), solverStats=solver_stats)
+        rows.append((result, timing))
+    return rows
+
+
+def compare_with_baseline(timings, baseline_path, slowdown_threshold, objective_tolerance):
+    """Returns regressions: worse statuses, objectives worse by more than the tolerance and slower solves."""
+    with open(baseline_path, newline='', encoding='utf-8') as f:
+        baseline = {row['payload_id']: row for row in csv.DictReader(f)}
+    regressions = []
+    for timing in timings:
+        base = baseline.get(timing['payload_id'])
+        if base is None or timing['chain_broken'] or base.get('chain_broken') == '1':
+            continue
+        payload_id = timing['payload_id']
+        if (timing['http_status'] != 200 and base['http_status'] == '200') or \
+                SOLVER_STATUS_RANK.get(timing['solver_status'], 0) < SOLVER_STATUS_RANK.get(base['solver_status'], 0):
+            regressions.append(f"{payload_id}: status {base['http_status']}/{base['solver_status']} -> {timing['http_status']}/{timing['solver_status']}")
+        if timing['objective'] != '' and base['objective'] and float(timing['objective']) > float(base['objective']) * (1 + objective_tolerance):
+            regressions.append(f"{payload_id}: objective {base['objective']} -> {timing['objective']}")
+        if base['total_s'] and float(timing['total_s']) > float(base['total_s']) * slowdown_threshold:
+            regressions.append(f"{payload_id}: total time {base['total_s']}s -> {timing['total_s']}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve schedule payloads from files in parallel")
+    parser.add_argument('inputs', nargs='+', help="JSONL files, JSON files or directories of JSON payloads")
+    parser.add_argument('--output', default='bulk_results.jsonl', help="Results, one JSON line per payload")
+    parser.add_argument('--timings', default='bulk_timings.csv', help="Per-payload timings CSV")
+    parser.add_argument('--processes', type=int, default=max(1, (os.cpu_count() or 2) // 4))
+    parser.add_argument('--solver-workers', type=int, default=None, help="CP-SAT workers per solve (default: CPUs / processes)")
+    parser.add_argument('--time-limit', type=float, default=None, help="Override solverTimeLimit of every payload")
+    parser.add_argument('--no-chain', action='store_true', help="Solve every payload independently, without warm starts or stored history (regression replay)")
+    parser.add_argument('--include-schedules', action='store_true', help="Write full nurse schedules to the results")
+    parser.add_argument('--store', default=':memory:', help="Schedule store path for the workers (default: in-memory)")
+    parser.add_argument('--use-firestore', action='store_true', help="Read approved hard requests and constraints from Firestore")
+    parser.add_argument('--log-dir', default=None, help="Write server and solver logs here (default: discarded)")
+    parser.add_argument('--baseline', default=None, help="Earlier timings CSV to compare against")
+    parser.add_argument('--slowdown-threshold', type=float, default=1.5, help="Flag solves slower than baseline x this")
+    parser.add_argument('--objective-tolerance', type=float, default=0.05, help="Flag objectives worse than baseline by more than this fraction")
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.inputs)
+    groups = group_by_ward(payloads)
+    if args.store != ':memory:' and args.processes > 1:
+        print("WARN: several processes share one schedule store file; SQLite will serialize their writes.")
+    solver_workers = args.solver_workers or max(1, (os.cpu_count() or 1) // args.processes)
+    if args.log_dir:
+        os.makedirs(args.log_dir, exist_ok=True)
+    print(f"Solving {len(payloads)} payloads in {len(groups)} groups with {args.processes} processes x {solver_workers} solver workers.")
+
+    started = time.time()
+    timings = []
+    with open(args.output, 'w', encoding='utf-8') as results_file, \
+            ProcessPoolExecutor(max_workers=args.processes, initializer=_init_worker,
+                                initargs=(args.log_dir, args.store, solver_workers, args.use_firestore)) as pool:
+        futures = {pool.submit(solve_group, group, not args.no_chain, args.time_limit, args.include_schedules): group for group in groups}
+        for future in as_completed(futures):
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f"!!! Group {[payload_id for payload_id, _ in futures[future]]} failed: {e}")
+                continue
+            for result, timing in rows:
+                results_file.write(json.dumps(result, ensure_ascii=False, separators=(',', ':')) + '\n')
+                timings.append(timing)
+                print(f"{timing['payload_id']}: {timing['http_status']} {timing['solver_status']} objective={timing['objective']} total={timing['total_s']}s")
+
+    timings.sort(key=lambda t: (t['ward'], t['start_date'], t['payload_id']))
+    with open(args.timings, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=TIMING_COLUMNS)
+        writer.writeheader()
+        writer.writerows(timings)
+    failed = sum(1 for t in timings if t['http_status'] != 200)
+    print(f"Done in {time.time() - started:.1f}s: {len(timings) - failed} solved, {failed} failed. Results: {args.output}, timings: {args.timings}")
+    broken = [t['payload_id'] for t in timings if t['chain_broken']]
+    if broken:
+        print(f"WARN: {len(broken)} payloads ran after an earlier month of their ward failed, so their chain is broken: {broken}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(timings, args.baseline, args.slowdown_threshold, args.objective_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        print(f"{len(regressions)} regressions against {args.baseline}.")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import functools
+import time
+from shift_automaton import LABEL_OFF, LABEL_MORNING, LABEL_AFTERNOON, LABEL_NIGHT, LABEL_NA_DOUBLE, LABEL_SHIFTS, DAY_LABELS, build_automaton, start_state
+
+# Shift ids follow server.py (1 = morning, 2 = afternoon, 3 = night).
+SHIFT_MORNING, SHIFT_AFTERNOON, SHIFT_NIGHT = 1, 2, 3
+LABEL_MASKS = {label: sum(1 << i for i, has in enumerate(has_shift) if has) for label, has_shift in LABEL_SHIFTS.items()}
+
+CAPACITY_MESSAGES = {
+    'gov_exceeds_morning': "ข้าราชการ {govCount} คนต้องทำเวรเช้าวันที่ {date} แต่ต้องการเวรเช้าเพียง {required} คน",
+    'nurse_no_feasible_month': "ไม่มีรูปแบบเวรใดของพยาบาล {nurseId} ที่ผ่านวันหยุดบังคับ ข้อห้ามเวร และกฎเวรติดต่อกันได้",
+    'shift_supply_short': "วันที่ {date} มีพยาบาลที่ทำเวร{shiftName}ได้ {eligible} คน แต่ต้องการ {required} คน",
+    'day_supply_short': "วันที่ {date} มีพยาบาลที่ทำงานได้ {available} คน แต่ต้องการอย่างน้อย {needed} คน (รวมการควบเวรดึก-บ่ายแล้ว)",
+    'afternoon_night_short': "เวรบ่ายวันที่ {date} และเวรดึกวันถัดไปต้องใช้พยาบาลต่างคนกัน {needed} คน แต่มีผู้ทำได้ {eligible} คน",
+    'window_off_days_short': "ช่วงวันที่ {date} ถึง {endDate} ต้องการวันทำงานอย่างน้อย {needed} คน-วัน แต่ทำได้สูงสุด {available} คน-วันเมื่อต้องมีวันหยุด {minOff} วันในทุก {window} วัน",
+    'month_shifts_short': "ทั้งเดือนต้องการ {needed} เวร แต่พยาบาลทำได้รวมสูงสุด {available} เวรตามกฎเวรติดต่อกัน",
+    'month_shifts_excess': "กฎวันหยุดติดต่อกันบังคับให้พยาบาลทำงานรวมอย่างน้อย {forced} เวร แต่ทั้งเดือนต้องการเพียง {needed} เวร",
+    'month_shift_type_short': "ทั้งเดือนต้องการเวร{shiftName} {needed} เวร แต่พยาบาลทำได้รวมสูงสุด {available} เวร",
+    'month_doubles_short': "ต้องควบเวรดึก-บ่ายอย่างน้อย {needed} ครั้ง แต่พยาบาลควบเวรได้รวมสูงสุด {available} ครั้ง",
+    'doubles_required': "วันที่ {date} ต้องควบเวรดึก-บ่ายอย่างน้อย {needed} ครั้ง",
+    'no_spare_supply': "วันที่ {date} มีพยาบาลที่ทำเวร{shiftName}ได้พอดีกับที่ต้องการ ({required} คน)",
+    'target_off_days_unreachable': "ไม่สามารถให้ทุกคนหยุดครบ {target} วันได้ ต้องใช้อย่างน้อย {needed} คน-วัน แต่มีได้สูงสุด {available} คน-วัน",
+}
+SHIFT_NAMES_TH = {SHIFT_MORNING: 'เช้า', SHIFT_AFTERNOON: 'บ่าย', SHIFT_NIGHT: 'ดึก'}
+SHIFT_KEYS = {SHIFT_MORNING: 'morning', SHIFT_AFTERNOON: 'afternoon', SHIFT_NIGHT: 'night'}
+
+
+def _issue(code, **fields):
+    issue = {'code': code, 'message': CAPACITY_MESSAGES[code].format(**fields)}
+    issue.update((key, fields[key]) for key in ('date', 'shift', 'nurseId') if key in fields)
+    return issue
+
+
+@functools.lru_cache(maxsize=1024)
+def nurse_month_bounds(start, allowed_by_day, max_consecutive_shifts, max_consecutive_off, max_same_shift):
+    """Forward/backward pass over the consecutive-rule automaton for one nurse.
+
+    `allowed_by_day` holds the day labels the nurse's hard rules allow on each day. Returns None when no
+    label sequence satisfies the rules, otherwise ((max shifts, min shifts, max mornings, max afternoons,
+    max nights, max doubles), labels that lie on some valid month for each day). Each bound is taken
+    over all valid months separately.
+    """
+    start_id, _, transitions = build_automaton(start, max_consecutive_shifts, max_consecutive_off, max_same_shift)
+    by_state = {}
+    for state_id, label, next_id in transitions:
+        if label in LABEL_SHIFTS:
+            by_state.setdefault(state_id, []).append((label, next_id))
+    # Every automaton state has an end transition, so any state reached after the last day is accepting.
+    forward = [{start_id}]
+    for allowed in allowed_by_day:
+        forward.append({next_id for state_id in forward[-1] for label, next_id in by_state.get(state_id, ()) if label in allowed})
+        if not forward[-1]:
+            return None
+    best = {state_id: (0, 0, 0, 0, 0, 0) for state_id in forward[-1]}
+    possible_labels = []
+    for d in reversed(range(len(allowed_by_day))):
+        day_best, day_labels = {}, set()
+        for state_id in forward[d]:
+            for label, next_id in by_state.get(state_id, ()):
+                after = best.get(next_id)
+                if after is None or label not in allowed_by_day[d]:
+                    continue
+                day_labels.add(label)
+                morning, afternoon, night = LABEL_SHIFTS[label]
+                count = morning + afternoon + night
+                value = (after[0] + count, after[1] + count, after[2] + morning, after[3] + afternoon, after[4] + night, after[5] + (label == LABEL_NA_DOUBLE))
+                current = day_best.get(state_id)
+                day_best[state_id] = value if current is None else (
+                    max(current[0], value[0]), min(current[1], value[1]), max(current[2], value[2]),
+                    max(current[3], value[3]), max(current[4], value[4]), max(current[5], value[5]))
+        best = day_best
+        possible_labels.append(frozenset(day_labels))
+    return best[start_id], tuple(reversed(possible_labels))
+
+
+def analyze_capacity(nurse_ids, days, gov_ids, holiday_day_numbers, required_by_shift, rules, target_off_days=0,
+                     previous_states=None, required_off_days=None, forbidden_masks=None, no_double_ids=None):
+    """Checks a schedule request against supply bounds without building a model.
+
+    Every error is a relaxation of the solver's hard rules failing, so an input with errors is proven
+    infeasible; warnings point at settings that force doubles, leave no slack or miss the off-day target.
+    Rules not modelled here (such as minimum off days per window inside one nurse's month) only make
+    the checks weaker, never wrong.
+    """
+    started = time.perf_counter()
+    errors, warnings = [], []
+    num_days = len(days)
+    days_iso = [day.isoformat() for day in days]
+    required_off_days = required_off_days or {}
+    forbidden_masks = forbidden_masks or {}
+    no_double_ids = set(no_double_ids or [])
+    max_consecutive_shifts = rules['max_consecutive_shifts']
+    max_same_shift = rules['max_consecutive_same_shift']
+    max_consecutive_off = rules['max_consecutive_off_days']
+    req_m, req_a, req_n = (required_by_shift.get(s, 0) for s in (SHIFT_MORNING, SHIFT_AFTERNOON, SHIFT_NIGHT))
+
+    gov_count = sum(1 for nurse_id in nurse_ids if nurse_id in gov_ids)
+    non_gov_ids = [nurse_id for nurse_id in nurse_ids if nurse_id not in gov_ids]
+    gov_morning = [0 if day.weekday() >= 5 or day.day in holiday_day_numbers else gov_count for day in days]
+    for d in range(num_days):
+        if gov_morning[d] > req_m:
+            errors.append(_issue('gov_exceeds_morning', date=days_iso[d], govCount=gov_morning[d], required=req_m))
+    required_m = [max(0, req_m - gov_morning[d]) for d in range(num_days)]
+
+    labels_by_nurse, month_bounds = {}, {}
+    for nurse_id in non_gov_ids:
+        off_days = required_off_days.get(nurse_id, ())
+        forbidden = forbidden_masks.get(nurse_id, 0)
+        labels = frozenset(label for label in DAY_LABELS if not LABEL_MASKS[label] & forbidden
+                           and not (label == LABEL_NA_DOUBLE and nurse_id in no_double_ids))
+        allowed_by_day = tuple(frozenset([LABEL_OFF]) if d in off_days else labels for d in range(num_days))
+        start = start_state((previous_states or {}).get(nurse_id) or {}, max_consecutive_shifts, max_same_shift)
+        result = nurse_month_bounds(start, allowed_by_day, max_consecutive_shifts, max_consecutive_off, max_same_shift)
+        if result is None:
+            errors.append(_issue('nurse_no_feasible_month', nurseId=nurse_id))
+            continue
+        month_bounds[nurse_id], labels_by_nurse[nurse_id] = result
+
+    day_reports, can_afternoon, can_night, can_work = [], [], [], []
+    min_doubles_needed = 0
+    for d in range(num_days):
+        day_labels = [labels[d] for labels in labels_by_nurse.values()]
+        can_afternoon.append({nurse_id for nurse_id, labels in labels_by_nurse.items() if labels[d] & {LABEL_AFTERNOON, LABEL_NA_DOUBLE}})
+        can_night.append({nurse_id for nurse_id, labels in labels_by_nurse.items() if labels[d] & {LABEL_NIGHT, LABEL_NA_DOUBLE}})
+        can_work.append(sum(1 for labels in day_labels if labels - {LABEL_OFF}))
+        eligible = {
+            SHIFT_MORNING: sum(1 for labels in day_labels if LABEL_MORNING in labels),
+            SHIFT_AFTERNOON: len(can_afternoon[d]), SHIFT_NIGHT: len(can_night[d]),
+        }
+        double_capable = sum(1 for labels in day_labels if LABEL_NA_DOUBLE in labels)
+        required = {SHIFT_MORNING: required_m[d], SHIFT_AFTERNOON: req_a, SHIFT_NIGHT: req_n}
+        for s in (SHIFT_MORNING, SHIFT_AFTERNOON, SHIFT_NIGHT):
+            if eligible[s] < required[s]:
+                errors.append(_issue('shift_supply_short', date=days_iso[d], shift=SHIFT_KEYS[s], shiftName=SHIFT_NAMES_TH[s], eligible=eligible[s], required=required[s]))
+            elif eligible[s] == required[s] and required[s] > 0:
+                warnings.append(_issue('no_spare_supply', date=days_iso[d], shift=SHIFT_KEYS[s], shiftName=SHIFT_NAMES_TH[s], required=required[s]))
+        # Morning nurses work one shift; an afternoon and a night can share a nurse only through a double.
+        needed = required_m[d] + max(req_a, req_n, req_a + req_n - double_capable)
+        if can_work[d] < needed:
+            errors.append(_issue('day_supply_short', date=days_iso[d], available=can_work[d], needed=needed))
+        doubles_needed = max(0, required_m[d] + req_a + req_n - can_work[d])
+        if doubles_needed and can_work[d] >= needed:
+            warnings.append(_issue('doubles_required', date=days_iso[d], needed=doubles_needed))
+        min_doubles_needed += doubles_needed
+        day_reports.append({
+            'date': days_iso[d], 'required': {SHIFT_KEYS[s]: required[s] for s in required}, 'govMorning': gov_morning[d],
+            'eligible': {SHIFT_KEYS[s]: eligible[s] for s in eligible}, 'doubleCapable': double_capable,
+            'available': can_work[d], 'minDoubles': doubles_needed,
+        })
+
+    # A nurse on an afternoon cannot take the next night, so both shifts need distinct nurses.
+    for d in range(num_days - 1):
+        if req_a and req_n and len(can_afternoon[d] | can_night[d + 1]) < req_a + req_n:
+            errors.append(_issue('afternoon_night_short', date=days_iso[d], needed=req_a + req_n, eligible=len(can_afternoon[d] | can_night[d + 1])))
+
+    window, min_off = rules.get('window_size_for_min_off', 0), rules.get('min_off_days_in_window', 0)
+    if min_off > 0 and window <= num_days:
+        for d_start in range(num_days - window + 1):
+            needed = sum(required_m[d] + max(req_a, req_n) for d in range(d_start, d_start + window))
+            available = sum(min(window - min_off, sum(1 for d in range(d_start, d_start + window) if labels[d] - {LABEL_OFF}))
+                            for labels in labels_by_nurse.values())
+            if available < needed:
+                errors.append(_issue('window_off_days_short', date=days_iso[d_start], endDate=days_iso[d_start + window - 1],
+                                     needed=needed, available=available, minOff=min_off, window=window))
+                break
+
+    demand_shifts = sum(required_m) + num_days * (req_a + req_n)
+    totals = [sum(bounds[i] for bounds in month_bounds.values()) for i in range(6)]
+    if len(month_bounds) == len(non_gov_ids):
+        # Per-nurse bounds only add up to a month bound when every nurse has one.
+        if totals[0] < demand_shifts:
+            errors.append(_issue('month_shifts_short', needed=demand_shifts, available=totals[0]))
+        if totals[1] > demand_shifts:
+            errors.append(_issue('month_shifts_excess', needed=demand_shifts, forced=totals[1]))
+        for s, needed, available in ((SHIFT_MORNING, sum(required_m), totals[2]), (SHIFT_AFTERNOON, num_days * req_a, totals[3]), (SHIFT_NIGHT, num_days * req_n, totals[4])):
+            if available < needed:
+                errors.append(_issue('month_shift_type_short', shift=SHIFT_KEYS[s], shiftName=SHIFT_NAMES_TH[s], needed=needed, available=available))
+        if totals[5] < min_doubles_needed:
+            errors.append(_issue('month_doubles_short', needed=min_doubles_needed, available=totals[5]))
+
+    min_working_days = sum(required_m) + num_days * max(req_a, req_n)
+    max_working_days = len(non_gov_ids) * max(0, num_days - target_off_days)
+    if target_off_days > 0 and min_working_days > max_working_days:
+        warnings.append(_issue('target_off_days_unreachable', target=target_off_days, needed=min_working_days, available=max_working_days))
+
+    return {
+        'feasible': not errors, 'errors': errors, 'warnings': warnings, 'days': day_reports,
+        'bounds': {
+            'demandShifts': demand_shifts, 'maxShifts': totals[0], 'minShifts': totals[1],
+            'nightsNeeded': num_days * req_n, 'maxNights': totals[4],
+            'minDoublesNeeded': min_doubles_needed, 'maxDoubles': totals[5],
+        },
+        'elapsedMs': round((time.perf_counter() - started) * 1000, 3),
+    }
@@ -0,0 +1,19 @@
+import os
+
+# Gunicorn reads this file from the working directory: run `gunicorn server:app` from backend/.
+#
+# Solve coalescing (identical /generate-schedule payloads share one solve) and the solve memory budget
+# live in process memory, so they only cover every request when all requests reach one process. Run a
+# single worker with threads; CP-SAT releases the GIL while solving, so threads still solve in parallel.
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = 1
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+
+def when_ready(server):
+    if server.cfg.workers > 1 or server.cfg.worker_class_str != 'gthread':
+        server.log.warning(
+            "Running %d %s workers: solve coalescing and the solve memory budget are per process, so duplicate "
+            "solves on different workers are not coalesced and total solve memory is not bounded. Use 1 gthread worker.",
+            server.cfg.workers, server.cfg.worker_class_str)
@@ -0,0 +1,99 @@
+import threading
+import time
+
+# Memory model calibrated against CP-SAT solves of synthetic wards (10-80 nurses, 31-90 days):
+# the model proto is about 820 bytes per nurse-day, building it costs ~15x the proto size, and the
+# solve adds a fixed cost per worker plus a per-worker copy of the (presolved) model.
+PROTO_BYTES_PER_NURSE_DAY = 820
+BUILD_MB_PER_PROTO_MB = 15
+SOLVE_BASE_MB = 10
+SOLVE_MB_PER_WORKER = 4
+SOLVE_MB_PER_PROTO_MB = 40
+SOLVE_MB_PER_PROTO_MB_PER_WORKER = 20
+
+
+def current_rss_mb():
+    """Resident set size of this process from /proc, or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def estimate_solve_memory_mb(num_nurses, num_days, num_workers):
+    proto_mb = num_nurses * num_days * PROTO_BYTES_PER_NURSE_DAY / 1e6
+    build_mb = proto_mb * BUILD_MB_PER_PROTO_MB
+    solve_mb = SOLVE_BASE_MB + SOLVE_MB_PER_WORKER * num_workers + proto_mb * (SOLVE_MB_PER_PROTO_MB + SOLVE_MB_PER_PROTO_MB_PER_WORKER * num_workers)
+    return round(build_mb + solve_mb, 1)
+
+
+class SolveMemoryBudget:
+    """Process-wide memory reservations for concurrent solves.
+
+    A solve reserves its estimated footprint before building the model, using the most workers (up to
+    max_workers) that fit both the per-job limit and what is left of the process budget.
+    """
+
+    def __init__(self, total_mb, per_job_mb):
+        self.total_mb = total_mb
+        self.per_job_mb = per_job_mb
+        self.reserved_mb = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, num_nurses, num_days, max_workers):
+        """Returns (workers, reserved MB, reason); workers is 0 when nothing fits and reason is 'too_large' or 'busy'."""
+        minimum_mb = estimate_solve_memory_mb(num_nurses, num_days, 1)
+        if minimum_mb > self.per_job_mb:
+            return 0, minimum_mb, 'too_large'
+        with self._lock:
+            available_mb = min(self.per_job_mb, self.total_mb - self.reserved_mb)
+            for workers in range(max_workers, 0, -1):
+                estimate_mb = estimate_solve_memory_mb(num_nurses, num_days, workers)
+                if estimate_mb <= available_mb:
+                    self.reserved_mb += estimate_mb
+                    return workers, estimate_mb, None
+        return 0, minimum_mb, 'busy'
+
+    def release(self, reserved_mb):
+        with self._lock:
+            self.reserved_mb = max(0.0, self.reserved_mb - reserved_mb)
+
+
+class RssSampler:
+    """Samples process RSS in a background thread; peak_mb is the highest value seen while running.
+
+    RSS is per process, so with concurrent solves the peak includes the other solves' memory too.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.start_mb = None
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss_mb = current_rss_mb()
+        if rss_mb is not None and (self.peak_mb is None or rss_mb > self.peak_mb):
+            self.peak_mb = rss_mb
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return False
@@ -0,0 +1,270 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DAY_OF_WEEK_REQUEST_TYPES = {'no_mondays': 0, 'no_tuesdays': 1, 'no_wednesdays': 2, 'no_thursdays': 3, 'no_fridays': 4, 'no_saturdays': 5, 'no_sundays': 6}
+REQUEST_TYPE_SPECIFIC_SHIFTS = 'request_specific_shifts_on_days'
+
+# Profile keys and their minimum values. Penalty weights live under "penalties".
+PROFILE_RULE_MINIMUMS = {
+    'maxConsecutiveSameShift': 1, 'maxConsecutiveOffDays': 1, 'minOffDaysInWindow': 0, 'windowSizeForMinOff': 1,
+}
+PROFILE_PENALTY_KEYS = [
+    'offDayUnderTarget', 'endingMonthAtMaxConsecutive', 'totalShiftImbalance', 'offDayImbalance', 'shiftTypeImbalance',
+    'perNADouble', 'nightToMorningTransition', 'baseSoftViolation', 'bonusHighPriority', 'bonusCarryOver',
+]
+
+RULE_HANDLERS = {}
+RULE_VALIDATORS = {}
+
+
+def rule_handler(*rule_types, validate=None):
+    """Registers a handler that emits the constraints of one rule type for all of its items in one call.
+
+    `validate(value)` raises ValueError for a malformed item value; apply_rules drops such items before
+    the handler runs, so handlers can assume well-formed values.
+    """
+    def register(handler):
+        for rule_type in rule_types:
+            RULE_HANDLERS[rule_type] = handler
+            if validate is not None:
+                RULE_VALIDATORS[rule_type] = validate
+        return handler
+    return register
+
+
+class RuleProfile:
+    """A validated ward rule profile. Instances are shared between solves and must not be mutated."""
+
+    def __init__(self, values):
+        self.values = values
+        self.max_consecutive_same_shift = values['maxConsecutiveSameShift']
+        self.max_consecutive_off_days = values['maxConsecutiveOffDays']
+        self.min_off_days_in_window = values['minOffDaysInWindow']
+        self.window_size_for_min_off = values['windowSizeForMinOff']
+        self.penalties = values['penalties']
+        self.disabled_rule_types = frozenset(values['disabledRuleTypes'])
+
+    def to_dict(self):
+        return json.loads(json.dumps(self.values))
+
+
+# Profiles arrive in requests, so the compiled-profile cache is a bounded LRU.
+COMPILED_PROFILE_CACHE_SIZE = 128
+_compiled_profiles = OrderedDict()
+_compiled_profiles_lock = threading.Lock()
+
+
+def compile_rule_profile(profile_input, defaults):
+    """Merges a ward profile over the defaults, validates it and returns a cached RuleProfile.
+
+    Raises ValueError for unknown keys, unknown rule types or out-of-range values.
+    """
+    profile_input = profile_input or {}
+    cache_key = json.dumps([profile_input, defaults], sort_keys=True, default=str)
+    with _compiled_profiles_lock:
+        cached = _compiled_profiles.get(cache_key)
+        if cached is not None:
+            _compiled_profiles.move_to_end(cache_key)
+            return cached
+
+    if not isinstance(profile_input, dict): raise ValueError("Invalid rule profile, expected an object")
+    unknown = set(profile_input) - set(PROFILE_RULE_MINIMUMS) - {'penalties', 'disabledRuleTypes'}
+    if unknown: raise ValueError(f"Unknown rule profile keys: {sorted(unknown)}")
+
+    values = {}
+    for key, minimum in PROFILE_RULE_MINIMUMS.items():
+        value = profile_input.get(key, defaults[key])
+        if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+            raise ValueError(f"Rule profile '{key}' must be an integer >= {minimum}")
+        values[key] = value
+
+    penalties_input = profile_input.get('penalties', {})
+    if not isinstance(penalties_input, dict): raise ValueError("Rule profile 'penalties' must be an object")
+    unknown = set(penalties_input) - set(PROFILE_PENALTY_KEYS)
+    if unknown: raise ValueError(f"Unknown penalty keys: {sorted(unknown)}")
+    values['penalties'] = {}
+    for key in PROFILE_PENALTY_KEYS:
+        value = penalties_input.get(key, defaults['penalties'][key])
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f"Penalty '{key}' must be an integer >= 0")
+        values['penalties'][key] = value
+
+    disabled = profile_input.get('disabledRuleTypes', defaults.get('disabledRuleTypes', []))
+    if not isinstance(disabled, list) or any(not isinstance(rule_type, str) or rule_type not in RULE_HANDLERS for rule_type in disabled):
+        raise ValueError(f"'disabledRuleTypes' must list known rule types: {sorted(RULE_HANDLERS)}")
+    values['disabledRuleTypes'] = sorted(disabled)
+
+    profile = RuleProfile(values)
+    with _compiled_profiles_lock:
+        _compiled_profiles[cache_key] = profile
+        while len(_compiled_profiles) > COMPILED_PROFILE_CACHE_SIZE:
+            _compiled_profiles.popitem(last=False)
+    return profile
+
+
+class RuleContext:
+    """Model handles shared by rule handlers, plus per-rule build statistics."""
+
+    def __init__(self, model, shifts, is_off, is_working, days, shift_ids, request_shift_codes):
+        self.model = model
+        self.shifts = shifts
+        self.is_off = is_off
+        self.is_working = is_working
+        self.days = days
+        self.day_indices = range(len(days))
+        self.morning, self.afternoon, self.night = shift_ids
+        self.request_shift_codes = request_shift_codes
+        self.days_by_weekday = {wd: [d for d, day in enumerate(days) if day.weekday() == wd] for wd in range(7)}
+        self.day_by_number = {day.day: d for d, day in reversed(list(enumerate(days)))}
+        self.penalty_terms = []
+        self.stats = {}
+        self._na_double = {}
+
+    def na_double(self, n, d):
+        """Shared literal for 'nurse n works both night and afternoon on day d'."""
+        key = (n, d)
+        if key not in self._na_double:
+            night, afternoon = self.shifts[(n, d, self.night)], self.shifts[(n, d, self.afternoon)]
+            na = self.model.NewBoolVar(f'na_n{n}_d{d}')
+            self.model.AddImplication(na, night)
+            self.model.AddImplication(na, afternoon)
+            self.model.AddBoolOr([night.Not(), afternoon.Not(), na])
+            self._na_double[key] = na
+        return self._na_double[key]
+
+    def penalize(self, weight, var):
+        self.penalty_terms.append((weight, var))
+
+    @contextmanager
+    def timed(self, name):
+        """Records build time, constraints added and penalty terms added under `name`."""
+        constraints_before = len(self.model.Proto().constraints)
+        penalties_before = len(self.penalty_terms)
+        started = time.perf_counter()
+        yield
+        entry = self.stats.setdefault(name, {"buildMs": 0.0, "constraints": 0, "penaltyTerms": 0})
+        entry["buildMs"] = round(entry["buildMs"] + (time.perf_counter() - started) * 1000, 3)
+        entry["constraints"] += len(self.model.Proto().constraints) - constraints_before
+        entry["penaltyTerms"] += len(self.penalty_terms) - penalties_before
+
+
+def parse_day_numbers(value):
+    return [int(dn) for dn in value if isinstance(dn, (str, int)) and str(dn).isdigit() and 1 <= int(dn) <= 31]
+
+
+def validate_rule_item(rule_type, item):
+    """Raises ValueError when an item is not (nurse index, value, weight, tag) with a valid value for its rule type."""
+    if not isinstance(item, tuple) or len(item) != 4:
+        raise ValueError("expected (nurse index, value, weight, tag)")
+    _, value, weight, _ = item
+    if weight is not None and (isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight < 0):
+        raise ValueError(f"invalid weight {weight!r}")
+    validate = RULE_VALIDATORS.get(rule_type)
+    if validate is not None:
+        validate(value)
+
+
+def apply_rules(ctx, items_by_type, profile):
+    """Validates every item, then runs each rule type's handler once on its valid items.
+
+    Items are (nurse index, value, weight, tag); a weight of None makes the item a hard constraint. A
+    malformed item is logged and dropped without affecting the other items of its type.
+    """
+    valid_by_type, invalid_counts = {}, {}
+    for rule_type, items in items_by_type.items():
+        if RULE_HANDLERS.get(rule_type) is None or rule_type in profile.disabled_rule_types:
+            continue
+        valid_by_type[rule_type], invalid_counts[rule_type] = [], 0
+        for item in items:
+            try:
+                validate_rule_item(rule_type, item)
+            except (ValueError, TypeError) as e:
+                invalid_counts[rule_type] += 1
+                print(f"!ERR invalid '{rule_type}' item {item!r}: {e}")
+                continue
+            valid_by_type[rule_type].append(item)
+
+    for rule_type, items in valid_by_type.items():
+        with ctx.timed(rule_type):
+            RULE_HANDLERS[rule_type](ctx, rule_type, items)
+        ctx.stats[rule_type].update(items=len(items), invalidItems=invalid_counts[rule_type])
+
+
+def validate_day_numbers(value):
+    if not isinstance(value, list):
+        raise ValueError("expected a list of day numbers")
+
+
+def validate_specific_shifts(value):
+    if not isinstance(value, list):
+        raise ValueError("expected a list of {day, shift_type} entries")
+    for sub_req in value:
+        if not isinstance(sub_req, dict):
+            raise ValueError(f"expected a {{day, shift_type}} entry, got {sub_req!r}")
+        for key in ('day', 'shift_type'):
+            if sub_req.get(key) is not None and (isinstance(sub_req[key], bool) or not isinstance(sub_req[key], int)):
+                raise ValueError(f"'{key}' must be an integer, got {sub_req[key]!r}")
+
+
+@rule_handler(*DAY_OF_WEEK_REQUEST_TYPES)
+def weekday_off_rule(ctx, rule_type, items):
+    target_days = ctx.days_by_weekday[DAY_OF_WEEK_REQUEST_TYPES[rule_type]]
+    for n, _, weight, _ in items:
+        for d in target_days:
+            if weight is None: ctx.model.Add(ctx.is_off[(n, d)] == 1)
+            else: ctx.penalize(weight, ctx.is_working[(n, d)])
+
+
+@rule_handler('no_morning_shifts', 'no_afternoon_shifts', 'no_night_shifts')
+def shift_type_ban_rule(ctx, rule_type, items):
+    shift_type = {'no_morning_shifts': ctx.morning, 'no_afternoon_shifts': ctx.afternoon, 'no_night_shifts': ctx.night}[rule_type]
+    for n, _, weight, _ in items:
+        for d in ctx.day_indices:
+            if weight is None: ctx.model.Add(ctx.shifts[(n, d, shift_type)] == 0)
+            else: ctx.penalize(weight, ctx.shifts[(n, d, shift_type)])
+
+
+@rule_handler('no_night_afternoon_double')
+def night_afternoon_double_ban_rule(ctx, rule_type, items):
+    for n, _, weight, _ in items:
+        for d in ctx.day_indices:
+            if weight is None: ctx.model.Add(ctx.shifts[(n, d, ctx.night)] + ctx.shifts[(n, d, ctx.afternoon)] <= 1)
+            else: ctx.penalize(weight, ctx.na_double(n, d))
+
+
+@rule_handler('no_specific_days', validate=validate_day_numbers)
+def specific_days_off_rule(ctx, rule_type, items):
+    for n, value, weight, _ in items:
+        for day_num in set(parse_day_numbers(value)):
+            for d, day in enumerate(ctx.days):
+                if day.day != day_num: continue
+                if weight is None: ctx.model.Add(ctx.is_off[(n, d)] == 1)
+                else: ctx.penalize(weight, ctx.is_working[(n, d)])
+
+
+@rule_handler(REQUEST_TYPE_SPECIFIC_SHIFTS, validate=validate_specific_shifts)
+def specific_shifts_request_rule(ctx, rule_type, items):
+    for n, value, weight, tag in items:
+        if weight is None or not value: continue
+        not_met_literals, always_violated = [], False
+        for sub_req in value:
+            d = ctx.day_by_number.get(sub_req.get('day'))
+            code = sub_req.get('shift_type')
+            if d is None or code is None: continue
+            requested = ctx.request_shift_codes.get(code)
+            if requested is None:
+                always_violated = True
+            elif len(requested) == 1:
+                not_met_literals.append(ctx.shifts[(n, d, requested[0])].Not())
+            else:
+                not_met_literals.append(ctx.na_double(n, d).Not())
+        if not not_met_literals and not always_violated: continue
+        violated = ctx.model.NewBoolVar(f'srs_violated_n{n}_{tag}')
+        for literal in not_met_literals:
+            ctx.model.AddImplication(literal, violated)
+        if always_violated:
+            ctx.model.Add(violated == 1)
+        ctx.penalize(weight, violated)
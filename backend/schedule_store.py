@@ -0,0 +1,312 @@
+import sqlite3
+import json
+import hashlib
+import threading
+import time
+
+# Per-nurse aggregate fields, as (API key, column name).
+STAT_FIELDS = [
+    ("morning", "morning"), ("afternoon", "afternoon"), ("night", "night"), ("total", "total"),
+    ("nightAfternoonDouble", "na_doubles"), ("daysOff", "days_off"),
+    ("weekendShifts", "weekend_shifts"), ("holidayShifts", "holiday_shifts"),
+    ("requestsTotal", "requests_total"), ("requestsMet", "requests_met"),
+]
+STAT_COLUMNS = [column for _, column in STAT_FIELDS]
+
+# Each nurse-day cell is stored as a 3-bit mask: bit (shift - 1) is set when the nurse works that shift.
+BITS_PER_CELL = 3
+CELL_MASK = (1 << BITS_PER_CELL) - 1
+
+# Largest page list_versions returns; SQLite treats a negative LIMIT as no limit, so the range is checked.
+MAX_LIST_VERSIONS = 500
+
+
+def compute_input_hash(data):
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def shifts_to_mask(shift_list):
+    mask = 0
+    for s in shift_list or []:
+        mask |= 1 << (int(s) - 1)
+    return mask
+
+
+def mask_to_shifts(mask):
+    return [s for s in range(1, BITS_PER_CELL + 1) if mask & (1 << (s - 1))]
+
+
+def pack_cells(masks):
+    packed = 0
+    for i, mask in enumerate(masks):
+        packed |= (mask & CELL_MASK) << (i * BITS_PER_CELL)
+    num_bytes = (len(masks) * BITS_PER_CELL + 7) // 8
+    return packed.to_bytes(num_bytes, 'little')
+
+
+def unpack_cells(blob, num_cells):
+    packed = int.from_bytes(blob, 'little')
+    return [(packed >> (i * BITS_PER_CELL)) & CELL_MASK for i in range(num_cells)]
+
+
+class ScheduleStore:
+    """Versioned store of solved schedules, kept as bit-packed nurse x day masks in SQLite."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS schedule_versions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ward TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    input_hash TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    nurse_ids TEXT NOT NULL,
+                    days TEXT NOT NULL,
+                    cells BLOB NOT NULL,
+                    params TEXT NOT NULL,
+                    solver_stats TEXT NOT NULL,
+                    published_at REAL
+                )""")
+            version_columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(schedule_versions)")}
+            if "published_at" not in version_columns:
+                self._conn.execute("ALTER TABLE schedule_versions ADD COLUMN published_at REAL")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_versions_ward_start ON schedule_versions (ward, start_date, id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_versions_input_hash ON schedule_versions (input_hash)")
+            stat_columns_sql = ", ".join(f"{column} INTEGER NOT NULL DEFAULT 0" for column in STAT_COLUMNS)
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS nurse_month_stats (
+                    ward TEXT NOT NULL, year INTEGER NOT NULL, month INTEGER NOT NULL, nurse_id TEXT NOT NULL,
+                    version_id INTEGER, {stat_columns_sql},
+                    PRIMARY KEY (ward, year, month, nurse_id)
+                )""")
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS nurse_year_stats (
+                    ward TEXT NOT NULL, year INTEGER NOT NULL, nurse_id TEXT NOT NULL, {stat_columns_sql},
+                    PRIMARY KEY (ward, year, nurse_id)
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS rule_profiles (
+                    ward TEXT PRIMARY KEY, profile TEXT NOT NULL, updated_at REAL NOT NULL
+                )""")
+
+    def _insert_version(self, ward, start_date, end_date, input_hash, nurse_ids, days_iso, nurse_shifts, params, solver_stats, published=False):
+        masks = []
+        for nurse_id in nurse_ids:
+            shifts_by_day = nurse_shifts.get(nurse_id, {})
+            for day_iso in days_iso:
+                masks.append(shifts_to_mask(shifts_by_day.get(day_iso, [])))
+        cur = self._conn.execute(
+            "INSERT INTO schedule_versions (ward, start_date, end_date, input_hash, created_at, nurse_ids, days, cells, params, solver_stats, published_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (ward, start_date, end_date, input_hash, time.time(), json.dumps(nurse_ids), json.dumps(days_iso),
+             pack_cells(masks), json.dumps(params), json.dumps(solver_stats), time.time() if published else None))
+        return cur.lastrowid
+
+    def save_version(self, ward, start_date, end_date, input_hash, nurse_ids, days_iso, nurse_shifts, params, solver_stats):
+        with self._lock, self._conn:
+            return self._insert_version(ward, start_date, end_date, input_hash, nurse_ids, days_iso, nurse_shifts, params, solver_stats)
+
+    def publish_version(self, version_id, year, month, stats_by_nurse):
+        """Marks a solved version as the ward's saved schedule and replaces its month stats with stats_by_nurse.
+
+        Drafts never touch the aggregates; only publishing does. Returns False when the version does not exist.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute("SELECT ward FROM schedule_versions WHERE id = ?", (version_id,)).fetchone()
+            if row is None:
+                return False
+            self._conn.execute("UPDATE schedule_versions SET published_at = ? WHERE id = ?", (time.time(), version_id))
+            self._record_month_stats(row["ward"], year, month, version_id, stats_by_nurse, True)
+            return True
+
+    def save_derived_version(self, base_version, nurse_shifts, solver_stats, year, month, stats_by_nurse, replace_all=False):
+        """Saves an edited copy of a published base_version, published, with its month stats in one write transaction.
+
+        Returns the new version id, or None when base_version is no longer the latest published version for
+        its ward and start date (another edit was saved first). BEGIN IMMEDIATE also serializes other
+        processes sharing the database file.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            latest = self._conn.execute(
+                "SELECT id FROM schedule_versions WHERE ward = ? AND start_date = ? AND published_at IS NOT NULL ORDER BY id DESC LIMIT 1",
+                (base_version["ward"], base_version["startDate"])).fetchone()
+            if latest is None or latest["id"] != base_version["id"]:
+                return None
+            version_id = self._insert_version(
+                base_version["ward"], base_version["startDate"], base_version["endDate"], base_version["inputHash"],
+                base_version["nurseIds"], base_version["days"], nurse_shifts, base_version["params"], solver_stats, published=True)
+            self._record_month_stats(base_version["ward"], year, month, version_id, stats_by_nurse, replace_all)
+            return version_id
+
+    def _row_to_version(self, row, include_cells):
+        version = {
+            "id": row["id"], "ward": row["ward"], "startDate": row["start_date"], "endDate": row["end_date"],
+            "inputHash": row["input_hash"], "createdAt": row["created_at"], "publishedAt": row["published_at"],
+            "params": json.loads(row["params"]), "solverStats": json.loads(row["solver_stats"]),
+        }
+        if include_cells:
+            nurse_ids = json.loads(row["nurse_ids"])
+            days_iso = json.loads(row["days"])
+            version["nurseIds"] = nurse_ids
+            version["days"] = days_iso
+            version["masks"] = unpack_cells(row["cells"], len(nurse_ids) * len(days_iso))
+        return version
+
+    def get_version(self, version_id, include_cells=True):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM schedule_versions WHERE id = ?", (version_id,)).fetchone()
+        return self._row_to_version(row, include_cells) if row else None
+
+    def latest_version(self, ward, start_date, include_cells=True, published_only=False):
+        published_sql = " AND published_at IS NOT NULL" if published_only else ""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT * FROM schedule_versions WHERE ward = ? AND start_date = ?{published_sql} ORDER BY id DESC LIMIT 1",
+                (ward, start_date)).fetchone()
+        return self._row_to_version(row, include_cells) if row else None
+
+    def find_version_covering(self, ward, day_iso, include_cells=True, published_only=False):
+        published_sql = " AND published_at IS NOT NULL" if published_only else ""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT * FROM schedule_versions WHERE ward = ? AND start_date <= ? AND end_date >= ?{published_sql} ORDER BY id DESC LIMIT 1",
+                (ward, day_iso, day_iso)).fetchone()
+        return self._row_to_version(row, include_cells) if row else None
+
+    def record_month_stats(self, ward, year, month, version_id, stats_by_nurse, replace_all=True):
+        """Replaces month rows for the given nurses and applies only the difference to the year-to-date rows.
+
+        With replace_all, nurses that are no longer in the month are removed as well (a full re-solve);
+        otherwise only the listed nurses are touched (e.g. after a swap).
+        """
+        with self._lock, self._conn:
+            self._record_month_stats(ward, year, month, version_id, stats_by_nurse, replace_all)
+
+    def _record_month_stats(self, ward, year, month, version_id, stats_by_nurse, replace_all):
+        old_rows = {row["nurse_id"]: row for row in self._conn.execute(
+            "SELECT * FROM nurse_month_stats WHERE ward = ? AND year = ? AND month = ?", (ward, year, month))}
+        affected = set(stats_by_nurse) | (set(old_rows) if replace_all else set())
+        for nurse_id in affected:
+            old_row = old_rows.get(nurse_id)
+            new_stats = stats_by_nurse.get(nurse_id)
+            delta = [
+                (new_stats.get(key, 0) if new_stats else 0) - (old_row[column] if old_row else 0)
+                for key, column in STAT_FIELDS
+            ]
+            if new_stats is None:
+                self._conn.execute("DELETE FROM nurse_month_stats WHERE ward = ? AND year = ? AND month = ? AND nurse_id = ?",
+                                   (ward, year, month, nurse_id))
+            else:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO nurse_month_stats (ward, year, month, nurse_id, version_id, {', '.join(STAT_COLUMNS)}) "
+                    f"VALUES (?, ?, ?, ?, ?, {', '.join('?' for _ in STAT_COLUMNS)})",
+                    [ward, year, month, nurse_id, version_id] + [int(new_stats.get(key, 0)) for key, _ in STAT_FIELDS])
+            if any(delta):
+                self._conn.execute(
+                    f"INSERT INTO nurse_year_stats (ward, year, nurse_id, {', '.join(STAT_COLUMNS)}) "
+                    f"VALUES (?, ?, ?, {', '.join('?' for _ in STAT_COLUMNS)}) "
+                    f"ON CONFLICT (ward, year, nurse_id) DO UPDATE SET "
+                    + ", ".join(f"{column} = {column} + excluded.{column}" for column in STAT_COLUMNS),
+                    [ward, year, nurse_id] + delta)
+
+    def _stats_rows(self, table, where, args):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT * FROM {table} WHERE {where} ORDER BY nurse_id", args).fetchall()
+        return {row["nurse_id"]: {key: row[column] for key, column in STAT_FIELDS} for row in rows}
+
+    def get_month_stats(self, ward, year, month, nurse_id=None):
+        where, args = "ward = ? AND year = ? AND month = ?", [ward, year, month]
+        if nurse_id is not None:
+            where += " AND nurse_id = ?"; args.append(nurse_id)
+        return self._stats_rows("nurse_month_stats", where, args)
+
+    def get_year_stats(self, ward, year, nurse_id=None):
+        where, args = "ward = ? AND year = ?", [ward, year]
+        if nurse_id is not None:
+            where += " AND nurse_id = ?"; args.append(nurse_id)
+        return self._stats_rows("nurse_year_stats", where, args)
+
+    def sum_month_stats(self, ward, year, month, months):
+        """Per-nurse totals over the `months` months before (year, month), crossing year boundaries."""
+        end = year * 12 + month - 1
+        sums_sql = ", ".join(f"SUM({column}) AS {column}" for column in STAT_COLUMNS)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT nurse_id, {sums_sql} FROM nurse_month_stats WHERE ward = ? AND year * 12 + month - 1 >= ? "
+                f"AND year * 12 + month - 1 < ? GROUP BY nurse_id ORDER BY nurse_id", (ward, end - months, end)).fetchall()
+        return {row["nurse_id"]: {key: row[column] for key, column in STAT_FIELDS} for row in rows}
+
+    def get_rule_profile(self, ward):
+        with self._lock:
+            row = self._conn.execute("SELECT profile FROM rule_profiles WHERE ward = ?", (ward,)).fetchone()
+        return json.loads(row["profile"]) if row else None
+
+    def save_rule_profile(self, ward, profile):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO rule_profiles (ward, profile, updated_at) VALUES (?, ?, ?)",
+                               (ward, json.dumps(profile), time.time()))
+
+    def list_versions(self, ward=None, start_date=None, limit=50):
+        """Newest versions first, without cells. Raises ValueError unless 1 <= limit <= MAX_LIST_VERSIONS."""
+        if isinstance(limit, bool) or not isinstance(limit, int) or not 1 <= limit <= MAX_LIST_VERSIONS:
+            raise ValueError(f"limit must be an integer between 1 and {MAX_LIST_VERSIONS}")
+        query, args = "SELECT * FROM schedule_versions WHERE 1 = 1", []
+        if ward is not None:
+            query += " AND ward = ?"; args.append(ward)
+        if start_date is not None:
+            query += " AND start_date = ?"; args.append(start_date)
+        query += " ORDER BY id DESC LIMIT ?"; args.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [self._row_to_version(row, include_cells=False) for row in rows]
+
+
+def version_nurse_shifts(version, nurse_ids=None):
+    """Expands a stored version into {nurseId: {dayIso: [shifts]}}, optionally for a subset of nurses."""
+    num_days = len(version["days"])
+    wanted = set(nurse_ids) if nurse_ids is not None else None
+    result = {}
+    for n_idx, nurse_id in enumerate(version["nurseIds"]):
+        if wanted is not None and nurse_id not in wanted:
+            continue
+        row = version["masks"][n_idx * num_days:(n_idx + 1) * num_days]
+        result[nurse_id] = {day_iso: mask_to_shifts(mask) for day_iso, mask in zip(version["days"], row)}
+    return result
+
+
+def diff_versions(old_version, new_version):
+    """Lists the nurse-day cells whose shifts differ between two stored versions."""
+    def cell_lookup(version):
+        num_days = len(version["days"])
+        lookup = {}
+        for n_idx, nurse_id in enumerate(version["nurseIds"]):
+            for d_idx, day_iso in enumerate(version["days"]):
+                lookup[(nurse_id, day_iso)] = version["masks"][n_idx * num_days + d_idx]
+        return lookup
+
+    old_cells, new_cells = cell_lookup(old_version), cell_lookup(new_version)
+    changes = []
+    for key in sorted(set(old_cells) | set(new_cells)):
+        old_mask, new_mask = old_cells.get(key, 0), new_cells.get(key, 0)
+        if old_mask != new_mask:
+            changes.append({"nurseId": key[0], "date": key[1], "from": mask_to_shifts(old_mask), "to": mask_to_shifts(new_mask)})
+    return changes
+
+
+def summarize_stats(stats_by_nurse, nurse_ids=None):
+    """Min/max/sum of every aggregate field over a set of nurses."""
+    rows = [stats for nurse_id, stats in stats_by_nurse.items() if nurse_ids is None or nurse_id in nurse_ids]
+    summary = {}
+    for key, _ in STAT_FIELDS:
+        values = [row.get(key, 0) for row in rows]
+        summary[key] = {"min": min(values) if values else 0, "max": max(values) if values else 0, "sum": sum(values)}
+    return summary
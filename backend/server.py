@@ -10,6 +10,14 @@ from firebase_admin import credentials, firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
 import os
 from dotenv import load_dotenv
+from schedule_store import ScheduleStore, compute_input_hash, shifts_to_mask, version_nurse_shifts, diff_versions, summarize_stats
+from swap_checker import ScheduleIndex
+from shift_automaton import start_state, add_consecutive_automaton
+from resource_limits import SolveMemoryBudget, RssSampler, current_rss_mb
+from capacity_analysis import analyze_capacity
+from rules import DAY_OF_WEEK_REQUEST_TYPES, REQUEST_TYPE_SPECIFIC_SHIFTS, RuleContext, apply_rules, compile_rule_profile
+from collections import OrderedDict
+import threading
 
 # Load environment variables
 load_dotenv()
@@ -47,6 +55,29 @@ PENALTY_BASE_SOFT_VIOLATION = 15
 BONUS_HIGH_PRIORITY = 15
 BONUS_CARRY_OVER = 5
 
+# Defaults for ward rule profiles; a ward profile (or 'ruleProfile' in the request) overrides any of these.
+DEFAULT_RULE_PROFILE = {
+    'maxConsecutiveSameShift': MAX_CONSECUTIVE_SAME_SHIFT, 'maxConsecutiveOffDays': MAX_CONSECUTIVE_OFF_DAYS,
+    'minOffDaysInWindow': MIN_OFF_DAYS_IN_WINDOW, 'windowSizeForMinOff': WINDOW_SIZE_FOR_MIN_OFF,
+    'penalties': {
+        'offDayUnderTarget': PENALTY_OFF_DAY_UNDER_TARGET, 'endingMonthAtMaxConsecutive': PENALTY_ENDING_MONTH_AT_MAX_CONSECUTIVE,
+        'totalShiftImbalance': PENALTY_TOTAL_SHIFT_IMBALANCE, 'offDayImbalance': PENALTY_OFF_DAY_IMBALANCE,
+        'shiftTypeImbalance': PENALTY_SHIFT_TYPE_IMBALANCE, 'perNADouble': PENALTY_PER_NA_DOUBLE,
+        'nightToMorningTransition': PENALTY_NIGHT_TO_MORNING_TRANSITION, 'baseSoftViolation': PENALTY_BASE_SOFT_VIOLATION,
+        'bonusHighPriority': BONUS_HIGH_PRIORITY, 'bonusCarryOver': BONUS_CARRY_OVER,
+    },
+    'disabledRuleTypes': [],
+}
+# 'linear' keeps the sliding-window sums and the consecutive-count chain; 'automaton' encodes each nurse's
+# month as one AddAutomaton constraint (see shift_automaton.py).
+CONSECUTIVE_ENCODINGS = ('linear', 'automaton')
+CONSECUTIVE_ENCODING_DEFAULT = os.getenv('CONSECUTIVE_ENCODING', 'linear')
+REQUEST_SHIFT_CODES = {
+    SHIFT_CODE_M_REQUEST: [SHIFT_MORNING], SHIFT_CODE_A_REQUEST: [SHIFT_AFTERNOON], SHIFT_CODE_N_REQUEST: [SHIFT_NIGHT],
+    SHIFT_CODE_NA_DOUBLE_REQUEST: [SHIFT_NIGHT, SHIFT_AFTERNOON],
+}
+SHIFT_TYPE_REQUEST_COUNT_KEYS = {'no_morning_shifts': 'm', 'no_afternoon_shifts': 'a', 'no_night_shifts': 'n', 'no_night_afternoon_double': 'na_double'}
+
 db_admin = None
 SERVICE_ACCOUNT_KEY_PATH = "serviceAccountKey.json"
 
@@ -66,6 +97,25 @@ except Exception as e:
     print(f"Error initializing Firebase Admin SDK: {e}. Carry-over flag updates and hard request fetching might fail.")
     db_admin = None
 
+# Per-solve memory cap and the total reserved by concurrent solves in this process. Oversized jobs run
+# with fewer workers, or are rejected when even one worker would not fit. The budget only bounds the host
+# when every solve runs in this process, which is why gunicorn runs a single gthread worker.
+SOLVER_NUM_WORKERS = int(os.getenv('SOLVER_NUM_WORKERS', 8))
+MAX_SOLVE_MEMORY_MB = int(os.getenv('MAX_SOLVE_MEMORY_MB', 2048))
+SOLVE_MEMORY_BUDGET_MB = int(os.getenv('SOLVE_MEMORY_BUDGET_MB', 4096))
+solve_memory_budget = SolveMemoryBudget(SOLVE_MEMORY_BUDGET_MB, MAX_SOLVE_MEMORY_MB)
+
+schedule_store = None
+SCHEDULE_STORE_PATH = os.getenv('SCHEDULE_STORE_PATH', 'schedule_store.db')
+SCHEDULE_STORE_FIRESTORE_MIRROR = os.getenv('SCHEDULE_STORE_FIRESTORE_MIRROR', '0') == '1'
+
+try:
+    schedule_store = ScheduleStore(SCHEDULE_STORE_PATH)
+    print(f"Schedule store opened at '{SCHEDULE_STORE_PATH}'.")
+except Exception as e:
+    print(f"Error opening schedule store at '{SCHEDULE_STORE_PATH}': {e}. Schedule versions will not be recorded.")
+    schedule_store = None
+
 
 def get_days_array(start_str, end_str):
     days = []
@@ -121,15 +171,266 @@ def get_previous_month_state_shifts(nurse_id, previous_schedule_data):
     return state
 
 
-@app.route('/generate-schedule', methods=['POST'])
-def generate_schedule_api():
+def evaluate_monthly_request_unmet(req, nurse_id, solved_grid, days, solved_totals, non_gov_ids):
+    """Returns True if a solved schedule leaves a monthly request unmet, False if met, None if it cannot be judged."""
+    rtype, rval = req.get('type'), req.get('value')
+    nurse_grid = solved_grid.get(nurse_id, {})
+
+    def shifts_on_day_number(day_num):
+        for day_obj in days:
+            if day_obj.day == day_num:
+                return nurse_grid.get(day_obj.isoformat(), [])
+        return None
+
+    if rtype == REQUEST_TYPE_SPECIFIC_SHIFTS and isinstance(rval, list) and rval:
+        for sub_req_item in rval:
+            day_shifts = shifts_on_day_number(sub_req_item.get('day'))
+            req_shift_code = sub_req_item.get('shift_type')
+            if day_shifts is None or req_shift_code is None:
+                return True
+            if req_shift_code == SHIFT_CODE_M_REQUEST: got_this_part = SHIFT_MORNING in day_shifts
+            elif req_shift_code == SHIFT_CODE_A_REQUEST: got_this_part = SHIFT_AFTERNOON in day_shifts
+            elif req_shift_code == SHIFT_CODE_N_REQUEST: got_this_part = SHIFT_NIGHT in day_shifts
+            elif req_shift_code == SHIFT_CODE_NA_DOUBLE_REQUEST: got_this_part = SHIFT_NIGHT in day_shifts and SHIFT_AFTERNOON in day_shifts
+            else: got_this_part = False
+            if not got_this_part:
+                return True
+        return False
+
+    if rtype in DAY_OF_WEEK_REQUEST_TYPES:
+        target_weekday = DAY_OF_WEEK_REQUEST_TYPES[rtype]
+        occurrences = [day_obj for day_obj in days if day_obj.weekday() == target_weekday]
+        if not occurrences:
+            return None
+        days_off = sum(1 for day_obj in occurrences if not nurse_grid.get(day_obj.isoformat(), []))
+        min_required_off = {1: 1, 2: 2, 3: 2, 4: 3}.get(len(occurrences), 4)
+        return days_off < min_required_off
+
+    if rtype == 'no_specific_days':
+        parsed_days = []
+        if isinstance(rval, list):
+            for dn_str in rval:
+                try: parsed_days.append(int(dn_str))
+                except (ValueError, TypeError): pass
+        if not 1 <= len(parsed_days) <= 2:
+            return None
+        for day_num in parsed_days:
+            day_shifts = shifts_on_day_number(day_num)
+            if day_shifts:
+                return True
+        return False
+
+    if rtype in SHIFT_TYPE_REQUEST_COUNT_KEYS:
+        count_key = SHIFT_TYPE_REQUEST_COUNT_KEYS[rtype]
+        actual = solved_totals.get(nurse_id, {}).get(count_key, 0)
+        others = [solved_totals.get(other_id, {}).get(count_key, 0) for other_id in non_gov_ids if other_id != nurse_id]
+        if not others:
+            return actual > 0
+        average_others = sum(others) / len(others)
+        if average_others == 0:
+            return actual > 0
+        return (actual / average_others) * 100 > 50.0
+
+    return None
+
+
+def evaluate_request_satisfaction(monthly_requests, nurse_id, solved_grid, days, solved_totals, non_gov_ids):
+    """Returns (requests judged, requests met, any high-priority request unmet) for one nurse.
+
+    Malformed requests are skipped like requests that cannot be judged, so they never fail a solved schedule.
+    """
+    requests_total, requests_met, unmet_high_priority = 0, 0, False
+    for monthly_req in monthly_requests or []:
+        try:
+            unmet = evaluate_monthly_request_unmet(monthly_req, nurse_id, solved_grid, days, solved_totals, non_gov_ids)
+        except Exception as eval_err:
+            print(f"WARN: Could not evaluate monthly request {monthly_req!r} for nurse {nurse_id}: {eval_err}")
+            continue
+        if unmet is None: continue
+        requests_total += 1
+        if not unmet: requests_met += 1
+        elif monthly_req.get('is_high_priority', False): unmet_high_priority = True
+    return requests_total, requests_met, unmet_high_priority
+
+
+FAIRNESS_HISTORY_METRICS = ['total', 'morning', 'afternoon', 'night', 'daysOff']
+# Stored history is a rolling window of published months, so it does not reset in January.
+FAIRNESS_HISTORY_MONTHS = int(os.getenv('FAIRNESS_HISTORY_MONTHS', 12))
+
+
+def parse_fairness_history(history_input):
+    """Validates {nurseId: {metric: surplus}} where surplus is how far above the ward the nurse already is."""
+    if history_input is None: return {}
+    if not isinstance(history_input, dict): raise ValueError("Invalid 'fairnessHistory' format")
+    history = {}
+    for nurse_id, metrics in history_input.items():
+        if not isinstance(metrics, dict): raise ValueError(f"Invalid 'fairnessHistory' entry for nurse {nurse_id}")
+        history[nurse_id] = {metric: int(metrics.get(metric, 0)) for metric in FAIRNESS_HISTORY_METRICS}
+    return history
+
+
+def stored_fairness_history(ward, year, month, nurse_ids):
+    """History in the parse_fairness_history form, from the published months before (year, month).
+
+    Totals cover the FAIRNESS_HISTORY_MONTHS months before the target month and are centred on the
+    mean of the given nurses that have stored months, so re-solving a month never counts itself or
+    later months.
+    """
+    if not schedule_store or not ward: return {}
+    totals = schedule_store.sum_month_stats(ward, year, month, FAIRNESS_HISTORY_MONTHS)
+    known_ids = [nurse_id for nurse_id in nurse_ids if nurse_id in totals]
+    history = {nurse_id: {} for nurse_id in known_ids}
+    for metric in FAIRNESS_HISTORY_METRICS:
+        values = [totals[nurse_id][metric] for nurse_id in known_ids]
+        mean = sum(values) / len(values) if values else 0
+        for nurse_id in known_ids:
+            history[nurse_id][metric] = round(totals[nurse_id][metric] - mean)
+    return history
+
+
+def add_cumulative_fairness_terms(model, name, month_totals, history_offsets, month_upper_bound, weight):
+    """Objective terms balancing each nurse's cumulative total (history + this month) across the ward.
+
+    The imbalance weights were tuned for the max-min range, so the range of the cumulative totals keeps
+    the full weight. Each nurse also pays for its distance from the ward average outside [avg, avg + 1]
+    (N * avg <= sum <= N * avg + N - 1) at weight / N, so one unit of deviation on every nurse weighs
+    about as much as one unit of range. Returns (weight, expression) objective terms.
+    """
+    num = len(month_totals)
+    lo = min(history_offsets)
+    hi = max(history_offsets) + month_upper_bound
+    cumulative = [month_totals[i] + history_offsets[i] for i in range(num)]
+    min_total, max_total = model.NewIntVar(lo, hi, f'min_{name}'), model.NewIntVar(lo, hi, f'max_{name}')
+    model.AddMinEquality(min_total, cumulative)
+    model.AddMaxEquality(max_total, cumulative)
+    avg = model.NewIntVar(lo, hi, f'avg_{name}')
+    model.Add(num * avg <= sum(cumulative))
+    model.Add(sum(cumulative) <= num * avg + num - 1)
+    deviations = []
+    for i in range(num):
+        dev = model.NewIntVar(0, hi - lo + 1, f'dev_{name}_{i}')
+        model.Add(dev >= cumulative[i] - avg - 1)
+        model.Add(dev >= avg - cumulative[i])
+        deviations.append(dev)
+    return [(weight, max_total - min_total), (max(1, round(weight / num)), sum(deviations))]
+
+
+def fetch_approved_hard_requests(start_date_str, end_date_str, nurse_ids):
+    """(nurseId, date) pairs of approved hard off-day requests in the range. Requires Firestore."""
+    results = []
+    hard_requests_ref = db_admin.collection('approvedHardRequests')
+    for i in range(0, len(nurse_ids), 30):
+        query = hard_requests_ref.where(filter=FieldFilter('date', '>=', start_date_str)) \
+                                 .where(filter=FieldFilter('date', '<=', end_date_str)) \
+                                 .where(filter=FieldFilter('nurseId', 'in', nurse_ids[i:i + 30]))
+        for req_doc in query.stream():
+            req_data = req_doc.to_dict()
+            results.append((req_data.get('nurseId'), req_data.get('date')))
+    return results
+
+
+def analyze_request_capacity(nurses_data, days, holiday_day_numbers, required_nurses_by_shift, max_consecutive_shifts, target_off_days,
+                             rule_profile, previous_month_schedule, approved_hard_requests):
+    """Runs the pre-solve capacity analysis with the same hard rules the model would get."""
+    gov_ids = {nurse['id'] for nurse in nurses_data if nurse.get('isGovernmentOfficial', False)}
+    non_gov_nurses = [nurse for nurse in nurses_data if nurse['id'] not in gov_ids]
+    required_off_days, forbidden_masks, no_double_ids = nurse_hard_rules_for_index(non_gov_nurses, days, rule_profile.disabled_rule_types)
+    day_pos = {day.isoformat(): d for d, day in enumerate(days)}
+    for req_nurse_id, req_date_str in approved_hard_requests:
+        if req_nurse_id not in gov_ids and req_date_str in day_pos:
+            required_off_days.setdefault(req_nurse_id, set()).add(day_pos[req_date_str])
+    previous_states = {}
+    if previous_month_schedule:
+        previous_states = {nurse['id']: get_previous_month_state_shifts(nurse['id'], previous_month_schedule) for nurse in non_gov_nurses}
+    rules = {
+        'max_consecutive_shifts': max_consecutive_shifts,
+        'max_consecutive_same_shift': rule_profile.max_consecutive_same_shift, 'max_consecutive_off_days': rule_profile.max_consecutive_off_days,
+        'min_off_days_in_window': rule_profile.min_off_days_in_window, 'window_size_for_min_off': rule_profile.window_size_for_min_off,
+    }
+    return analyze_capacity([nurse['id'] for nurse in nurses_data], days, gov_ids, holiday_day_numbers, required_nurses_by_shift, rules,
+                            target_off_days, previous_states, required_off_days, forbidden_masks, no_double_ids)
+
+
+def compute_nurse_month_stats(shifts_by_day, days, holiday_day_numbers):
+    stats = {"morning": 0, "afternoon": 0, "night": 0, "total": 0, "nightAfternoonDouble": 0, "daysOff": 0, "weekendShifts": 0, "holidayShifts": 0}
+    for day_obj in days:
+        day_shifts = shifts_by_day.get(day_obj.isoformat(), [])
+        if not day_shifts:
+            stats["daysOff"] += 1
+            continue
+        stats["morning"] += SHIFT_MORNING in day_shifts
+        stats["afternoon"] += SHIFT_AFTERNOON in day_shifts
+        stats["night"] += SHIFT_NIGHT in day_shifts
+        stats["total"] += len(day_shifts)
+        stats["nightAfternoonDouble"] += SHIFT_NIGHT in day_shifts and SHIFT_AFTERNOON in day_shifts
+        if day_obj.weekday() >= 5: stats["weekendShifts"] += len(day_shifts)
+        if day_obj.day in holiday_day_numbers: stats["holidayShifts"] += len(day_shifts)
+    return stats
+
+
+def version_month_stats(version, nurse_shifts, nurse_ids=None):
+    """Month stats of a grid over a stored version's days, for all nurses or the given ones.
+
+    Request satisfaction is judged from the monthly requests stored with the version; versions saved
+    before those were stored get no requestsTotal/requestsMet keys.
+    """
+    days = [datetime.date.fromisoformat(day_iso) for day_iso in version['days']]
+    params = version['params']
+    holiday_day_numbers = set(params.get('holidays', []))
+    gov_ids = set(params.get('govNurseIds', []))
+    non_gov_ids = [nurse_id for nurse_id in version['nurseIds'] if nurse_id not in gov_ids]
+    monthly_requests = params.get('monthlyRequests')
+    solved_totals = {}
+    if monthly_requests is not None:
+        # Balance requests compare a nurse with the others, so totals come from the whole grid.
+        for nurse_id in non_gov_ids:
+            nurse_days = list(nurse_shifts.get(nurse_id, {}).values())
+            solved_totals[nurse_id] = {
+                'm': sum(SHIFT_MORNING in ds for ds in nurse_days), 'a': sum(SHIFT_AFTERNOON in ds for ds in nurse_days),
+                'n': sum(SHIFT_NIGHT in ds for ds in nurse_days),
+                'na_double': sum(SHIFT_NIGHT in ds and SHIFT_AFTERNOON in ds for ds in nurse_days),
+            }
+    stats = {}
+    for nurse_id in nurse_ids if nurse_ids is not None else version['nurseIds']:
+        stats[nurse_id] = compute_nurse_month_stats(nurse_shifts.get(nurse_id, {}), days, holiday_day_numbers)
+        if monthly_requests is not None:
+            requests_total, requests_met = 0, 0
+            if nurse_id in solved_totals:
+                requests_total, requests_met, _ = evaluate_request_satisfaction(
+                    monthly_requests.get(nurse_id, []), nurse_id, nurse_shifts, days, solved_totals, non_gov_ids)
+            stats[nurse_id].update(requestsTotal=requests_total, requestsMet=requests_met)
+    return stats
+
+
+def apply_swap_to_grid(nurse_shifts, swap):
+    """Exchanges the requester's shifts on requesterDate with the target's shifts on targetDate.
+
+    Only the rows of the two nurses are copied; the rest of the grid is shared with the input.
+    """
+    requester_id, target_id = swap['requesterId'], swap['targetId']
+    new_grid = dict(nurse_shifts)
+    new_grid[requester_id] = dict(nurse_shifts.get(requester_id, {}))
+    new_grid[target_id] = dict(nurse_shifts.get(target_id, {}))
+    moves = [
+        (requester_id, target_id, swap['requesterDate'], [int(s) for s in swap.get('requesterShifts', [])]),
+        (target_id, requester_id, swap['targetDate'], [int(s) for s in swap.get('targetShifts', [])]),
+    ]
+    for from_id, to_id, day_iso, moved_shifts in moves:
+        new_grid[from_id][day_iso] = sorted(s for s in new_grid[from_id].get(day_iso, []) if s not in moved_shifts)
+        new_grid[to_id][day_iso] = sorted(set(new_grid[to_id].get(day_iso, [])) | set(moved_shifts))
+    return new_grid
+
+
+def solve_schedule_request(data, input_hash=None):
+    """Builds and solves the model for one /generate-schedule payload. Returns (response body, HTTP status).
+
+    Pass input_hash when the caller has already hashed the payload; otherwise it is computed here.
+    """
     global db_admin
     start_time = time.time()
+    reserved_memory_mb = 0
     print("\n--- Received schedule generation request ---")
     try:
-        data = request.get_json()
-        if not data: return jsonify({"error": "Invalid JSON payload"}), 400
-
         try:
             nurses_data = data['nurses']
             schedule_info = data['schedule']
@@ -137,6 +438,11 @@ def generate_schedule_api():
             monthly_soft_requests_input = data.get('monthly_soft_requests', {})
             carry_over_flags_input = data.get('carry_over_flags', {})
             holidays_input = data.get('holidays', [])
+            ward = str(data.get('ward') or '')
+            use_warm_start = bool(data.get('warmStart', True))
+            use_capacity_check = bool(data.get('capacityCheck', True))
+            fairness_history_input = parse_fairness_history(data.get('fairnessHistory'))
+            use_stored_fairness_history = bool(data.get('useStoredFairnessHistory', False))
 
             start_date_str = schedule_info['startDate'].split('T')[0]
             end_date_str = schedule_info['endDate'].split('T')[0]
@@ -147,6 +453,26 @@ def generate_schedule_api():
             MAX_CONSECUTIVE_SHIFTS_WORKED = int(data.get('maxConsecutiveShiftsWorked', 6))
             TARGET_OFF_DAYS = int(data.get('targetOffDays', 8))
             SOLVER_TIME_LIMIT = float(data.get('solverTimeLimit', 60.0))
+            rule_profile_input = data.get('ruleProfile')
+            if rule_profile_input is None and schedule_store and ward:
+                rule_profile_input = schedule_store.get_rule_profile(ward)
+            rule_profile = compile_rule_profile(rule_profile_input, DEFAULT_RULE_PROFILE)
+            MAX_CONSECUTIVE_SAME_SHIFT = rule_profile.max_consecutive_same_shift
+            MAX_CONSECUTIVE_OFF_DAYS = rule_profile.max_consecutive_off_days
+            MIN_OFF_DAYS_IN_WINDOW = rule_profile.min_off_days_in_window
+            WINDOW_SIZE_FOR_MIN_OFF = rule_profile.window_size_for_min_off
+            PENALTY_OFF_DAY_UNDER_TARGET = rule_profile.penalties['offDayUnderTarget']
+            PENALTY_ENDING_MONTH_AT_MAX_CONSECUTIVE = rule_profile.penalties['endingMonthAtMaxConsecutive']
+            PENALTY_TOTAL_SHIFT_IMBALANCE = rule_profile.penalties['totalShiftImbalance']
+            PENALTY_OFF_DAY_IMBALANCE = rule_profile.penalties['offDayImbalance']
+            PENALTY_SHIFT_TYPE_IMBALANCE = rule_profile.penalties['shiftTypeImbalance']
+            PENALTY_PER_NA_DOUBLE = rule_profile.penalties['perNADouble']
+            PENALTY_NIGHT_TO_MORNING_TRANSITION = rule_profile.penalties['nightToMorningTransition']
+            PENALTY_BASE_SOFT_VIOLATION = rule_profile.penalties['baseSoftViolation']
+            BONUS_HIGH_PRIORITY = rule_profile.penalties['bonusHighPriority']
+            BONUS_CARRY_OVER = rule_profile.penalties['bonusCarryOver']
+            consecutive_encoding = str(data.get('consecutiveEncoding', CONSECUTIVE_ENCODING_DEFAULT))
+            if consecutive_encoding not in CONSECUTIVE_ENCODINGS: raise ValueError(f"consecutiveEncoding must be one of {CONSECUTIVE_ENCODINGS}")
 
             if not isinstance(nurses_data, list) or not nurses_data: raise ValueError("Invalid or empty 'nurses' data")
             if not all('id' in n for n in nurses_data): raise ValueError("Missing 'id' in nurse data")
@@ -162,8 +488,6 @@ def generate_schedule_api():
             if REQ_MORNING < 0 or REQ_AFTERNOON < 0 or REQ_NIGHT < 0: raise ValueError("Required nurses cannot be negative")
             if MAX_CONSECUTIVE_SHIFTS_WORKED < 1: raise ValueError(f"Max consecutive SHIFTS worked must be >= 1")
             if TARGET_OFF_DAYS < 0: raise ValueError("Target off days cannot be negative")
-            if MAX_CONSECUTIVE_SAME_SHIFT < 1: raise ValueError("Internal Error: MAX_CONSECUTIVE_SAME_SHIFT")
-            if MAX_CONSECUTIVE_OFF_DAYS < 1: raise ValueError("Internal Error: MAX_CONSECUTIVE_OFF_DAYS")
             
             total_nurses_available = len(nurses_data)
             max_required = max(REQ_MORNING, REQ_AFTERNOON, REQ_NIGHT)
@@ -172,16 +496,48 @@ def generate_schedule_api():
 
         except (KeyError, TypeError, ValueError) as e:
             print(f"Data extraction/validation error: {e}\n{traceback.format_exc()}")
-            return jsonify({"error": f"ข้อมูล Input ไม่ถูกต้อง หรือไม่ครบถ้วน: {e}"}), 400
+            return {"error": f"ข้อมูล Input ไม่ถูกต้อง หรือไม่ครบถ้วน: {e}"}, 400
         except Exception as e:
             print(f"Unexpected error during data extraction: {e}\n{traceback.format_exc()}")
-            return jsonify({"error": f"เกิดข้อผิดพลาดในการประมวลผลข้อมูล Input: {e}"}), 400
+            return {"error": f"เกิดข้อผิดพลาดในการประมวลผลข้อมูล Input: {e}"}, 400
 
         days = get_days_array(start_date_str, end_date_str)
-        if days is None: return jsonify({"error": "รูปแบบวันที่เริ่มต้น/สิ้นสุดไม่ถูกต้อง"}), 400
+        if days is None: return {"error": "รูปแบบวันที่เริ่มต้น/สิ้นสุดไม่ถูกต้อง"}, 400
         num_nurses = len(nurses_data)
         num_days = len(days)
-        if num_days == 0: return jsonify({"error": "ช่วงวันที่ที่เลือกไม่ถูกต้อง"}), 400
+        if num_days == 0: return {"error": "ช่วงวันที่ที่เลือกไม่ถูกต้อง"}, 400
+
+        approved_hard_requests = []
+        non_gov_ids = [nurse['id'] for nurse in nurses_data if not nurse.get('isGovernmentOfficial', False)]
+        if db_admin and non_gov_ids:
+            try:
+                approved_hard_requests = fetch_approved_hard_requests(start_date_str, end_date_str, non_gov_ids)
+            except Exception as firestore_err:
+                print(f"!!! ERROR fetching approved hard requests from Firestore: {firestore_err}")
+        elif not non_gov_ids:
+            print("No non-government nurses, skipping Firestore Hard Request check.")
+        else:
+            print("Firestore Admin not initialized, skipping Hard Request check.")
+
+        capacity_analysis = None
+        if use_capacity_check:
+            capacity_analysis = analyze_request_capacity(nurses_data, days, holiday_day_numbers, required_nurses_by_shift, MAX_CONSECUTIVE_SHIFTS_WORKED,
+                                                         TARGET_OFF_DAYS, rule_profile, previous_month_schedule, approved_hard_requests)
+            print(f"Capacity analysis: {len(capacity_analysis['errors'])} errors, {len(capacity_analysis['warnings'])} warnings in {capacity_analysis['elapsedMs']:.1f}ms.")
+            if not capacity_analysis['feasible']:
+                for capacity_error in capacity_analysis['errors']:
+                    print(f"Capacity error: {capacity_error['code']}: {capacity_error['message']}")
+                return {"error": f"ไม่สามารถสร้างตารางเวรได้จากการตั้งค่านี้: {capacity_analysis['errors'][0]['message']}", "capacityAnalysis": capacity_analysis}, 422
+        solve_workers, estimated_memory_mb, memory_reject_reason = solve_memory_budget.reserve(num_nurses, num_days, SOLVER_NUM_WORKERS)
+        if memory_reject_reason == 'too_large':
+            print(f"Rejected solve: estimated {estimated_memory_mb}MB with 1 worker exceeds per-solve limit {MAX_SOLVE_MEMORY_MB}MB.")
+            return {"error": f"งานนี้ใหญ่เกินขีดจำกัดหน่วยความจำ (ประมาณ {estimated_memory_mb:.0f} MB จากที่อนุญาต {MAX_SOLVE_MEMORY_MB} MB) กรุณาลดจำนวนพยาบาลหรือแบ่งช่วงวันที่เป็นรายเดือน"}, 413
+        if memory_reject_reason == 'busy':
+            print(f"Rejected solve: {solve_memory_budget.reserved_mb:.0f}MB of {SOLVE_MEMORY_BUDGET_MB}MB already reserved, needs {estimated_memory_mb}MB.")
+            return {"error": "เซิร์ฟเวอร์กำลังประมวลผลตารางเวรอื่นอยู่ หน่วยความจำไม่เพียงพอ กรุณาลองใหม่อีกครั้ง"}, 503
+        reserved_memory_mb = estimated_memory_mb
+        if solve_workers < SOLVER_NUM_WORKERS:
+            print(f"Downgraded solve to {solve_workers} workers to fit memory limits (estimated {estimated_memory_mb}MB).")
         nurse_indices = range(num_nurses)
         day_indices = range(num_days)
         days_iso = [day.isoformat() for day in days]
@@ -222,6 +578,8 @@ def generate_schedule_api():
             for d in day_indices:
                 is_off[(n, d)] = model.NewBoolVar(f'off_n{n}_d{d}')
                 is_working[(n, d)] = is_off[(n, d)].Not()
+        rule_ctx = RuleContext(model, shifts, is_off, is_working, days, (SHIFT_MORNING, SHIFT_AFTERNOON, SHIFT_NIGHT), REQUEST_SHIFT_CODES)
+        objective_penalty_terms = rule_ctx.penalty_terms
 
         num_shifts_on_day = {}
         for n in nurse_indices:
@@ -266,14 +624,16 @@ def generate_schedule_api():
         print(f"Applied {gov_constraints_applied_count} fixed schedule constraints for Government Officials.")
 
 
-        print("--- Applying Transitions & Consecutive Constraints (Non-Gov Only) ---")
+        print(f"--- Applying Transitions & Consecutive Constraints (Non-Gov Only, {consecutive_encoding} encoding) ---")
         nm_transition_penalties = []
         consecutive_constraints_applied_count = 0
 
         consecutive_shift_count_ending_day = {}
-        for n in non_gov_indices:
-            for d in day_indices:
-                consecutive_shift_count_ending_day[n, d] = model.NewIntVar(0, MAX_CONSECUTIVE_SHIFTS_WORKED, f'csh_n{n}_d{d}')
+        ends_month_at_max_by_nurse = {}
+        if consecutive_encoding == 'linear':
+            for n in non_gov_indices:
+                for d in day_indices:
+                    consecutive_shift_count_ending_day[n, d] = model.NewIntVar(0, MAX_CONSECUTIVE_SHIFTS_WORKED, f'csh_n{n}_d{d}')
 
 
         for n in non_gov_indices:
@@ -281,13 +641,35 @@ def generate_schedule_api():
             last_day_prev_shifts = prev_state.get('last_day_shifts', [])
             last_shift_types_count = prev_state.get('last_shift_types_count', {})
 
+            if SHIFT_NIGHT in last_day_prev_shifts and SHIFT_AFTERNOON in last_day_prev_shifts and PENALTY_NIGHT_TO_MORNING_TRANSITION > 0:
+                nm_transition_penalties.append(shifts[(n, 0, SHIFT_MORNING)])
+            if PENALTY_NIGHT_TO_MORNING_TRANSITION > 0:
+                for d in range(num_days - 1):
+                    na_double_d_indicator = rule_ctx.na_double(n, d)
+                    temp_m_indicator = model.NewBoolVar(f'nm_t_n{n}_d{d}')
+                    model.AddBoolAnd([na_double_d_indicator, shifts[(n, d + 1, SHIFT_MORNING)]]).OnlyEnforceIf(temp_m_indicator)
+                    model.AddImplication(temp_m_indicator, na_double_d_indicator)
+                    model.AddImplication(temp_m_indicator, shifts[(n, d + 1, SHIFT_MORNING)])
+                    nm_transition_penalties.append(temp_m_indicator)
+
+            if num_days >= WINDOW_SIZE_FOR_MIN_OFF and MIN_OFF_DAYS_IN_WINDOW > 0:
+                for d_start in range(num_days - WINDOW_SIZE_FOR_MIN_OFF + 1):
+                    model.Add(sum(is_off[(n, d_start + k)] for k in range(WINDOW_SIZE_FOR_MIN_OFF)) >= MIN_OFF_DAYS_IN_WINDOW); consecutive_constraints_applied_count +=1
+
+            if consecutive_encoding == 'automaton':
+                # One regular constraint covers max consecutive shifts, same-shift runs, off-day runs and the
+                # afternoon -> night ban (which also rules out night after an N/A double).
+                start = start_state(prev_state, MAX_CONSECUTIVE_SHIFTS_WORKED, MAX_CONSECUTIVE_SAME_SHIFT)
+                day_shifts = [(shifts[(n, d, SHIFT_MORNING)], shifts[(n, d, SHIFT_AFTERNOON)], shifts[(n, d, SHIFT_NIGHT)]) for d in day_indices]
+                ends_month_at_max_by_nurse[n] = add_consecutive_automaton(
+                    model, f'auto_n{n}', day_shifts, start, MAX_CONSECUTIVE_SHIFTS_WORKED, MAX_CONSECUTIVE_OFF_DAYS, MAX_CONSECUTIVE_SAME_SHIFT)
+                consecutive_constraints_applied_count += 1
+                continue
+
             if SHIFT_AFTERNOON in last_day_prev_shifts:
                  model.Add(shifts[(n, 0, SHIFT_NIGHT)] == 0); consecutive_constraints_applied_count +=1
-            
             if SHIFT_NIGHT in last_day_prev_shifts and SHIFT_AFTERNOON in last_day_prev_shifts:
                 model.Add(shifts[(n, 0, SHIFT_NIGHT)] == 0); consecutive_constraints_applied_count +=1
-                if PENALTY_NIGHT_TO_MORNING_TRANSITION > 0:
-                    nm_transition_penalties.append(shifts[(n, 0, SHIFT_MORNING)])
 
             if MAX_CONSECUTIVE_SAME_SHIFT > 0:
                 for s_type in SHIFTS:
@@ -307,17 +689,7 @@ def generate_schedule_api():
             if num_days > 1:
                 for d in range(num_days - 1):
                     model.Add(shifts[(n, d, SHIFT_AFTERNOON)] + shifts[(n, d + 1, SHIFT_NIGHT)] <= 1); consecutive_constraints_applied_count +=1
-                    
-                    na_double_d_indicator = model.NewBoolVar(f'na_d_n{n}_d{d}')
-                    model.AddMultiplicationEquality(na_double_d_indicator, [shifts[(n, d, SHIFT_NIGHT)], shifts[(n, d, SHIFT_AFTERNOON)]])
-                    model.AddImplication(na_double_d_indicator, shifts[(n, d+1, SHIFT_NIGHT)].Not()); consecutive_constraints_applied_count +=1
-
-                    if PENALTY_NIGHT_TO_MORNING_TRANSITION > 0:
-                        temp_m_indicator = model.NewBoolVar(f'nm_t_n{n}_d{d}')
-                        model.AddBoolAnd([na_double_d_indicator, shifts[(n, d + 1, SHIFT_MORNING)]]).OnlyEnforceIf(temp_m_indicator)
-                        model.AddImplication(temp_m_indicator, na_double_d_indicator)
-                        model.AddImplication(temp_m_indicator, shifts[(n, d + 1, SHIFT_MORNING)])
-                        nm_transition_penalties.append(temp_m_indicator)
+                    model.AddImplication(rule_ctx.na_double(n, d), shifts[(n, d+1, SHIFT_NIGHT)].Not()); consecutive_constraints_applied_count +=1
 
             if MAX_CONSECUTIVE_SHIFTS_WORKED > 0:
                 prev_consecutive_shifts = prev_state['consecutive_shifts']
@@ -354,191 +726,46 @@ def generate_schedule_api():
                 if num_days > MAX_CONSECUTIVE_OFF_DAYS:
                     for d_start in range(num_days - MAX_CONSECUTIVE_OFF_DAYS):
                         model.Add(sum(is_off[(n, d_start + k)] for k in range(MAX_CONSECUTIVE_OFF_DAYS + 1)) <= MAX_CONSECUTIVE_OFF_DAYS); consecutive_constraints_applied_count +=1
-
-            if num_days >= WINDOW_SIZE_FOR_MIN_OFF and MIN_OFF_DAYS_IN_WINDOW > 0:
-                for d_start in range(num_days - WINDOW_SIZE_FOR_MIN_OFF + 1):
-                    model.Add(sum(is_off[(n, d_start + k)] for k in range(WINDOW_SIZE_FOR_MIN_OFF)) >= MIN_OFF_DAYS_IN_WINDOW); consecutive_constraints_applied_count +=1
         print(f"Applied {consecutive_constraints_applied_count} transition/consecutive constraints for Non-Gov officials.")
 
         print("--- Applying Approved Hard Requests (Non-Gov Only) ---")
         approved_hard_requests_applied_count = 0
         date_to_day_index = {day.isoformat(): d for d, day in enumerate(days)}
-        non_gov_ids = [nurse_id_map[n] for n in non_gov_indices]
-        if db_admin and non_gov_ids:
-            try:
-                hard_requests_ref = db_admin.collection('approvedHardRequests')
-                query = hard_requests_ref.where(filter=FieldFilter('date', '>=', start_date_str)) \
-                                     .where(filter=FieldFilter('date', '<=', end_date_str)) \
-                                     .where(filter=FieldFilter('nurseId', 'in', non_gov_ids))
-                approved_requests = query.stream()
-                for req_doc in approved_requests:
-                    req_data = req_doc.to_dict()
-                    req_nurse_id = req_data.get('nurseId')
-                    req_date_str = req_data.get('date')
-                    if req_nurse_id in nurse_id_to_index and req_date_str in date_to_day_index:
-                        n = nurse_id_to_index[req_nurse_id]
-                        if n in non_gov_indices:
-                            d = date_to_day_index[req_date_str]
-                            try:
-                                model.Add(is_off[(n, d)] == 1)
-                                approved_hard_requests_applied_count += 1
-                            except Exception as apply_err:
-                                print(f"!!! ERROR applying hard request constraint for non-gov nurse {req_nurse_id} on day {d}: {apply_err}")
-            except Exception as firestore_err:
-                print(f"!!! ERROR fetching approved hard requests from Firestore: {firestore_err}")
-        elif not non_gov_ids:
-            print("No non-government nurses, skipping Firestore Hard Request check.")
-        else:
-            print("Firestore Admin not initialized, skipping Hard Request check.")
+        for req_nurse_id, req_date_str in approved_hard_requests:
+            if req_nurse_id in nurse_id_to_index and req_date_str in date_to_day_index:
+                n = nurse_id_to_index[req_nurse_id]
+                if n in non_gov_indices:
+                    d = date_to_day_index[req_date_str]
+                    try:
+                        model.Add(is_off[(n, d)] == 1)
+                        approved_hard_requests_applied_count += 1
+                    except Exception as apply_err:
+                        print(f"!!! ERROR applying hard request constraint for non-gov nurse {req_nurse_id} on day {d}: {apply_err}")
         print(f"Applied/Accounted for {approved_hard_requests_applied_count} Approved Hard Requests for Non-Gov officials.")
 
 
-        print("--- Applying Permanent Profile Constraints (Non-Gov Only) ---")
-        applied_permanent_constraints_count = 0
-        objective_penalty_terms = []
-        day_of_week_map_local_pc = {'no_mondays': 0, 'no_tuesdays': 1, 'no_wednesdays': 2, 'no_thursdays': 3, 'no_fridays': 4, 'no_saturdays': 5, 'no_sundays': 6}
+        print("--- Applying Permanent Profile Constraints & Monthly Soft Requests (Non-Gov Only) ---")
+        rule_items_by_type = {}
         for n in non_gov_indices:
             nurse_id = nurse_id_map[n]
-            permanent_constraints = nurse_permanent_constraints.get(nurse_id, [])
-            for constraint in permanent_constraints:
+            for c_idx, constraint in enumerate(nurse_permanent_constraints.get(nurse_id, [])):
                 ctype, cval, cstr = constraint.get('type'), constraint.get('value'), constraint.get('strength', 'hard')
-                if not ctype: continue
-                try:
-                    vvars, is_hard = [], (cstr == 'hard')
-                    if is_hard:
-                        if ctype in day_of_week_map_local_pc:
-                            target_wd = day_of_week_map_local_pc[ctype];
-                            for d in day_indices:
-                                if days[d].weekday() == target_wd: model.Add(is_off[(n, d)] == 1); applied_permanent_constraints_count += 1
-                        elif ctype == 'no_morning_shifts':
-                            for d in day_indices: model.Add(shifts[(n, d, SHIFT_MORNING)] == 0); applied_permanent_constraints_count += 1
-                        elif ctype == 'no_afternoon_shifts':
-                            for d in day_indices: model.Add(shifts[(n, d, SHIFT_AFTERNOON)] == 0); applied_permanent_constraints_count += 1
-                        elif ctype == 'no_night_shifts':
-                            for d in day_indices: model.Add(shifts[(n, d, SHIFT_NIGHT)] == 0); applied_permanent_constraints_count += 1
-                        elif ctype == 'no_night_afternoon_double':
-                            for d in day_indices: model.Add(shifts[(n, d, SHIFT_NIGHT)] + shifts[(n, d, SHIFT_AFTERNOON)] <= 1); applied_permanent_constraints_count += 1
-                        elif ctype == 'no_specific_days' and isinstance(cval, list):
-                            try:
-                                f_days = [int(dn) for dn in cval if isinstance(dn, (str, int)) and str(dn).isdigit()]
-                                for d in day_indices:
-                                    if days[d].day in f_days: model.Add(is_off[(n, d)] == 1); applied_permanent_constraints_count += 1
-                            except (ValueError, TypeError): pass
-                    else:
-                        if ctype in day_of_week_map_local_pc:
-                            target_wd = day_of_week_map_local_pc[ctype];
-                            for d in day_indices:
-                                if days[d].weekday() == target_wd: vvars.append(is_working[(n, d)])
-                        elif ctype == 'no_morning_shifts':
-                            for d in day_indices: vvars.append(shifts[(n, d, SHIFT_MORNING)])
-                        elif ctype == 'no_afternoon_shifts':
-                            for d in day_indices: vvars.append(shifts[(n, d, SHIFT_AFTERNOON)])
-                        elif ctype == 'no_night_shifts':
-                            for d in day_indices: vvars.append(shifts[(n, d, SHIFT_NIGHT)])
-                        elif ctype == 'no_night_afternoon_double':
-                            for d in day_indices:
-                                na_dv = model.NewBoolVar(f'pna_n{n}_d{d}'); model.AddMultiplicationEquality(na_dv,[shifts[(n,d,SHIFT_NIGHT)],shifts[(n,d,SHIFT_AFTERNOON)]]); vvars.append(na_dv)
-                        elif ctype == 'no_specific_days' and isinstance(cval, list):
-                            try:
-                                f_days = [int(dn) for dn in cval if isinstance(dn, (str, int)) and str(dn).isdigit()]
-                                for d in day_indices:
-                                    if days[d].day in f_days: vvars.append(is_working[(n, d)])
-                            except (ValueError, TypeError): pass
-                    if vvars:
-                        for var in vvars: objective_penalty_terms.append((PENALTY_BASE_SOFT_VIOLATION, var))
-                except Exception as pce:
-                    print(f"!ERR processing permanent constraint '{ctype}' for non-gov nurse {nurse_id}: {pce}")
-        print(f"Applied {applied_permanent_constraints_count} hard permanent constraints and {len([p for p_val,v in objective_penalty_terms if p_val == PENALTY_BASE_SOFT_VIOLATION])} soft permanent penalty terms for Non-Gov officials.")
-
-
-        print("--- Applying Monthly Soft Requests (Non-Gov Only) For Penalties ---")
-        monthly_soft_penalties_count = 0
-        day_of_week_map_local_msr = {'no_mondays': 0, 'no_tuesdays': 1, 'no_wednesdays': 2, 'no_thursdays': 3, 'no_fridays': 4, 'no_saturdays': 5, 'no_sundays': 6}
-        REQUEST_TYPE_SPECIFIC_SHIFTS = 'request_specific_shifts_on_days'
-
-        for n in non_gov_indices:
-            nurse_id = nurse_id_map[n]
-            monthly_requests = monthly_soft_requests_input.get(nurse_id, [])
-            
-            for req_idx, req in enumerate(monthly_requests):
+                if not ctype or ctype == REQUEST_TYPE_SPECIFIC_SHIFTS: continue
+                rule_items_by_type.setdefault(ctype, []).append((n, cval, None if cstr == 'hard' else PENALTY_BASE_SOFT_VIOLATION, f'pc{c_idx}'))
+            for req_idx, req in enumerate(monthly_soft_requests_input.get(nurse_id, [])):
                 rtype, rval, is_hp = req.get('type'), req.get('value'), req.get('is_high_priority', False)
                 if not rtype: continue
-                try:
-                    penalty_weight = PENALTY_BASE_SOFT_VIOLATION
-                    if is_hp: penalty_weight += BONUS_HIGH_PRIORITY
-                    if is_hp and carry_over_flags_input.get(nurse_id, False):
-                        penalty_weight += BONUS_CARRY_OVER
-                    
-                    curr_vvars_for_penalty_sum = []
-                    
-                    if rtype == REQUEST_TYPE_SPECIFIC_SHIFTS and isinstance(rval, list) and rval:
-                        violation_triggers_for_this_request = []
-                        for sub_req_item_idx, sub_req_data in enumerate(rval):
-                            req_day_num = sub_req_data.get('day')
-                            req_shift_code = sub_req_data.get('shift_type')
-
-                            d_idx_for_req = -1
-                            for d_lookup, day_obj_lookup in enumerate(days):
-                                if day_obj_lookup.day == req_day_num:
-                                    d_idx_for_req = d_lookup
-                                    break
-                            
-                            if d_idx_for_req != -1 and req_shift_code is not None:
-                                d_s = d_idx_for_req
-                                part_not_met_var = model.NewBoolVar(f'srs_part_notmet_n{n}_req{req_idx}_item{sub_req_item_idx}')
-
-                                if req_shift_code == SHIFT_CODE_M_REQUEST:
-                                    model.Add(shifts[(n, d_s, SHIFT_MORNING)] == 0).OnlyEnforceIf(part_not_met_var)
-                                    model.Add(shifts[(n, d_s, SHIFT_MORNING)] == 1).OnlyEnforceIf(part_not_met_var.Not())
-                                elif req_shift_code == SHIFT_CODE_A_REQUEST:
-                                    model.Add(shifts[(n, d_s, SHIFT_AFTERNOON)] == 0).OnlyEnforceIf(part_not_met_var)
-                                    model.Add(shifts[(n, d_s, SHIFT_AFTERNOON)] == 1).OnlyEnforceIf(part_not_met_var.Not())
-                                elif req_shift_code == SHIFT_CODE_N_REQUEST:
-                                    model.Add(shifts[(n, d_s, SHIFT_NIGHT)] == 0).OnlyEnforceIf(part_not_met_var)
-                                    model.Add(shifts[(n, d_s, SHIFT_NIGHT)] == 1).OnlyEnforceIf(part_not_met_var.Not())
-                                elif req_shift_code == SHIFT_CODE_NA_DOUBLE_REQUEST:
-                                    got_na_double_for_part = model.NewBoolVar(f'srs_got_na_n{n}_d{d_s}_req{req_idx}_item{sub_req_item_idx}')
-                                    model.AddBoolAnd([shifts[(n, d_s, SHIFT_NIGHT)], shifts[(n, d_s, SHIFT_AFTERNOON)]]).OnlyEnforceIf(got_na_double_for_part)
-                                    model.AddBoolOr([shifts[(n, d_s, SHIFT_NIGHT)].Not(), shifts[(n, d_s, SHIFT_AFTERNOON)].Not()]).OnlyEnforceIf(got_na_double_for_part.Not())
-                                    model.Add(part_not_met_var == got_na_double_for_part.Not())
-                                else:
-                                    model.Add(part_not_met_var == 1) 
-                                violation_triggers_for_this_request.append(part_not_met_var)
-                        
-                        if violation_triggers_for_this_request:
-                            overall_request_violated_indicator = model.NewBoolVar(f'srs_overall_violated_n{n}_req{req_idx}')
-                            model.AddMaxEquality(overall_request_violated_indicator, violation_triggers_for_this_request)
-                            objective_penalty_terms.append((penalty_weight, overall_request_violated_indicator))
-                            monthly_soft_penalties_count += 1
-                    
-                    elif rtype in day_of_week_map_local_msr:
-                        twd = day_of_week_map_local_msr[rtype];
-                        for d in day_indices:
-                            if days[d].weekday() == twd: curr_vvars_for_penalty_sum.append(is_working[(n, d)])
-                    elif rtype == 'no_morning_shifts':
-                        for d in day_indices: curr_vvars_for_penalty_sum.append(shifts[(n, d, SHIFT_MORNING)])
-                    elif rtype == 'no_afternoon_shifts':
-                        for d in day_indices: curr_vvars_for_penalty_sum.append(shifts[(n, d, SHIFT_AFTERNOON)])
-                    elif rtype == 'no_night_shifts':
-                        for d in day_indices: curr_vvars_for_penalty_sum.append(shifts[(n, d, SHIFT_NIGHT)])
-                    elif rtype == 'no_night_afternoon_double':
-                        for d in day_indices: mna_dv=model.NewBoolVar(f'mna_n{n}_d{d}_r{req_idx}'); model.AddMultiplicationEquality(mna_dv,[shifts[(n,d,SHIFT_NIGHT)],shifts[(n,d,SHIFT_AFTERNOON)]]); curr_vvars_for_penalty_sum.append(mna_dv)
-                    elif rtype == 'no_specific_days' and isinstance(rval, list):
-                        try:
-                            f_days_req = [int(dn_str) for dn_str in rval if isinstance(dn_str, (str, int)) and str(dn_str).isdigit() and 1 <= int(dn_str) <= 31]
-                            for d in day_indices:
-                                if days[d].day in f_days_req: curr_vvars_for_penalty_sum.append(is_working[(n, d)])
-                        except (ValueError, TypeError):
-                            print(f"WARN: Invalid value '{rval}' for 'no_specific_days' (monthly) for nurse {nurse_id}")
-                    
-                    if curr_vvars_for_penalty_sum:
-                        for var_penalty in curr_vvars_for_penalty_sum:
-                            objective_penalty_terms.append((penalty_weight, var_penalty))
-                            monthly_soft_penalties_count += 1
-
-                except Exception as mce:
-                    print(f"!ERR processing monthly request '{rtype}' for non-gov nurse {nurse_id} for penalty: {mce}\n{traceback.format_exc()}")
-        print(f"Applied {monthly_soft_penalties_count} monthly soft request penalty terms for Non-Gov officials.")
+                penalty_weight = PENALTY_BASE_SOFT_VIOLATION
+                if is_hp: penalty_weight += BONUS_HIGH_PRIORITY
+                if is_hp and carry_over_flags_input.get(nurse_id, False):
+                    penalty_weight += BONUS_CARRY_OVER
+                rule_items_by_type.setdefault(rtype, []).append((n, rval, penalty_weight, f'req{req_idx}'))
+        apply_rules(rule_ctx, rule_items_by_type, rule_profile)
+        for rule_type, rule_stats in sorted(rule_ctx.stats.items()):
+            print(f"Rule '{rule_type}': {rule_stats['items']} items, {rule_stats['constraints']} constraints, {rule_stats['penaltyTerms']} penalty terms in {rule_stats['buildMs']:.1f}ms.")
+        skipped_rule_types = sorted(set(rule_items_by_type) - set(rule_ctx.stats))
+        if skipped_rule_types:
+            print(f"Skipped unknown or disabled rule types: {skipped_rule_types}")
 
 
         print("--- Defining Objective Function (Non-Gov Penalties) ---")
@@ -562,23 +789,38 @@ def generate_schedule_api():
                 total_under_non_gov = model.NewIntVar(0, num_non_gov * num_days, 'tot_under_ng'); model.Add(total_under_non_gov == sum(off_under_non_gov)); objective_penalty_terms.append((PENALTY_OFF_DAY_UNDER_TARGET, total_under_non_gov))
                 print(f"Added Target Off Day penalty term ({PENALTY_OFF_DAY_UNDER_TARGET}) for non-gov.")
 
+            non_gov_ids_fairness = [nurse_id_map[n] for n in non_gov_indices]
+            fairness_history = dict(fairness_history_input)
+            if use_stored_fairness_history and not fairness_history:
+                fairness_history = stored_fairness_history(ward, days[0].year, days[0].month, non_gov_ids_fairness)
+            known_history = [fairness_history[nid] for nid in non_gov_ids_fairness if nid in fairness_history]
+            history_offsets = {}
+            for metric in FAIRNESS_HISTORY_METRICS:
+                known_values = [h[metric] for h in known_history]
+                neutral = round(sum(known_values) / len(known_values)) if known_values else 0
+                history_offsets[metric] = [fairness_history[nid][metric] if nid in fairness_history else neutral for nid in non_gov_ids_fairness]
+            if known_history:
+                print(f"Balancing cumulative totals with history for {len(known_history)}/{num_non_gov} non-gov nurses.")
+
             if num_non_gov > 1:
                 if PENALTY_OFF_DAY_IMBALANCE > 0:
-                    min_off_ng, max_off_ng = model.NewIntVar(0,num_days,'minoff_ng'), model.NewIntVar(0,num_days,'maxoff_ng'); model.AddMinEquality(min_off_ng, total_off_non_gov); model.AddMaxEquality(max_off_ng, total_off_non_gov); objective_penalty_terms.append((PENALTY_OFF_DAY_IMBALANCE, max_off_ng - min_off_ng))
+                    objective_penalty_terms.extend(add_cumulative_fairness_terms(
+                        model, 'off', total_off_non_gov, history_offsets['daysOff'], num_days, PENALTY_OFF_DAY_IMBALANCE))
                     print(f"Added Off Day Imbalance penalty term ({PENALTY_OFF_DAY_IMBALANCE}) for non-gov.")
                 if PENALTY_TOTAL_SHIFT_IMBALANCE > 0:
-                    min_tsh_ng, max_tsh_ng = model.NewIntVar(0,num_days*2,'mintsh_ng'), model.NewIntVar(0,num_days*2,'maxtsh_ng'); model.AddMinEquality(min_tsh_ng, total_shifts_non_gov_model_vars); model.AddMaxEquality(max_tsh_ng, total_shifts_non_gov_model_vars); objective_penalty_terms.append((PENALTY_TOTAL_SHIFT_IMBALANCE, max_tsh_ng - min_tsh_ng))
+                    objective_penalty_terms.extend(add_cumulative_fairness_terms(
+                        model, 'tsh', total_shifts_non_gov_model_vars, history_offsets['total'], num_days * 2, PENALTY_TOTAL_SHIFT_IMBALANCE))
                     print(f"Added Total Shift Imbalance penalty term ({PENALTY_TOTAL_SHIFT_IMBALANCE}) for non-gov.")
                 if PENALTY_SHIFT_TYPE_IMBALANCE > 0:
-                    min_m_ng, max_m_ng = model.NewIntVar(0,num_days,'minm_ng'), model.NewIntVar(0,num_days,'maxm_ng'); model.AddMinEquality(min_m_ng, total_m_non_gov_model_vars); model.AddMaxEquality(max_m_ng, total_m_non_gov_model_vars); objective_penalty_terms.append((PENALTY_SHIFT_TYPE_IMBALANCE, max_m_ng - min_m_ng))
-                    min_a_ng, max_a_ng = model.NewIntVar(0,num_days,'mina_ng'), model.NewIntVar(0,num_days,'maxa_ng'); model.AddMinEquality(min_a_ng, total_a_non_gov_model_vars); model.AddMaxEquality(max_a_ng, total_a_non_gov_model_vars); objective_penalty_terms.append((PENALTY_SHIFT_TYPE_IMBALANCE, max_a_ng - min_a_ng))
-                    min_n_sh_ng, max_n_sh_ng = model.NewIntVar(0,num_days,'minn_ng'), model.NewIntVar(0,num_days,'maxn_ng'); model.AddMinEquality(min_n_sh_ng, total_n_non_gov_model_vars); model.AddMaxEquality(max_n_sh_ng, total_n_non_gov_model_vars); objective_penalty_terms.append((PENALTY_SHIFT_TYPE_IMBALANCE, max_n_sh_ng - min_n_sh_ng))
+                    for metric, type_totals in (('morning', total_m_non_gov_model_vars), ('afternoon', total_a_non_gov_model_vars), ('night', total_n_non_gov_model_vars)):
+                        objective_penalty_terms.extend(add_cumulative_fairness_terms(
+                            model, metric, type_totals, history_offsets[metric], num_days, PENALTY_SHIFT_TYPE_IMBALANCE))
                     print(f"Added Shift Type Imbalance penalty term ({PENALTY_SHIFT_TYPE_IMBALANCE}) for non-gov.")
             
             if PENALTY_PER_NA_DOUBLE > 0:
                 na_double_terms_non_gov = [];
                 for n_ng_idx in non_gov_indices:
-                    for d in day_indices: na_ind=model.NewBoolVar(f'nad_n{n_ng_idx}_d{d}'); model.AddMultiplicationEquality(na_ind,[shifts[(n_ng_idx,d,SHIFT_NIGHT)],shifts[(n_ng_idx,d,SHIFT_AFTERNOON)]]); na_double_terms_non_gov.append(na_ind)
+                    for d in day_indices: na_double_terms_non_gov.append(rule_ctx.na_double(n_ng_idx, d))
                 if na_double_terms_non_gov: objective_penalty_terms.append((PENALTY_PER_NA_DOUBLE, sum(na_double_terms_non_gov)))
                 print(f"Added N/A Double penalty term ({PENALTY_PER_NA_DOUBLE}) for non-gov.")
 
@@ -590,6 +832,8 @@ def generate_schedule_api():
                 ends_month_at_max_vars = []
                 last_day_idx = num_days - 1
                 for i, n_ng_idx in enumerate(non_gov_indices):
+                    if n_ng_idx in ends_month_at_max_by_nurse:
+                        ends_month_at_max_vars.append(ends_month_at_max_by_nurse[n_ng_idx]); continue
                     ends_at_max_var = model.NewBoolVar(f'ends_max_n{n_ng_idx}')
                     model.Add(consecutive_shift_count_ending_day[n_ng_idx, last_day_idx] == MAX_CONSECUTIVE_SHIFTS_WORKED).OnlyEnforceIf(ends_at_max_var)
                     model.Add(consecutive_shift_count_ending_day[n_ng_idx, last_day_idx] < MAX_CONSECUTIVE_SHIFTS_WORKED).OnlyEnforceIf(ends_at_max_var.Not())
@@ -605,9 +849,42 @@ def generate_schedule_api():
         else:
             print("No penalties defined in objective function (either no non-gov nurses or no penalty terms applicable).")
 
-        solver = cp_model.CpSolver(); solver.parameters.max_time_in_seconds = SOLVER_TIME_LIMIT; solver.parameters.log_search_progress = True; solver.parameters.num_workers = 8
-        print(f"\n--- Starting Solver (Time Limit: {SOLVER_TIME_LIMIT}s, Workers: {solver.parameters.num_workers}) ---")
-        solve_start_time = time.time(); status = solver.Solve(model); solve_end_time = time.time()
+        warm_start_version_id = None
+        if schedule_store and ward and use_warm_start:
+            try:
+                warm_start_version = schedule_store.latest_version(ward, start_date_str)
+                if warm_start_version:
+                    hint_shifts = version_nurse_shifts(warm_start_version)
+                    hints_added = 0
+                    for n in nurse_indices:
+                        nurse_hint = hint_shifts.get(nurse_id_map[n])
+                        if nurse_hint is None: continue
+                        for d in day_indices:
+                            day_hint = nurse_hint.get(days_iso[d], [])
+                            for s in SHIFTS:
+                                model.AddHint(shifts[(n, d, s)], 1 if s in day_hint else 0); hints_added += 1
+                    warm_start_version_id = warm_start_version["id"]
+                    print(f"Warm start: added {hints_added} hints from schedule version {warm_start_version_id}.")
+            except Exception as hint_err:
+                print(f"WARN: Could not apply warm start hints: {hint_err}")
+
+        model_proto = model.Proto()
+        model_stats = {
+            "buildMs": round((time.time() - start_time) * 1000, 1), "variables": len(model_proto.variables),
+            "constraints": len(model_proto.constraints), "objectiveTerms": len(objective_penalty_terms), "rules": rule_ctx.stats,
+        }
+        print(f"Model built in {model_stats['buildMs']:.1f}ms: {model_stats['variables']} variables, {model_stats['constraints']} constraints.")
+
+        solver = cp_model.CpSolver(); solver.parameters.max_time_in_seconds = SOLVER_TIME_LIMIT; solver.parameters.log_search_progress = True; solver.parameters.num_workers = solve_workers
+        rss_before_solve_mb = current_rss_mb()
+        if rss_before_solve_mb is not None:
+            # CP-SAT checks the memory limit against the whole process, so allow this job's share on top of what is in use.
+            solver.parameters.max_memory_in_mb = int(rss_before_solve_mb + MAX_SOLVE_MEMORY_MB)
+        print(f"\n--- Starting Solver (Time Limit: {SOLVER_TIME_LIMIT}s, Workers: {solver.parameters.num_workers}, Estimated Memory: {estimated_memory_mb}MB) ---")
+        with RssSampler() as rss_sampler:
+            solve_start_time = time.time(); status = solver.Solve(model); solve_end_time = time.time()
+        if rss_sampler.peak_mb is not None:
+            print(f"Peak RSS during solve: {rss_sampler.peak_mb:.0f}MB (before solve: {rss_sampler.start_mb:.0f}MB).")
         print(f"--- Solver Finished --- Status: {solver.StatusName(status)}, Time: {solve_end_time - solve_start_time:.2f}s")
 
         if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
@@ -617,8 +894,6 @@ def generate_schedule_api():
             nurse_next_carry_over_status = {}
             print("--- Calculating Potential Next Carry-over Flags (Non-Gov Only) based on New Logic ---")
 
-            day_of_week_map_carry_over = {'no_mondays': 0, 'no_tuesdays': 1, 'no_wednesdays': 2, 'no_thursdays': 3, 'no_fridays': 4, 'no_saturdays': 5, 'no_sundays': 6}
-
             solved_total_shifts_for_carry_over = {}
             if num_non_gov > 0:
                 for i, n_ng_idx_co in enumerate(non_gov_indices):
@@ -641,154 +916,20 @@ def generate_schedule_api():
                         print(f"WARN: Could not get solved total shifts for nurse {nurse_id_co} for carry-over logic: {e}. Defaulting to 0 counts.")
 
 
+            solved_grid = {}
             for n_idx_main in nurse_indices:
-                nurse_id_main = nurse_id_map[n_idx_main]
-                is_gov_main = is_gov_official_map.get(n_idx_main, False)
-
-                if is_gov_main:
-                    nurse_next_carry_over_status[nurse_id_main] = False
-                    continue
-
-                unmet_hp_request_overall = False
-                nurse_monthly_requests = monthly_soft_requests_input.get(nurse_id_main, [])
-                high_priority_requests = [req for req in nurse_monthly_requests if req.get('is_high_priority', False)]
+                solved_grid[nurse_id_map[n_idx_main]] = {
+                    days_iso[d]: [s for s in SHIFTS if solver.Value(shifts[(n_idx_main, d, s)]) == 1] for d in day_indices
+                }
+            non_gov_ids_solved = [nurse_id_map[n] for n in non_gov_indices]
 
-                if not high_priority_requests:
+            for n_idx_main in nurse_indices:
+                nurse_id_main = nurse_id_map[n_idx_main]
+                if is_gov_official_map.get(n_idx_main, False):
                     nurse_next_carry_over_status[nurse_id_main] = False
                     continue
-                
-                for hp_req in high_priority_requests:
-                    if unmet_hp_request_overall: break
-
-                    rtype = hp_req.get('type')
-                    rval = hp_req.get('value')
-
-                    if rtype == REQUEST_TYPE_SPECIFIC_SHIFTS and isinstance(rval, list) and rval:
-                        request_fully_met_specific_shifts = True
-                        for sub_req_item in rval:
-                            req_day_num_co = sub_req_item.get('day')
-                            req_shift_code_co = sub_req_item.get('shift_type')
-                            
-                            d_idx_for_req_co = -1
-                            for d_lookup_co, day_obj_lookup_co in enumerate(days):
-                                if day_obj_lookup_co.day == req_day_num_co:
-                                    d_idx_for_req_co = d_lookup_co
-                                    break
-                            
-                            if d_idx_for_req_co != -1 and req_shift_code_co is not None:
-                                d_s_co = d_idx_for_req_co
-                                got_this_part = False
-                                if req_shift_code_co == SHIFT_CODE_M_REQUEST:
-                                    if solver.Value(shifts[(n_idx_main, d_s_co, SHIFT_MORNING)]) == 1: got_this_part = True
-                                elif req_shift_code_co == SHIFT_CODE_A_REQUEST:
-                                    if solver.Value(shifts[(n_idx_main, d_s_co, SHIFT_AFTERNOON)]) == 1: got_this_part = True
-                                elif req_shift_code_co == SHIFT_CODE_N_REQUEST:
-                                    if solver.Value(shifts[(n_idx_main, d_s_co, SHIFT_NIGHT)]) == 1: got_this_part = True
-                                elif req_shift_code_co == SHIFT_CODE_NA_DOUBLE_REQUEST:
-                                    if solver.Value(shifts[(n_idx_main, d_s_co, SHIFT_NIGHT)]) == 1 and \
-                                       solver.Value(shifts[(n_idx_main, d_s_co, SHIFT_AFTERNOON)]) == 1:
-                                        got_this_part = True
-                                
-                                if not got_this_part:
-                                    request_fully_met_specific_shifts = False
-                                    break
-                            else:
-                                request_fully_met_specific_shifts = False 
-                                break
-                        
-                        if not request_fully_met_specific_shifts:
-                            unmet_hp_request_overall = True
-
-
-                    elif rtype in day_of_week_map_carry_over:
-                        target_weekday = day_of_week_map_carry_over[rtype]
-                        requested_day_occurrences_in_month = 0
-                        days_off_on_requested_weekday = 0
-                        for d_idx, day_obj in enumerate(days):
-                            if day_obj.weekday() == target_weekday:
-                                requested_day_occurrences_in_month += 1
-                                if solver.Value(is_off[(n_idx_main, d_idx)]) == 1:
-                                    days_off_on_requested_weekday += 1
-                        
-                        if requested_day_occurrences_in_month > 0:
-                            min_required_off = 0
-                            if requested_day_occurrences_in_month == 1: min_required_off = 1
-                            elif requested_day_occurrences_in_month == 2: min_required_off = 2
-                            elif requested_day_occurrences_in_month == 3: min_required_off = 2
-                            elif requested_day_occurrences_in_month == 4: min_required_off = 3
-                            elif requested_day_occurrences_in_month >= 5: min_required_off = 4
-                            
-                            if days_off_on_requested_weekday < min_required_off:
-                                unmet_hp_request_overall = True
-                    
-                    elif rtype == 'no_specific_days':
-                        parsed_specific_days_req = []
-                        if isinstance(rval, list):
-                            for dn_str in rval:
-                                try: parsed_specific_days_req.append(int(dn_str))
-                                except (ValueError, TypeError): pass
-                        
-                        if not 1 <= len(parsed_specific_days_req) <= 2:
-                            continue
-
-                        if len(parsed_specific_days_req) == 1:
-                            day_num_requested = parsed_specific_days_req[0]
-                            worked_on_requested_day = False
-                            for d_idx, day_obj in enumerate(days):
-                                if day_obj.day == day_num_requested:
-                                    if solver.Value(is_off[(n_idx_main, d_idx)]) == 0:
-                                        worked_on_requested_day = True
-                                    break
-                            if worked_on_requested_day:
-                                unmet_hp_request_overall = True
-                        
-                        elif len(parsed_specific_days_req) == 2:
-                            got_both_days_off = True
-                            for day_num_req_val in parsed_specific_days_req:
-                                worked_this_specific_day = False
-                                for d_idx, day_obj in enumerate(days):
-                                    if day_obj.day == day_num_req_val:
-                                        if solver.Value(is_off[(n_idx_main, d_idx)]) == 0:
-                                            worked_this_specific_day = True
-                                        break
-                                if worked_this_specific_day:
-                                    got_both_days_off = False
-                                    break
-                            if not got_both_days_off:
-                                unmet_hp_request_overall = True
-
-                    elif rtype in ['no_morning_shifts', 'no_afternoon_shifts', 'no_night_shifts', 'no_night_afternoon_double']:
-                        actual_shifts_of_type_for_nurse_n = 0
-                        shift_key_for_solved_counts = ''
-                        if rtype == 'no_morning_shifts': shift_key_for_solved_counts = 'm'
-                        elif rtype == 'no_afternoon_shifts': shift_key_for_solved_counts = 'a'
-                        elif rtype == 'no_night_shifts': shift_key_for_solved_counts = 'n'
-                        elif rtype == 'no_night_afternoon_double': shift_key_for_solved_counts = 'na_double'
-                        
-                        actual_shifts_of_type_for_nurse_n = solved_total_shifts_for_carry_over.get(nurse_id_main, {}).get(shift_key_for_solved_counts, 0)
-
-                        if num_non_gov == 1:
-                            if actual_shifts_of_type_for_nurse_n > 0:
-                                unmet_hp_request_overall = True
-                        else:
-                            sum_shifts_other_nurses = 0
-                            count_other_nurses = 0
-                            for other_n_idx in non_gov_indices:
-                                if other_n_idx == n_idx_main: continue
-                                other_nurse_id = nurse_id_map[other_n_idx]
-                                sum_shifts_other_nurses += solved_total_shifts_for_carry_over.get(other_nurse_id, {}).get(shift_key_for_solved_counts, 0)
-                                count_other_nurses += 1
-                            
-                            if count_other_nurses > 0:
-                                average_shifts_of_type_others = sum_shifts_other_nurses / count_other_nurses
-                                if average_shifts_of_type_others == 0:
-                                    if actual_shifts_of_type_for_nurse_n > 0:
-                                        unmet_hp_request_overall = True
-                                else:
-                                    percentage_of_average = (actual_shifts_of_type_for_nurse_n / average_shifts_of_type_others) * 100
-                                    if percentage_of_average > 50.0:
-                                        unmet_hp_request_overall = True
-                
+                _, _, unmet_hp_request_overall = evaluate_request_satisfaction(
+                    monthly_soft_requests_input.get(nurse_id_main, []), nurse_id_main, solved_grid, days, solved_total_shifts_for_carry_over, non_gov_ids_solved)
                 nurse_next_carry_over_status[nurse_id_main] = unmet_hp_request_overall
 
             nurse_schedules, shifts_count = {}, {}
@@ -844,9 +985,64 @@ def generate_schedule_api():
                     max_n = max(c['night'] for c in non_gov_counts)
                     tot_nad = sum(c['nightAfternoonDouble'] for c in non_gov_counts)
 
+                fairness_history_next = {}
+                if non_gov_counts:
+                    cumulative_by_metric = {}
+                    for metric in FAIRNESS_HISTORY_METRICS:
+                        cumulative_by_metric[metric] = {
+                            nid: shifts_count[nid][metric] + history_offsets[metric][i] for i, nid in enumerate(non_gov_ids_fairness)
+                        }
+                    for i, nid in enumerate(non_gov_ids_fairness):
+                        fairness_history_next[nid] = {}
+                        for metric in FAIRNESS_HISTORY_METRICS:
+                            values = cumulative_by_metric[metric]
+                            fairness_history_next[nid][metric] = round(values[nid] - sum(values.values()) / len(values))
+
                 total_time_taken = time.time() - start_time
+                solver_stats = {
+                    "status": solver.StatusName(status), "objective": objective_value,
+                    "bestBound": solver.BestObjectiveBound() if objective_penalty_terms else 0,
+                    "wallTime": solver.WallTime(), "conflicts": solver.NumConflicts(), "branches": solver.NumBranches(),
+                    "totalTime": total_time_taken, "warmStartVersionId": warm_start_version_id, "consecutiveEncoding": consecutive_encoding,
+                    "numWorkers": solve_workers, "estimatedMemoryMb": estimated_memory_mb,
+                    "rssBeforeSolveMb": rss_sampler.start_mb, "peakRssMb": rss_sampler.peak_mb,
+                }
+                schedule_version_id = None
+                if input_hash is None: input_hash = compute_input_hash(data)
+                if schedule_store:
+                    try:
+                        store_params = {
+                            "requiredNursesByShift": {str(s): required_nurses_by_shift[s] for s in SHIFTS},
+                            "maxConsecutiveShiftsWorked": MAX_CONSECUTIVE_SHIFTS_WORKED, "targetOffDays": TARGET_OFF_DAYS,
+                            "holidays": sorted(holiday_day_numbers), "ruleProfile": rule_profile.to_dict(),
+                            "govNurseIds": [nurse_id_map[n] for n in nurse_indices if is_gov_official_map.get(n, False)],
+                            "monthlyRequests": {nid: reqs for nid, reqs in monthly_soft_requests_input.items() if nid in non_gov_ids_solved},
+                            # The swap checker re-checks against exactly what this solve was constrained by.
+                            "previousStates": {
+                                nurse_id_map[n]: {**previous_states[n], 'last_shift_types_count': {str(s): c for s, c in previous_states[n]['last_shift_types_count'].items()}}
+                                for n in non_gov_indices
+                            },
+                            "nurseHardConstraints": {
+                                nurse_id_map[n]: [c for c in nurse_permanent_constraints.get(nurse_id_map[n], []) if c.get('strength', 'hard') == 'hard']
+                                for n in non_gov_indices
+                            },
+                            "approvedHardRequests": [[nid, date_str] for nid, date_str in approved_hard_requests if nid in non_gov_ids_solved],
+                        }
+                        nurse_shift_grid = {nid: ns["shifts"] for nid, ns in nurse_schedules.items()}
+                        schedule_version_id = schedule_store.save_version(ward, start_date_str, end_date_str, input_hash, [nurse_id_map[n] for n in nurse_indices], days_iso, nurse_shift_grid, store_params, solver_stats)
+                        print(f"Saved schedule version {schedule_version_id} (ward '{ward}', input hash {input_hash[:12]}).")
+                        if SCHEDULE_STORE_FIRESTORE_MIRROR and db_admin:
+                            db_admin.collection('scheduleVersions').document(str(schedule_version_id)).set({
+                                "ward": ward, "startDate": start_date_str, "endDate": end_date_str, "inputHash": input_hash,
+                                "params": store_params, "solverStats": solver_stats,
+                                "nurseIds": [nurse_id_map[n] for n in nurse_indices], "days": days_iso,
+                                "masks": [shifts_to_mask(nurse_shift_grid[nurse_id_map[n]][day_iso]) for n in nurse_indices for day_iso in days_iso],
+                            })
+                    except Exception as store_err:
+                        print(f"WARN: Could not save schedule version: {store_err}")
+
                 print(f"Schedule generation successful. Total time: {total_time_taken:.2f}s")
-                return jsonify({
+                return {
                     "nurseSchedules": nurse_schedules, 
                     "shiftsCount": shifts_count, 
                     "days": days_iso, 
@@ -862,11 +1058,17 @@ def generate_schedule_api():
                         "nightMin": min_n, "nightMax": max_n, 
                         "totalNADoubles": tot_nad 
                     }, 
-                    "nextCarryOverFlags": nurse_next_carry_over_status 
-                }), 200
+                    "nextCarryOverFlags": nurse_next_carry_over_status,
+                    "fairnessHistoryNext": fairness_history_next,
+                    "scheduleVersionId": schedule_version_id,
+                    "inputHash": input_hash,
+                    "solverStats": solver_stats,
+                    "modelStats": model_stats,
+                    "capacityWarnings": capacity_analysis['warnings'] if capacity_analysis else []
+                }, 200
             except Exception as res_err:
                 print(f"!!! ERROR DURING RESULT PROCESSING !!!\n{traceback.format_exc()}"); 
-                return jsonify({"error": f"เกิดข้อผิดพลาดในการประมวลผลผลลัพธ์: {res_err}"}), 500
+                return {"error": f"เกิดข้อผิดพลาดในการประมวลผลผลลัพธ์: {res_err}"}, 500
         else:
             error_message = f"ไม่สามารถสร้างตารางเวรได้ (Solver Status: {solver.StatusName(status)}). ";
             if status == cp_model.INFEASIBLE: error_message += "ข้อจำกัด Hard Constraints ขัดแย้งกัน (อาจเกิดจากจำนวนพยาบาลไม่พอ, Hard Request, หรือข้อกำหนดข้าราชการ)"
@@ -874,11 +1076,436 @@ def generate_schedule_api():
             elif status == cp_model.MODEL_INVALID: error_message += "โครงสร้าง Model ไม่ถูกต้อง (ตรวจสอบ Backend Log)"
             else: error_message += "เกิดข้อผิดพลาดที่ไม่ทราบสาเหตุระหว่างการ Solve"
             print(f"Schedule generation failed. Status: {solver.StatusName(status)}")
-            return jsonify({"error": error_message}), 500
+            return {"error": error_message, "solverStats": {
+                "status": solver.StatusName(status), "wallTime": solver.WallTime(), "numWorkers": solve_workers,
+                "estimatedMemoryMb": estimated_memory_mb, "rssBeforeSolveMb": rss_sampler.start_mb, "peakRssMb": rss_sampler.peak_mb,
+            }}, 500
 
     except Exception as e:
-        print(f"!!! UNEXPECTED ERROR IN generate_schedule_api !!!\n{traceback.format_exc()}")
-        return jsonify({"error": f"เกิดข้อผิดพลาดไม่คาดคิดใน Server: {e}"}), 500
+        print(f"!!! UNEXPECTED ERROR IN solve_schedule_request !!!\n{traceback.format_exc()}")
+        return {"error": f"เกิดข้อผิดพลาดไม่คาดคิดใน Server: {e}"}, 500
+    finally:
+        solve_memory_budget.release(reserved_memory_mb)
+
+
+# Single-flight coalescing: identical payloads submitted while a solve is running wait for that solve
+# instead of starting their own. This is per process, so it needs every request in one process: gunicorn
+# runs a single gthread worker (see gunicorn.conf.py) and warns at startup when configured otherwise.
+inflight_solves = {}
+inflight_solves_lock = threading.Lock()
+solve_metrics = {"solveRequests": 0, "solvesStarted": 0, "coalescedRequests": 0}
+
+
+def solve_schedule_coalesced(data):
+    input_hash = compute_input_hash(data)
+    with inflight_solves_lock:
+        solve_metrics["solveRequests"] += 1
+        entry = inflight_solves.get(input_hash)
+        is_leader = entry is None
+        if is_leader:
+            entry = {"done": threading.Event(), "result": None}
+            inflight_solves[input_hash] = entry
+            solve_metrics["solvesStarted"] += 1
+        else:
+            solve_metrics["coalescedRequests"] += 1
+
+    if not is_leader:
+        print(f"Coalescing request onto in-flight solve {input_hash[:12]}.")
+        entry["done"].wait()
+        body, status_code = entry["result"]
+        return dict(body, coalesced=True), status_code
+
+    try:
+        entry["result"] = solve_schedule_request(data, input_hash)
+    except Exception as e:
+        entry["result"] = ({"error": f"เกิดข้อผิดพลาดไม่คาดคิดใน Server: {e}"}, 500)
+    finally:
+        with inflight_solves_lock:
+            inflight_solves.pop(input_hash, None)
+        entry["done"].set()
+    return entry["result"]
+
+
+@app.route('/generate-schedule', methods=['POST'])
+def generate_schedule_api():
+    data = request.get_json(silent=True)
+    if not data: return jsonify({"error": "Invalid JSON payload"}), 400
+    body, status_code = solve_schedule_coalesced(data)
+    return jsonify(body), status_code
+
+
+@app.route('/analyze-schedule-input', methods=['POST'])
+def analyze_schedule_input_api():
+    """Fast feasibility check of /generate-schedule settings; builds no model, so the UI can call it on every edit.
+
+    Takes the /generate-schedule payload plus optional 'approvedHardRequests' ([{nurseId, date}]); without
+    it the approved requests are read from Firestore when available.
+    """
+    data = request.get_json(silent=True)
+    if not data: return jsonify({"error": "Invalid JSON payload"}), 400
+    try:
+        nurses_data = data['nurses']
+        if not isinstance(nurses_data, list) or not nurses_data or not all('id' in n for n in nurses_data): raise ValueError("Invalid or empty 'nurses' data")
+        start_date_str = data['schedule']['startDate'].split('T')[0]
+        end_date_str = data['schedule']['endDate'].split('T')[0]
+        required_nurses_by_shift = {
+            SHIFT_MORNING: int(data.get('requiredNursesMorning', 2)), SHIFT_AFTERNOON: int(data.get('requiredNursesAfternoon', 3)),
+            SHIFT_NIGHT: int(data.get('requiredNursesNight', 2)),
+        }
+        if min(required_nurses_by_shift.values()) < 0: raise ValueError("Required nurses cannot be negative")
+        max_consecutive_shifts = int(data.get('maxConsecutiveShiftsWorked', 6))
+        if max_consecutive_shifts < 1: raise ValueError("Max consecutive SHIFTS worked must be >= 1")
+        target_off_days = int(data.get('targetOffDays', 8))
+        holiday_day_numbers = set(int(h) for h in data.get('holidays', []))
+        ward = str(data.get('ward') or '')
+        rule_profile_input = data.get('ruleProfile')
+        if rule_profile_input is None and schedule_store and ward:
+            rule_profile_input = schedule_store.get_rule_profile(ward)
+        rule_profile = compile_rule_profile(rule_profile_input, DEFAULT_RULE_PROFILE)
+        hard_requests_input = data.get('approvedHardRequests')
+        if hard_requests_input is not None and not isinstance(hard_requests_input, list): raise ValueError("Invalid 'approvedHardRequests' format, expected a list")
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"ข้อมูล Input ไม่ถูกต้อง หรือไม่ครบถ้วน: {e}"}), 400
+    days = get_days_array(start_date_str, end_date_str)
+    if not days: return jsonify({"error": "รูปแบบวันที่เริ่มต้น/สิ้นสุดไม่ถูกต้อง"}), 400
+
+    if hard_requests_input is not None:
+        approved_hard_requests = [(req.get('nurseId'), str(req.get('date', '')).split('T')[0]) for req in hard_requests_input if isinstance(req, dict)]
+    else:
+        approved_hard_requests = []
+        non_gov_ids = [nurse['id'] for nurse in nurses_data if not nurse.get('isGovernmentOfficial', False)]
+        if db_admin and non_gov_ids:
+            try:
+                approved_hard_requests = fetch_approved_hard_requests(start_date_str, end_date_str, non_gov_ids)
+            except Exception as firestore_err:
+                print(f"WARN: Could not fetch approved hard requests for capacity analysis: {firestore_err}")
+    analysis = analyze_request_capacity(nurses_data, days, holiday_day_numbers, required_nurses_by_shift, max_consecutive_shifts,
+                                        target_off_days, rule_profile, data.get('previousMonthSchedule'), approved_hard_requests)
+    return jsonify(analysis), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_api():
+    with inflight_solves_lock:
+        metrics = dict(solve_metrics, inflightSolves=len(inflight_solves))
+    metrics.update(reservedSolveMemoryMb=solve_memory_budget.reserved_mb, solveMemoryBudgetMb=SOLVE_MEMORY_BUDGET_MB,
+                   maxSolveMemoryMb=MAX_SOLVE_MEMORY_MB, rssMb=current_rss_mb())
+    return jsonify(metrics), 200
+
+
+@app.route('/rule-profiles/<ward>', methods=['GET'])
+def get_rule_profile_api(ward):
+    if not schedule_store: return jsonify({"error": "Schedule store ไม่พร้อมใช้งาน"}), 503
+    stored_profile = schedule_store.get_rule_profile(ward)
+    try:
+        effective_profile = compile_rule_profile(stored_profile, DEFAULT_RULE_PROFILE).to_dict()
+    except ValueError as e:
+        return jsonify({"error": f"Rule profile ที่บันทึกไว้ไม่ถูกต้อง: {e}", "profile": stored_profile}), 500
+    return jsonify({"ward": ward, "profile": stored_profile or {}, "effective": effective_profile}), 200
+
+
+@app.route('/rule-profiles/<ward>', methods=['PUT'])
+def put_rule_profile_api(ward):
+    if not schedule_store: return jsonify({"error": "Schedule store ไม่พร้อมใช้งาน"}), 503
+    profile_input = request.get_json(silent=True)
+    if not isinstance(profile_input, dict): return jsonify({"error": "Invalid JSON payload"}), 400
+    try:
+        effective_profile = compile_rule_profile(profile_input, DEFAULT_RULE_PROFILE).to_dict()
+    except ValueError as e:
+        return jsonify({"error": f"Rule profile ไม่ถูกต้อง: {e}"}), 400
+    schedule_store.save_rule_profile(ward, profile_input)
+    print(f"Saved rule profile for ward '{ward}': {profile_input}")
+    return jsonify({"ward": ward, "profile": profile_input, "effective": effective_profile}), 200
+
+
+@app.route('/schedule-versions', methods=['GET'])
+def list_schedule_versions_api():
+    if not schedule_store: return jsonify({"error": "Schedule store ไม่พร้อมใช้งาน"}), 503
+    try:
+        versions = schedule_store.list_versions(ward=request.args.get('ward'), start_date=request.args.get('startDate'),
+                                                limit=int(request.args.get('limit', 50)))
+    except ValueError as e:
+        return jsonify({"error": f"ค่า limit ไม่ถูกต้อง: {e}"}), 400
+    return jsonify({"versions": versions}), 200
+
+
+@app.route('/schedule-versions/<int:version_id>', methods=['GET'])
+def get_schedule_version_api(version_id):
+    if not schedule_store: return jsonify({"error": "Schedule store ไม่พร้อมใช้งาน"}), 503
+    version = schedule_store.get_version(version_id)
+    if not version: return jsonify({"error": f"ไม่พบตารางเวรเวอร์ชัน {version_id}"}), 404
+    nurse_ids = request.args.getlist('nurseId') or None
+    result = {k: v for k, v in version.items() if k not in ('masks', 'nurseIds')}
+    result["nurseShifts"] = version_nurse_shifts(version, nurse_ids)
+    return jsonify(result), 200
+
+
+@app.route('/schedule-versions/<int:old_version_id>/diff/<int:new_version_id>', methods=['GET'])
+def diff_schedule_versions_api(old_version_id, new_version_id):
+    if not schedule_store: return jsonify({"error": "Schedule store ไม่พร้อมใช้งาน"}), 503
+    old_version = schedule_store.get_version(old_version_id)
+    new_version = schedule_store.get_version(new_version_id)
+    if not old_version or not new_version:
+        return jsonify({"error": f"ไม่พบตารางเวรเวอร์ชัน {old_version_id if not old_version else new_version_id}"}), 404
+    changes = diff_versions(old_version, new_version)
+    return jsonify({
+        "oldVersionId": old_version_id, "newVersionId": new_version_id,
+        "changedCells": len(changes), "changedNurseIds": sorted({c["nurseId"] for c in changes}),
+        "changes": changes
+    }), 200
+
+
+@app.route('/schedule-versions/<int:version_id>/publish', methods=['POST'])
+def publish_schedule_version_api(version_id):
+    """Called when a generated schedule is saved; only published versions feed the monthly and yearly aggregates."""
+    if not schedule_store: return jsonify({"error": "Schedule store ไม่พร้อมใช้งาน"}), 503
+    version = schedule_store.get_version(version_id)
+    if not version: return jsonify({"error": f"ไม่พบตารางเวรเวอร์ชัน {version_id}"}), 404
+    month_stats = version_month_stats(version, version_nurse_shifts(version))
+    first_day = datetime.date.fromisoformat(version['days'][0])
+    if not schedule_store.publish_version(version_id, first_day.year, first_day.month, month_stats):
+        return jsonify({"error": f"ไม่พบตารางเวรเวอร์ชัน {version_id}"}), 404
+    print(f"Published schedule version {version_id} (ward '{version['ward']}', {first_day.year}-{first_day.month:02d}).")
+    return jsonify({"scheduleVersionId": version_id, "ward": version['ward'], "year": first_day.year, "month": first_day.month, "nurses": month_stats}), 200
+
+
+SCHEDULE_INDEX_CACHE_SIZE = int(os.getenv('SCHEDULE_INDEX_CACHE_SIZE', 32))
+INDEX_DATA_MISSING_ERROR = "ตารางเวรเวอร์ชันนี้ไม่มีข้อมูลสถานะเดือนก่อนและข้อจำกัดของพยาบาลสำหรับตรวจสอบการแลกเวร กรุณาสร้างและบันทึกตารางเวรใหม่"
+schedule_index_cache = OrderedDict()
+schedule_index_cache_lock = threading.Lock()
+
+
+def nurse_hard_rules_for_index(nurses, days, disabled_rule_types=()):
+    """Hard permanent constraints as required off-days, forbidden shift masks and no-double nurses."""
+    required_off_days, forbidden_masks, no_double_ids = {}, {}, set()
+    shift_type_constraints = {'no_morning_shifts': SHIFT_MORNING, 'no_afternoon_shifts': SHIFT_AFTERNOON, 'no_night_shifts': SHIFT_NIGHT}
+    for nurse in nurses:
+        nurse_id = nurse.get('id')
+        for constraint in nurse.get('constraints', []) or []:
+            ctype, cval = constraint.get('type'), constraint.get('value')
+            if constraint.get('strength', 'hard') != 'hard' or ctype in disabled_rule_types: continue
+            if ctype in DAY_OF_WEEK_REQUEST_TYPES:
+                required_off_days.setdefault(nurse_id, set()).update(d for d, day in enumerate(days) if day.weekday() == DAY_OF_WEEK_REQUEST_TYPES[ctype])
+            elif ctype in shift_type_constraints:
+                forbidden_masks[nurse_id] = forbidden_masks.get(nurse_id, 0) | shifts_to_mask([shift_type_constraints[ctype]])
+            elif ctype == 'no_night_afternoon_double':
+                no_double_ids.add(nurse_id)
+            elif ctype == 'no_specific_days' and isinstance(cval, list):
+                f_days = [int(dn) for dn in cval if isinstance(dn, (str, int)) and str(dn).isdigit()]
+                required_off_days.setdefault(nurse_id, set()).update(d for d, day in enumerate(days) if day.day in f_days)
+    return required_off_days, forbidden_masks, no_double_ids
+
+
+def build_schedule_index(version, nurses=None):
+    """ScheduleIndex from the boundary state, hard constraints and approved requests stored with the version.
+
+    Returns None for versions saved before these were stored. nurses overrides the stored constraints.
+    """
+    params = version['params']
+    if not all(key in params for key in ('previousStates', 'nurseHardConstraints', 'approvedHardRequests')):
+        return None
+    days = [datetime.date.fromisoformat(day_iso) for day_iso in version['days']]
+    num_days = len(days)
+    masks_by_nurse = {nurse_id: version['masks'][i * num_days:(i + 1) * num_days] for i, nurse_id in enumerate(version['nurseIds'])}
+    gov_ids = set(params.get('govNurseIds', []))
+    rule_profile = compile_rule_profile(params.get('ruleProfile'), DEFAULT_RULE_PROFILE)
+
+    if nurses is None:
+        nurses = [{'id': nurse_id, 'constraints': constraints} for nurse_id, constraints in params['nurseHardConstraints'].items()]
+    required_off_days, forbidden_masks, no_double_ids = nurse_hard_rules_for_index(nurses, days, rule_profile.disabled_rule_types)
+    day_pos = {day_iso: d for d, day_iso in enumerate(version['days'])}
+    for req_nurse_id, req_date_str in params['approvedHardRequests']:
+        if req_date_str in day_pos:
+            required_off_days.setdefault(req_nurse_id, set()).add(day_pos[req_date_str])
+
+    rules = {
+        'max_consecutive_shifts': int(params.get('maxConsecutiveShiftsWorked', 6)),
+        'max_consecutive_same_shift': rule_profile.max_consecutive_same_shift, 'max_consecutive_off_days': rule_profile.max_consecutive_off_days,
+        'min_off_days_in_window': rule_profile.min_off_days_in_window, 'window_size_for_min_off': rule_profile.window_size_for_min_off,
+    }
+    return ScheduleIndex(version['nurseIds'], days, masks_by_nurse, gov_ids, set(params.get('holidays', [])), rules,
+                         params['previousStates'], required_off_days, forbidden_masks, no_double_ids)
+
+
+def get_schedule_index(ward, version_id=None, day_iso=None, nurses=None):
+    """Cached ScheduleIndex for a stored version (or the published one covering day_iso). Returns (index, version).
+
+    index is None when the version predates the stored swap-check data.
+    """
+    if version_id is not None:
+        version = schedule_store.get_version(version_id)
+    else:
+        version = schedule_store.find_version_covering(ward, day_iso, published_only=True)
+    if not version or version['ward'] != ward:
+        return None, None
+    cache_key = (version['id'], compute_input_hash(nurses) if nurses is not None else None)
+    with schedule_index_cache_lock:
+        cached = schedule_index_cache.get(cache_key)
+        if cached is not None:
+            schedule_index_cache.move_to_end(cache_key)
+            return cached, version
+    build_start = time.time()
+    index = build_schedule_index(version, nurses)
+    if index is None:
+        return None, version
+    print(f"Built swap index for schedule version {version['id']} in {(time.time() - build_start) * 1000:.1f}ms.")
+    with schedule_index_cache_lock:
+        schedule_index_cache[cache_key] = index
+        schedule_index_cache.move_to_end(cache_key)
+        while len(schedule_index_cache) > SCHEDULE_INDEX_CACHE_SIZE:
+            schedule_index_cache.popitem(last=False)
+    return index, version
+
+
+def parse_version_id(value):
+    """Optional versionId from a request body; raises ValueError when it is not an integer."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or not str(value).isdigit():
+        raise ValueError(f"versionId must be an integer, got {value!r}")
+    return int(value)
+
+
+def parse_swap(item):
+    swap = {k: item[k] for k in ('requesterId', 'requesterDate', 'targetId', 'targetDate')}
+    swap['requesterShifts'] = [int(s) for s in item.get('requesterShifts', [])]
+    swap['targetShifts'] = [int(s) for s in item.get('targetShifts', [])]
+    return swap
+
+
+def _aggregate_query_args():
+    ward = request.args.get('ward')
+    if not ward: raise ValueError("ต้องระบุ ward")
+    return ward, int(request.args['year']), request.args.get('nurseId')
+
+
+@app.route('/aggregates/monthly', methods=['GET'])
+def monthly_aggregates_api():
+    if not schedule_store: return jsonify({"error": "Schedule store ไม่พร้อมใช้งาน"}), 503
+    try:
+        ward, year, nurse_id = _aggregate_query_args()
+        month = int(request.args['month'])
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"พารามิเตอร์ไม่ถูกต้อง: {e}"}), 400
+    stats = schedule_store.get_month_stats(ward, year, month, nurse_id)
+    return jsonify({"ward": ward, "year": year, "month": month, "nurses": stats, "summary": summarize_stats(stats)}), 200
+
+
+@app.route('/aggregates/yearly', methods=['GET'])
+def yearly_aggregates_api():
+    if not schedule_store: return jsonify({"error": "Schedule store ไม่พร้อมใช้งาน"}), 503
+    try:
+        ward, year, nurse_id = _aggregate_query_args()
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"พารามิเตอร์ไม่ถูกต้อง: {e}"}), 400
+    stats = schedule_store.get_year_stats(ward, year, nurse_id)
+    return jsonify({"ward": ward, "year": year, "nurses": stats, "summary": summarize_stats(stats)}), 200
+
+
+@app.route('/swaps/apply', methods=['POST'])
+def apply_swap_api():
+    if not schedule_store: return jsonify({"error": "Schedule store ไม่พร้อมใช้งาน"}), 503
+    data = request.get_json(silent=True)
+    if not data: return jsonify({"error": "Invalid JSON payload"}), 400
+    try:
+        ward = str(data['ward'])
+        swap = parse_swap(data)
+        version_id = parse_version_id(data.get('versionId'))
+        # The swap is applied to the version the admin saw, never to whichever version happens to be newest.
+        if version_id is None: raise ValueError("ต้องระบุ versionId ของตารางเวรที่บันทึกไว้")
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"ข้อมูลการแลกเวรไม่ถูกต้อง: {e}"}), 400
+
+    index, version = get_schedule_index(ward, version_id, swap['requesterDate'])
+    if not version:
+        return jsonify({"error": "ไม่พบตารางเวรของวอร์ดนี้ที่ครอบคลุมวันที่แลกเวร"}), 404
+    if index is None:
+        return jsonify({"error": INDEX_DATA_MISSING_ERROR}), 409
+    latest = schedule_store.latest_version(ward, version['startDate'], include_cells=False, published_only=True)
+    if latest is None or latest['id'] != version['id']:
+        return jsonify({"error": "ตารางเวรถูกแก้ไขไปแล้ว กรุณาตรวจสอบการแลกเวรกับตารางเวรล่าสุดอีกครั้ง", "latestVersionId": latest['id'] if latest else None}), 409
+    try:
+        check = index.check_swaps([swap])
+    except KeyError as e:
+        return jsonify({"error": f"ไม่พบพยาบาลหรือวันที่ในตารางเวร: {e}"}), 400
+    if not check["feasible"]:
+        return jsonify({"error": "การแลกเวรขัดกับข้อกำหนดของตารางเวร", "violations": check["violations"]}), 409
+
+    new_grid = apply_swap_to_grid(version_nurse_shifts(version), swap)
+    first_day = datetime.date.fromisoformat(version['days'][0])
+    year, month = first_day.year, first_day.month
+    # A swap only moves shifts between the two nurses, so only their rows are recomputed.
+    swapped_stats = version_month_stats(version, new_grid, sorted({swap['requesterId'], swap['targetId']}))
+    if 'monthlyRequests' not in version['params']:
+        # Versions saved before monthly requests were stored cannot be re-judged; keep their counts.
+        previous_stats = schedule_store.get_month_stats(ward, year, month)
+        for nurse_id, nurse_stats in swapped_stats.items():
+            for key in ("requestsTotal", "requestsMet"):
+                nurse_stats[key] = previous_stats.get(nurse_id, {}).get(key, 0)
+
+    solver_stats = {"source": "swap", "baseVersionId": version['id'], "swapRequestId": data.get('swapRequestId')}
+    new_version_id = schedule_store.save_derived_version(version, new_grid, solver_stats, year, month, swapped_stats)
+    if new_version_id is None:
+        return jsonify({"error": "ตารางเวรถูกแก้ไขไปแล้ว กรุณาตรวจสอบการแลกเวรกับตารางเวรล่าสุดอีกครั้ง"}), 409
+    with schedule_index_cache_lock:
+        for cache_key in [key for key in schedule_index_cache if key[0] == version['id']]:
+            cached_index = schedule_index_cache.pop(cache_key)
+            cached_index.apply_swaps([swap])
+            schedule_index_cache[(new_version_id, cache_key[1])] = cached_index
+    print(f"Applied swap {swap['requesterId']}@{swap['requesterDate']} <-> {swap['targetId']}@{swap['targetDate']} as schedule version {new_version_id}.")
+
+    return jsonify({
+        "scheduleVersionId": new_version_id, "baseVersionId": version['id'],
+        "changes": diff_versions(version, schedule_store.get_version(new_version_id)),
+        "nurses": swapped_stats
+    }), 200
+
+
+@app.route('/swaps/check', methods=['POST'])
+def check_swaps_api():
+    if not schedule_store: return jsonify({"error": "Schedule store ไม่พร้อมใช้งาน"}), 503
+    data = request.get_json(silent=True)
+    if not data: return jsonify({"error": "Invalid JSON payload"}), 400
+    try:
+        ward = str(data['ward'])
+        swaps = [parse_swap(item) for item in data['swaps']] if 'swaps' in data else [parse_swap(data)]
+        if not swaps: raise ValueError("'swaps' is empty")
+        version_id = parse_version_id(data.get('versionId'))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"ข้อมูลการแลกเวรไม่ถูกต้อง: {e}"}), 400
+    index, version = get_schedule_index(ward, version_id, swaps[0]['requesterDate'], data.get('nurses'))
+    if not version:
+        return jsonify({"error": "ไม่พบตารางเวรของวอร์ดนี้ที่ครอบคลุมวันที่แลกเวร"}), 404
+    if index is None:
+        return jsonify({"error": INDEX_DATA_MISSING_ERROR}), 409
+    try:
+        result = index.check_swaps(swaps)
+    except KeyError as e:
+        return jsonify({"error": f"ไม่พบพยาบาลหรือวันที่ในตารางเวร: {e}"}), 400
+    result.update({"versionId": version['id'], "checkedSwaps": len(swaps)})
+    return jsonify(result), 200
+
+
+@app.route('/swaps/partners', methods=['POST'])
+def swap_partners_api():
+    if not schedule_store: return jsonify({"error": "Schedule store ไม่พร้อมใช้งาน"}), 503
+    data = request.get_json(silent=True)
+    if not data: return jsonify({"error": "Invalid JSON payload"}), 400
+    try:
+        ward, nurse_id, day_iso = str(data['ward']), data['nurseId'], data['date']
+        version_id = parse_version_id(data.get('versionId'))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"ข้อมูลไม่ถูกต้อง: {e}"}), 400
+    index, version = get_schedule_index(ward, version_id, day_iso, data.get('nurses'))
+    if not version:
+        return jsonify({"error": "ไม่พบตารางเวรของวอร์ดนี้ที่ครอบคลุมวันที่"}), 404
+    if index is None:
+        return jsonify({"error": INDEX_DATA_MISSING_ERROR}), 409
+    if nurse_id not in index.rows or day_iso not in index.day_pos:
+        return jsonify({"error": "ไม่พบพยาบาลหรือวันที่ในตารางเวร"}), 400
+    partners, elapsed_us = index.feasible_partners(nurse_id, day_iso, data.get('shifts'), bool(data.get('includeGiveaways', False)))
+    return jsonify({"versionId": version['id'], "partners": partners, "elapsedMicroseconds": elapsed_us}), 200
+
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
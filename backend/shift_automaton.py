@@ -0,0 +1,98 @@
+import functools
+from ortools.sat.python import cp_model
+
+# Day labels for non-gov nurses. The label value equals M + 2*A + 3*N, so it is a linear function of the
+# shift booleans (morning cannot be combined with other shifts, the only double is night + afternoon).
+LABEL_OFF = 0
+LABEL_MORNING = 1
+LABEL_AFTERNOON = 2
+LABEL_NIGHT = 3
+LABEL_NA_DOUBLE = 5
+DAY_LABELS = [LABEL_OFF, LABEL_MORNING, LABEL_AFTERNOON, LABEL_NIGHT, LABEL_NA_DOUBLE]
+
+# One extra symbol after the last day records whether the month ends at the consecutive-shift limit.
+LABEL_END_AT_MAX = 6
+LABEL_END_BELOW_MAX = 7
+
+LABEL_SHIFTS = {
+    LABEL_OFF: (False, False, False), LABEL_MORNING: (True, False, False), LABEL_AFTERNOON: (False, True, False),
+    LABEL_NIGHT: (False, False, True), LABEL_NA_DOUBLE: (False, True, True),
+}
+
+
+def start_state(prev_state, max_consecutive_shifts, max_same_shift):
+    """Automaton state (consecutive shifts, off run, M/A/N runs, last day had afternoon) carried over from last month."""
+    last_counts = prev_state.get('last_shift_types_count', {})
+    consecutive = 0 if prev_state.get('was_off_last_day', True) else prev_state.get('consecutive_shifts', 0)
+    return (
+        min(consecutive, max_consecutive_shifts), 0,
+        tuple(min(int(last_counts.get(s, last_counts.get(str(s), 0))), max_same_shift) for s in (1, 2, 3)),
+        2 in prev_state.get('last_day_shifts', []),
+    )
+
+
+def _step(state, label, max_consecutive_shifts, max_consecutive_off, max_same_shift):
+    consecutive, off_run, runs, last_afternoon = state
+    has_shift = LABEL_SHIFTS[label]
+    if last_afternoon and has_shift[2]:
+        return None
+    count = sum(has_shift)
+    if count:
+        consecutive, off_run = consecutive + count, 0
+        if consecutive > max_consecutive_shifts: return None
+    else:
+        consecutive, off_run = 0, off_run + 1
+        if off_run > max_consecutive_off: return None
+    runs = tuple(run + 1 if has else 0 for run, has in zip(runs, has_shift))
+    if max(runs) > max_same_shift:
+        return None
+    return (consecutive, off_run, runs, has_shift[1])
+
+
+@functools.lru_cache(maxsize=256)
+def build_automaton(start, max_consecutive_shifts, max_consecutive_off, max_same_shift):
+    """Builds the consecutive-rule automaton reachable from `start`.
+
+    Returns (start state id, final state ids, transitions) in the form AddAutomaton expects. Only the
+    sink state reached through one of the end symbols is final, so the label sequence must be one value
+    per day followed by exactly one end symbol.
+    """
+    state_ids = {start: 0}
+    queue = [start]
+    transitions = []
+    end_transitions = []
+    while queue:
+        state = queue.pop()
+        state_id = state_ids[state]
+        for label in DAY_LABELS:
+            next_state = _step(state, label, max_consecutive_shifts, max_consecutive_off, max_same_shift)
+            if next_state is None:
+                continue
+            if next_state not in state_ids:
+                state_ids[next_state] = len(state_ids)
+                queue.append(next_state)
+            transitions.append((state_id, label, state_ids[next_state]))
+        end_transitions.append((state_id, LABEL_END_AT_MAX if state[0] == max_consecutive_shifts else LABEL_END_BELOW_MAX))
+    sink = len(state_ids)
+    transitions.extend((state_id, label, sink) for state_id, label in end_transitions)
+    return 0, (sink,), tuple(transitions)
+
+
+def add_consecutive_automaton(model, name, day_shifts, start, max_consecutive_shifts, max_consecutive_off, max_same_shift):
+    """Adds one AddAutomaton constraint over a nurse's month.
+
+    `day_shifts` holds the (morning, afternoon, night) booleans of each day. Returns the boolean that is
+    true when the month ends at the consecutive-shift limit.
+    """
+    start_id, final_ids, transitions = build_automaton(start, max_consecutive_shifts, max_consecutive_off, max_same_shift)
+    label_domain = cp_model.Domain.FromValues(DAY_LABELS)
+    labels = []
+    for d, (morning, afternoon, night) in enumerate(day_shifts):
+        label = model.NewIntVarFromDomain(label_domain, f'{name}_lbl_d{d}')
+        model.Add(label == morning + 2 * afternoon + 3 * night)
+        labels.append(label)
+    ends_at_max = model.NewBoolVar(f'{name}_ends_max')
+    end_label = model.NewIntVar(LABEL_END_AT_MAX, LABEL_END_BELOW_MAX, f'{name}_end')
+    model.Add(end_label == LABEL_END_BELOW_MAX - ends_at_max)
+    model.AddAutomaton(labels + [end_label], start_id, list(final_ids), list(transitions))
+    return ends_at_max
@@ -0,0 +1,209 @@
+import time
+from schedule_store import shifts_to_mask, mask_to_shifts
+
+# Shift ids follow server.py (1 = morning, 2 = afternoon, 3 = night).
+MORNING_BIT = shifts_to_mask([1])
+AFTERNOON_BIT = shifts_to_mask([2])
+NIGHT_BIT = shifts_to_mask([3])
+SHIFT_BITS = [MORNING_BIT, AFTERNOON_BIT, NIGHT_BIT]
+
+RULE_MESSAGES = {
+    'shift_not_held': "ไม่มีเวรนี้ในตารางเวรปัจจุบัน",
+    'duplicate_shift': "พยาบาลมีเวรนี้อยู่แล้วในวันเดียวกัน",
+    'gov_fixed_schedule': "ข้าราชการต้องทำเวรเช้าวันธรรมดาและหยุดวันหยุด",
+    'invalid_combination': "ไม่สามารถควบเวรเช้ากับเวรอื่นในวันเดียวกันได้",
+    'hard_off_day': "วันนี้เป็นวันหยุดบังคับของพยาบาล",
+    'forbidden_shift': "พยาบาลไม่สามารถทำเวรประเภทนี้ได้",
+    'forbidden_double': "พยาบาลไม่สามารถควบเวรดึก-บ่ายได้",
+    'afternoon_to_night': "ห้ามเวรดึกต่อจากเวรบ่ายของวันก่อนหน้า",
+    'max_consecutive_shifts': "เกินจำนวนเวรติดต่อกันสูงสุด",
+    'max_consecutive_same_shift': "เกินจำนวนเวรประเภทเดียวกันติดต่อกันสูงสุด",
+    'max_consecutive_off_days': "เกินจำนวนวันหยุดติดต่อกันสูงสุด",
+    'min_off_in_window': "วันหยุดในช่วงวันไม่ถึงขั้นต่ำ",
+}
+
+
+class ScheduleIndex:
+    """In-memory index of a published schedule for checking swaps against the hard rules.
+
+    For every non-gov nurse it keeps, per day, the run of consecutive shifts, the run of off days and
+    the run of each shift type ending on that day. A change is checked by re-scanning from the first
+    changed day only until the recomputed state meets the indexed state again, so a swap costs a few
+    days of work per nurse regardless of the schedule length.
+    """
+
+    def __init__(self, nurse_ids, days, masks_by_nurse, gov_ids, holiday_day_numbers, rules,
+                 previous_states=None, required_off_days=None, forbidden_masks=None, no_double_ids=None):
+        self.nurse_ids = list(nurse_ids)
+        self.days = list(days)
+        self.days_iso = [day.isoformat() for day in self.days]
+        self.day_pos = {day_iso: d for d, day_iso in enumerate(self.days_iso)}
+        self.gov_ids = set(gov_ids)
+        self.rules = rules
+        self.rows = {nurse_id: list(masks_by_nurse[nurse_id]) for nurse_id in self.nurse_ids}
+        self.required_off_days = {nurse_id: set(ds) for nurse_id, ds in (required_off_days or {}).items()}
+        self.forbidden_masks = dict(forbidden_masks or {})
+        self.no_double_ids = set(no_double_ids or [])
+        self.gov_fixed_masks = [
+            0 if day.weekday() >= 5 or day.day in holiday_day_numbers else MORNING_BIT for day in self.days
+        ]
+        self.initial_states = {}
+        for nurse_id in self.nurse_ids:
+            prev = (previous_states or {}).get(nurse_id) or {}
+            last_counts = prev.get('last_shift_types_count', {})
+            self.initial_states[nurse_id] = (
+                0 if prev.get('was_off_last_day', True) else prev.get('consecutive_shifts', 0),
+                0,
+                tuple(int(last_counts.get(s, last_counts.get(str(s), 0))) for s in (1, 2, 3)),
+                shifts_to_mask(prev.get('last_day_shifts', [])),
+            )
+        self.states = {}
+        self.off_prefix = {}
+        for nurse_id in self.nurse_ids:
+            self._rebuild_nurse(nurse_id, 0)
+
+    @staticmethod
+    def _step(state, mask):
+        work, off, same, _ = state
+        count = bin(mask).count('1')
+        return (
+            work + count if count else 0,
+            0 if count else off + 1,
+            tuple(same[i] + 1 if mask & bit else 0 for i, bit in enumerate(SHIFT_BITS)),
+            mask,
+        )
+
+    def _rebuild_nurse(self, nurse_id, from_day):
+        row = self.rows[nurse_id]
+        states = self.states.setdefault(nurse_id, [None] * len(row))
+        state = self.initial_states[nurse_id] if from_day == 0 else states[from_day - 1]
+        for d in range(from_day, len(row)):
+            state = self._step(state, row[d])
+            states[d] = state
+        prefix = [0]
+        for mask in row:
+            prefix.append(prefix[-1] + (mask == 0))
+        self.off_prefix[nurse_id] = prefix
+
+    def _violation(self, nurse_id, d, rule):
+        return {"nurseId": nurse_id, "date": self.days_iso[d], "rule": rule, "message": RULE_MESSAGES[rule]}
+
+    def _check_nurse(self, nurse_id, overrides):
+        row = self.rows[nurse_id]
+        changed = sorted(overrides)
+        violations = []
+
+        if nurse_id in self.gov_ids:
+            for d in changed:
+                if overrides[d] != self.gov_fixed_masks[d]:
+                    violations.append(self._violation(nurse_id, d, 'gov_fixed_schedule'))
+            return violations
+
+        forbidden_mask = self.forbidden_masks.get(nurse_id, 0)
+        required_off = self.required_off_days.get(nurse_id, ())
+        for d in changed:
+            mask = overrides[d]
+            if mask & MORNING_BIT and mask & (AFTERNOON_BIT | NIGHT_BIT):
+                violations.append(self._violation(nurse_id, d, 'invalid_combination'))
+            if mask and d in required_off:
+                violations.append(self._violation(nurse_id, d, 'hard_off_day'))
+            if mask & forbidden_mask:
+                violations.append(self._violation(nurse_id, d, 'forbidden_shift'))
+            if nurse_id in self.no_double_ids and mask & AFTERNOON_BIT and mask & NIGHT_BIT:
+                violations.append(self._violation(nurse_id, d, 'forbidden_double'))
+
+        rules = self.rules
+        states = self.states[nurse_id]
+        d = changed[0]
+        state = self.initial_states[nurse_id] if d == 0 else states[d - 1]
+        while d < len(row):
+            mask = overrides.get(d, row[d])
+            if state[3] & AFTERNOON_BIT and mask & NIGHT_BIT:
+                violations.append(self._violation(nurse_id, d, 'afternoon_to_night'))
+            state = self._step(state, mask)
+            if rules['max_consecutive_shifts'] > 0 and state[0] > rules['max_consecutive_shifts']:
+                violations.append(self._violation(nurse_id, d, 'max_consecutive_shifts'))
+            if rules['max_consecutive_same_shift'] > 0 and max(state[2]) > rules['max_consecutive_same_shift']:
+                violations.append(self._violation(nurse_id, d, 'max_consecutive_same_shift'))
+            if rules['max_consecutive_off_days'] > 0 and state[1] > rules['max_consecutive_off_days']:
+                violations.append(self._violation(nurse_id, d, 'max_consecutive_off_days'))
+            if d >= changed[-1] and state == states[d]:
+                break
+            d += 1
+
+        window, min_off = rules['window_size_for_min_off'], rules['min_off_days_in_window']
+        if min_off > 0 and len(row) >= window:
+            prefix = self.off_prefix[nurse_id]
+            delta = {d: (overrides[d] == 0) - (row[d] == 0) for d in changed}
+            starts = set()
+            for d in changed:
+                starts.update(range(max(0, d - window + 1), min(d, len(row) - window) + 1))
+            for start in sorted(starts):
+                off_count = prefix[start + window] - prefix[start] + sum(v for d, v in delta.items() if start <= d < start + window)
+                if off_count < min_off:
+                    violations.append(self._violation(nurse_id, start, 'min_off_in_window'))
+        return violations
+
+    def swap_changes(self, swaps):
+        """Turns swaps into per-nurse cell overrides, applied in order. Returns (overrides, violations)."""
+        overrides, violations = {}, []
+
+        def cell(nurse_id, d):
+            return overrides.get(nurse_id, {}).get(d, self.rows[nurse_id][d])
+
+        for swap in swaps:
+            moves = [
+                (swap['requesterId'], swap['targetId'], swap['requesterDate'], shifts_to_mask(swap.get('requesterShifts', []))),
+                (swap['targetId'], swap['requesterId'], swap['targetDate'], shifts_to_mask(swap.get('targetShifts', []))),
+            ]
+            for from_id, to_id, day_iso, moved in moves:
+                if from_id not in self.rows or to_id not in self.rows or day_iso not in self.day_pos:
+                    raise KeyError(f"Unknown nurse or date in swap: {from_id} -> {to_id} on {day_iso}")
+                d = self.day_pos[day_iso]
+                if cell(from_id, d) & moved != moved:
+                    violations.append(self._violation(from_id, d, 'shift_not_held'))
+                if cell(to_id, d) & moved:
+                    violations.append(self._violation(to_id, d, 'duplicate_shift'))
+                overrides.setdefault(from_id, {})[d] = cell(from_id, d) & ~moved
+                overrides.setdefault(to_id, {})[d] = cell(to_id, d) | moved
+        return overrides, violations
+
+    def check_swaps(self, swaps):
+        started = time.perf_counter()
+        overrides, violations = self.swap_changes(swaps)
+        for nurse_id, nurse_overrides in overrides.items():
+            changed = {d: mask for d, mask in nurse_overrides.items() if mask != self.rows[nurse_id][d]}
+            if changed:
+                violations.extend(self._check_nurse(nurse_id, changed))
+        return {
+            "feasible": not violations, "violations": violations,
+            "elapsedMicroseconds": round((time.perf_counter() - started) * 1e6, 1),
+        }
+
+    def apply_swaps(self, swaps):
+        """Commits swaps into the index, updating run lengths only from the first changed day."""
+        overrides, _ = self.swap_changes(swaps)
+        for nurse_id, nurse_overrides in overrides.items():
+            for d, mask in nurse_overrides.items():
+                self.rows[nurse_id][d] = mask
+            self._rebuild_nurse(nurse_id, min(nurse_overrides))
+
+    def feasible_partners(self, nurse_id, day_iso, shift_list=None, include_giveaways=False):
+        """Every (nurse, date, shifts) the nurse could exchange the given shifts with without breaking a hard rule."""
+        started = time.perf_counter()
+        d = self.day_pos[day_iso]
+        offered = mask_to_shifts(self.rows[nurse_id][d]) if shift_list is None else sorted(int(s) for s in shift_list)
+        partners = []
+        for target_id in self.nurse_ids:
+            if target_id == nurse_id or target_id in self.gov_ids:
+                continue
+            for target_d, target_mask in enumerate(self.rows[target_id]):
+                if not target_mask and not (include_giveaways and target_d == d):
+                    continue
+                swap = {
+                    "requesterId": nurse_id, "requesterDate": day_iso, "requesterShifts": offered,
+                    "targetId": target_id, "targetDate": self.days_iso[target_d], "targetShifts": mask_to_shifts(target_mask),
+                }
+                if self.check_swaps([swap])["feasible"]:
+                    partners.append({"targetId": target_id, "targetDate": swap["targetDate"], "targetShifts": swap["targetShifts"]})
+        return partners, round((time.perf_counter() - started) * 1e6, 1)
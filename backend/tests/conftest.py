@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# server.py opens its store at import time; keep tests off the working directory.
+os.environ.setdefault('SCHEDULE_STORE_PATH', ':memory:')
+
+from schedule_store import ScheduleStore
+
+
+@pytest.fixture
+def store():
+    return ScheduleStore(':memory:')
+
+
+@pytest.fixture
+def server_app(monkeypatch, store):
+    """server.py with a fresh in-memory store, no Firestore and empty in-process caches."""
+    import server
+    monkeypatch.setattr(server, 'schedule_store', store)
+    monkeypatch.setattr(server, 'db_admin', None)
+    server.schedule_index_cache.clear()
+    return server
+
+
+def small_payload(num_nurses=5, start='2025-03-03', end='2025-03-09', **overrides):
+    payload = {
+        'nurses': [{'id': f'n{i}', 'isGovernmentOfficial': False, 'constraints': []} for i in range(1, num_nurses + 1)],
+        'schedule': {'startDate': start, 'endDate': end},
+        'requiredNursesMorning': 1, 'requiredNursesAfternoon': 1, 'requiredNursesNight': 1,
+        'maxConsecutiveShiftsWorked': 6, 'targetOffDays': 2, 'solverTimeLimit': 3,
+        'monthly_soft_requests': {}, 'holidays': [], 'ward': 'w1',
+    }
+    payload.update(overrides)
+    return payload
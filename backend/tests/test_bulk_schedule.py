@@ -0,0 +1,78 @@
+import csv
+import json
+
+import bulk_schedule
+from bulk_schedule import TIMING_COLUMNS, chain_from_previous, compare_with_baseline, group_by_ward, load_payloads, solve_group
+
+
+def month_payload(ward, month):
+    return {'ward': ward, 'schedule': {'startDate': f'2025-{month:02d}-01', 'endDate': f'2025-{month:02d}-28'}, 'nurses': []}
+
+
+def fake_solver(monkeypatch, failing_months=()):
+    import server
+    calls = []
+
+    def solve(data):
+        calls.append(data)
+        month = int(data['schedule']['startDate'][5:7])
+        if month in failing_months:
+            return {'error': 'infeasible', 'solverStats': {'status': 'INFEASIBLE'}}, 500
+        return {'days': [f'2025-{month:02d}-01'], 'nurseSchedules': {}, 'fairnessHistoryNext': {'n1': {'total': month}},
+                'solverStats': {'status': 'OPTIMAL', 'objective': 10}, 'modelStats': {}}, 200
+    monkeypatch.setattr(server, 'solve_schedule_request', solve)
+    return calls
+
+
+def test_load_payloads_and_group_by_ward(tmp_path):
+    (tmp_path / 'batch.jsonl').write_text('\n'.join(json.dumps(p) for p in [
+        {'id': 'b', 'payload': month_payload('w1', 2)}, month_payload('w2', 1), {'id': 'a', 'payload': month_payload('w1', 1)},
+    ]) + '\n\n')
+    (tmp_path / 'single.json').write_text(json.dumps({'schedule': {'startDate': '2025-01-01'}}))
+    payloads = load_payloads([str(tmp_path)])
+    assert [payload_id for payload_id, _ in payloads] == ['b', 'batch:2', 'a', 'single']
+    groups = group_by_ward(payloads)
+    assert [[payload_id for payload_id, _ in group] for group in groups] == [['a', 'b'], ['batch:2'], ['single']]
+
+
+def test_chain_does_not_override_payload_fields():
+    previous = {'days': ['d'], 'nurseSchedules': {'n1': {}}, 'fairnessHistoryNext': {'n1': {}}, 'nextCarryOverFlags': {'n1': True}}
+    chained = chain_from_previous({'carry_over_flags': {}}, previous)
+    assert chained['previousMonthSchedule'] == {'days': ['d'], 'nurseSchedules': {'n1': {}}}
+    assert chained['fairnessHistory'] == {'n1': {}}
+    assert chained['carry_over_flags'] == {}
+
+
+def test_failed_month_marks_rest_of_ward_unchained(monkeypatch):
+    calls = fake_solver(monkeypatch, failing_months={2})
+    group = [(f'm{m}', month_payload('w1', m)) for m in (1, 2, 3, 4)]
+    rows = solve_group(group, True, None, False)
+    timings = [timing for _, timing in rows]
+    assert [t['chained_from'] for t in timings] == ['', 'm1', '', 'm3']
+    assert [t['chain_broken'] for t in timings] == [0, 0, 1, 1]
+    assert 'previousMonthSchedule' not in calls[2] and calls[3]['fairnessHistory'] == {'n1': {'total': 3}}
+
+
+def test_no_chain_disables_stored_state(monkeypatch):
+    calls = fake_solver(monkeypatch, failing_months={1})
+    rows = solve_group([(f'm{m}', month_payload('w1', m)) for m in (1, 2)], False, 5, False)
+    assert all(call['warmStart'] is False and call['useStoredFairnessHistory'] is False and call['solverTimeLimit'] == 5 for call in calls)
+    assert [timing['chain_broken'] for _, timing in rows] == [0, 0]
+
+
+def test_compare_with_baseline(tmp_path):
+    base_row = {column: '' for column in TIMING_COLUMNS}
+    baseline_path = tmp_path / 'baseline.csv'
+    with open(baseline_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=TIMING_COLUMNS)
+        writer.writeheader()
+        for payload_id in ('a', 'b', 'c'):
+            writer.writerow(dict(base_row, payload_id=payload_id, http_status=200, solver_status='OPTIMAL', objective=100, total_s=10, chain_broken=0))
+    timings = [
+        dict(base_row, payload_id='a', http_status=200, solver_status='FEASIBLE', objective=100, total_s=10, chain_broken=0),
+        dict(base_row, payload_id='b', http_status=200, solver_status='OPTIMAL', objective=120, total_s=20, chain_broken=0),
+        dict(base_row, payload_id='c', http_status=500, solver_status='', objective='', total_s=50, chain_broken=1),
+    ]
+    regressions = compare_with_baseline(timings, baseline_path, 1.5, 0.05)
+    assert len(regressions) == 3
+    assert regressions[0].startswith('a: status') and regressions[1].startswith('b: objective') and regressions[2].startswith('b: total time')
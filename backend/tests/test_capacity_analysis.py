@@ -0,0 +1,63 @@
+import datetime
+
+from capacity_analysis import analyze_capacity
+from conftest import small_payload
+
+DAYS = [datetime.date(2025, 3, 3) + datetime.timedelta(days=d) for d in range(7)]
+RULES = {'max_consecutive_shifts': 6, 'max_consecutive_same_shift': 2, 'max_consecutive_off_days': 2,
+         'min_off_days_in_window': 0, 'window_size_for_min_off': 7}
+NURSES = [f'n{i}' for i in range(1, 6)]
+ONE_EACH = {1: 1, 2: 1, 3: 1}
+
+
+def error_codes(result):
+    return [error['code'] for error in result['errors']]
+
+
+def test_feasible_ward_has_no_errors():
+    result = analyze_capacity(NURSES, DAYS, set(), set(), ONE_EACH, RULES, target_off_days=2)
+    assert result['feasible'], result['errors']
+    assert result['bounds']['demandShifts'] == 21
+    assert result['bounds']['maxShifts'] >= 21
+
+
+def test_gov_nurses_exceeding_morning_demand():
+    result = analyze_capacity(NURSES + ['g1', 'g2'], DAYS, {'g1', 'g2'}, set(), ONE_EACH, RULES)
+    # Saturday and Sunday have no fixed government mornings.
+    assert [e['date'] for e in result['errors'] if e['code'] == 'gov_exceeds_morning'] == [day.isoformat() for day in DAYS[:5]]
+
+
+def test_required_off_days_leave_shift_uncovered():
+    required_off = {nurse_id: {2} for nurse_id in NURSES[:3]}
+    result = analyze_capacity(NURSES, DAYS, set(), set(), {1: 1, 2: 1, 3: 2}, RULES, required_off_days=required_off)
+    assert not result['feasible']
+    assert {'code': 'day_supply_short', 'date': '2025-03-05'}.items() <= next(
+        e for e in result['errors'] if e['code'] == 'day_supply_short').items()
+
+
+def test_forbidden_shift_for_everyone():
+    forbidden = {nurse_id: 0b100 for nurse_id in NURSES}
+    result = analyze_capacity(NURSES, DAYS, set(), set(), ONE_EACH, RULES, forbidden_masks=forbidden)
+    assert 'shift_supply_short' in error_codes(result)
+    assert all(e['shift'] == 'night' for e in result['errors'] if e['code'] == 'shift_supply_short')
+
+
+def test_nurse_with_no_valid_month():
+    # Off every day breaks the two-day limit on consecutive off days.
+    result = analyze_capacity(NURSES, DAYS, set(), set(), ONE_EACH, RULES, required_off_days={'n1': set(range(7))})
+    assert error_codes(result) == ['nurse_no_feasible_month']
+    assert result['errors'][0]['nurseId'] == 'n1'
+
+
+def test_previous_month_run_limits_first_days():
+    worked_six = {'last_day_shifts': [1], 'consecutive_shifts': 6, 'was_off_last_day': False, 'last_shift_types_count': {'1': 1}}
+    result = analyze_capacity(['n1'], DAYS[:1], set(), set(), {1: 1, 2: 0, 3: 0}, RULES, previous_states={'n1': worked_six})
+    assert 'shift_supply_short' in error_codes(result)
+
+
+def test_generate_schedule_rejects_proven_infeasible_input(server_app):
+    # Three nights a day leave nobody for the morning.
+    body, status_code = server_app.solve_schedule_request(small_payload(num_nurses=3, requiredNursesNight=3))
+    assert status_code == 422
+    assert 'day_supply_short' in error_codes(body['capacityAnalysis'])
+    assert server_app.schedule_store.latest_version('w1', '2025-03-03') is None
@@ -0,0 +1,40 @@
+import threading
+
+from schedule_store import compute_input_hash
+
+
+def test_identical_requests_share_one_solve(server_app, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    solves, hashes = [], []
+
+    def slow_solve(data, input_hash=None):
+        solves.append(input_hash)
+        started.set()
+        release.wait(5)
+        return {"scheduleVersionId": 1}, 200
+
+    def counting_hash(data):
+        hashes.append(data)
+        return compute_input_hash(data)
+    monkeypatch.setattr(server_app, 'solve_schedule_request', slow_solve)
+    monkeypatch.setattr(server_app, 'compute_input_hash', counting_hash)
+    payload = {'ward': 'w1', 'nurses': [{'id': 'n1'}]}
+    results = []
+    coalesced_before = server_app.solve_metrics["coalescedRequests"]
+    leader = threading.Thread(target=lambda: results.append(server_app.solve_schedule_coalesced(payload)))
+    leader.start()
+    assert started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(server_app.solve_schedule_coalesced(dict(payload)))) for _ in range(2)]
+    for thread in followers:
+        thread.start()
+    while server_app.solve_metrics["coalescedRequests"] < coalesced_before + 2:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert solves == [compute_input_hash(payload)]
+    assert len(hashes) == 3
+    assert sorted(body.get('coalesced', False) for body, _ in results) == [False, True, True]
+    assert all(status == 200 and body['scheduleVersionId'] == 1 for body, status in results)
+    assert server_app.inflight_solves == {}
@@ -0,0 +1,42 @@
+import pytest
+
+from conftest import small_payload
+
+
+def publish_month(store, year, month, totals):
+    store.record_month_stats('w1', year, month, None, {nurse_id: {'total': total} for nurse_id, total in totals.items()})
+
+
+def test_parse_fairness_history(server_app):
+    assert server_app.parse_fairness_history(None) == {}
+    assert server_app.parse_fairness_history({'n1': {'night': '2'}})['n1'] == {'total': 0, 'morning': 0, 'afternoon': 0, 'night': 2, 'daysOff': 0}
+    with pytest.raises(ValueError):
+        server_app.parse_fairness_history([])
+
+
+def test_stored_history_uses_only_earlier_months_across_year_end(server_app):
+    store = server_app.schedule_store
+    publish_month(store, 2024, 11, {'n1': 20, 'n2': 10})
+    publish_month(store, 2024, 12, {'n1': 22, 'n2': 18})
+    publish_month(store, 2025, 1, {'n1': 0, 'n2': 30})
+    publish_month(store, 2025, 2, {'n1': 0, 'n2': 50})
+    history = server_app.stored_fairness_history('w1', 2025, 1, ['n1', 'n2', 'n3'])
+    assert history == {
+        'n1': {'total': 7, 'morning': 0, 'afternoon': 0, 'night': 0, 'daysOff': 0},
+        'n2': {'total': -7, 'morning': 0, 'afternoon': 0, 'night': 0, 'daysOff': 0},
+    }
+
+
+def test_stored_history_window_length(server_app, monkeypatch):
+    store = server_app.schedule_store
+    publish_month(store, 2024, 1, {'n1': 40, 'n2': 0})
+    publish_month(store, 2024, 12, {'n1': 10, 'n2': 20})
+    monkeypatch.setattr(server_app, 'FAIRNESS_HISTORY_MONTHS', 12)
+    assert server_app.stored_fairness_history('w1', 2025, 1, ['n1', 'n2'])['n1']['total'] == 15
+    monkeypatch.setattr(server_app, 'FAIRNESS_HISTORY_MONTHS', 11)
+    assert server_app.stored_fairness_history('w1', 2025, 1, ['n1', 'n2'])['n1']['total'] == -5
+
+
+def test_null_fairness_history_is_no_history(server_app):
+    body, status_code = server_app.solve_schedule_request(small_payload(fairnessHistory=None))
+    assert status_code == 200, body
@@ -0,0 +1,39 @@
+from resource_limits import RssSampler, SolveMemoryBudget, estimate_solve_memory_mb
+
+
+def test_estimate_grows_with_size_and_workers():
+    assert estimate_solve_memory_mb(20, 31, 1) < estimate_solve_memory_mb(40, 31, 1) < estimate_solve_memory_mb(40, 62, 1)
+    assert estimate_solve_memory_mb(40, 31, 1) < estimate_solve_memory_mb(40, 31, 8)
+
+
+def test_reserve_downgrades_workers_then_reports_busy():
+    one, eight = estimate_solve_memory_mb(30, 31, 1), estimate_solve_memory_mb(30, 31, 8)
+    budget = SolveMemoryBudget(total_mb=eight + one + 1, per_job_mb=eight)
+    assert budget.reserve(30, 31, 8) == (8, eight, None)
+    workers, reserved_mb, reason = budget.reserve(30, 31, 8)
+    assert (workers, reason) == (1, None) and reserved_mb == one
+    assert budget.reserve(30, 31, 8) == (0, one, 'busy')
+    budget.release(eight)
+    budget.release(reserved_mb)
+    assert budget.reserved_mb == 0.0
+
+
+def test_reserve_rejects_jobs_over_per_job_limit():
+    one = estimate_solve_memory_mb(30, 31, 1)
+    budget = SolveMemoryBudget(total_mb=10 * one, per_job_mb=one - 1)
+    assert budget.reserve(30, 31, 8) == (0, one, 'too_large')
+    assert budget.reserved_mb == 0.0
+
+
+def test_release_never_goes_negative():
+    budget = SolveMemoryBudget(total_mb=100, per_job_mb=100)
+    budget.release(5)
+    assert budget.reserved_mb == 0.0
+
+
+def test_rss_sampler_tracks_peak():
+    with RssSampler(interval=0.01) as sampler:
+        data = bytearray(20 * 1024 * 1024)
+    del data
+    if sampler.start_mb is not None:
+        assert sampler.peak_mb >= sampler.start_mb
@@ -0,0 +1,70 @@
+import datetime
+
+import pytest
+from ortools.sat.python import cp_model
+
+import rules
+from rules import RULE_HANDLERS, RuleContext, apply_rules, compile_rule_profile
+
+DEFAULTS = {
+    'maxConsecutiveSameShift': 2, 'maxConsecutiveOffDays': 2, 'minOffDaysInWindow': 0, 'windowSizeForMinOff': 7,
+    'penalties': {key: 10 for key in rules.PROFILE_PENALTY_KEYS}, 'disabledRuleTypes': [],
+}
+
+
+def make_context(num_nurses=2, num_days=7):
+    model = cp_model.CpModel()
+    days = [datetime.date(2025, 3, 3) + datetime.timedelta(days=d) for d in range(num_days)]
+    shifts = {(n, d, s): model.NewBoolVar(f's{n}_{d}_{s}') for n in range(num_nurses) for d in range(num_days) for s in (1, 2, 3)}
+    is_off = {(n, d): model.NewBoolVar(f'off{n}_{d}') for n in range(num_nurses) for d in range(num_days)}
+    is_working = {key: var.Not() for key, var in is_off.items()}
+    return RuleContext(model, shifts, is_off, is_working, days, (1, 2, 3), {1: [1], 2: [2], 3: [3], 4: [3, 2]})
+
+
+def test_profile_overrides_and_validation():
+    profile = compile_rule_profile({'maxConsecutiveOffDays': 3, 'penalties': {'perNADouble': 0}, 'disabledRuleTypes': ['no_mondays']}, DEFAULTS)
+    assert profile.max_consecutive_off_days == 3 and profile.penalties['perNADouble'] == 0
+    assert profile.disabled_rule_types == {'no_mondays'}
+    assert compile_rule_profile(None, DEFAULTS).max_consecutive_same_shift == 2
+    for bad in ({'unknown': 1}, {'maxConsecutiveOffDays': 0}, {'penalties': {'perNADouble': -1}},
+                {'disabledRuleTypes': ['no_such_rule']}, {'disabledRuleTypes': [['no_mondays']]}, ['no_mondays']):
+        with pytest.raises(ValueError):
+            compile_rule_profile(bad, DEFAULTS)
+
+
+def test_compiled_profile_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(rules, 'COMPILED_PROFILE_CACHE_SIZE', 3)
+    for off_days in range(1, 10):
+        compile_rule_profile({'maxConsecutiveOffDays': off_days}, DEFAULTS)
+    assert len(rules._compiled_profiles) <= 3
+
+
+def test_handlers_run_once_per_type_with_all_valid_items(monkeypatch):
+    calls = []
+    monkeypatch.setitem(RULE_HANDLERS, 'no_specific_days', lambda ctx, rule_type, items: calls.append((rule_type, list(items))))
+    items = [(0, ['3'], 15, 'req0'), (1, 'not a list', 15, 'req1'), (1, ['4', '5'], None, 'pc0')]
+    ctx = make_context()
+    apply_rules(ctx, {'no_specific_days': items}, compile_rule_profile(None, DEFAULTS))
+    assert calls == [('no_specific_days', [items[0], items[2]])]
+    assert ctx.stats['no_specific_days']['items'] == 2
+    assert ctx.stats['no_specific_days']['invalidItems'] == 1
+
+
+def test_malformed_specific_shift_request_keeps_valid_ones():
+    items = [(0, [{'day': 3, 'shift_type': 1}], 30, 'req0'), (1, ['bad'], 30, 'req1'), (1, [{'day': [3], 'shift_type': 1}], 30, 'req2')]
+    ctx = make_context()
+    apply_rules(ctx, {rules.REQUEST_TYPE_SPECIFIC_SHIFTS: items}, compile_rule_profile(None, DEFAULTS))
+    assert ctx.stats[rules.REQUEST_TYPE_SPECIFIC_SHIFTS]['invalidItems'] == 2
+    assert [weight for weight, _ in ctx.penalty_terms] == [30]
+
+
+def test_hard_and_soft_items_and_disabled_types():
+    ctx = make_context()
+    profile = compile_rule_profile({'disabledRuleTypes': ['no_night_shifts']}, DEFAULTS)
+    apply_rules(ctx, {'no_mondays': [(0, None, None, 'pc0'), (1, None, 15, 'pc0')], 'no_night_shifts': [(0, None, None, 'pc1')]}, profile)
+    assert 'no_night_shifts' not in ctx.stats
+    assert ctx.stats['no_mondays']['constraints'] == 1
+    assert len(ctx.penalty_terms) == 1
+    solver = cp_model.CpSolver()
+    ctx.model.Add(ctx.is_off[(0, 0)] == 0)
+    assert solver.Solve(ctx.model) == cp_model.INFEASIBLE
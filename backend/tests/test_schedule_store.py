@@ -0,0 +1,102 @@
+import pytest
+
+from schedule_store import MAX_LIST_VERSIONS, diff_versions, mask_to_shifts, pack_cells, shifts_to_mask, unpack_cells, version_nurse_shifts
+
+DAYS = ['2025-03-01', '2025-03-02', '2025-03-03']
+GRID = {
+    'n1': {'2025-03-01': [1], '2025-03-02': [2, 3], '2025-03-03': []},
+    'n2': {'2025-03-01': [], '2025-03-02': [1], '2025-03-03': [3]},
+}
+
+
+def save(store, ward='w1', start='2025-03-01', end='2025-03-03', grid=GRID, params=None):
+    return store.save_version(ward, start, end, 'hash', ['n1', 'n2'], DAYS, grid, params or {}, {})
+
+
+def test_masks_round_trip():
+    masks = [shifts_to_mask(s) for s in ([], [1], [2, 3], [1, 2, 3])]
+    assert masks == [0, 1, 6, 7]
+    assert unpack_cells(pack_cells(masks), len(masks)) == masks
+    assert [mask_to_shifts(m) for m in masks] == [[], [1], [2, 3], [1, 2, 3]]
+
+
+def test_save_and_load_version(store):
+    version_id = save(store, params={'holidays': [2]})
+    version = store.get_version(version_id)
+    assert version['ward'] == 'w1' and version['params'] == {'holidays': [2]}
+    assert version_nurse_shifts(version) == GRID
+    assert version_nurse_shifts(version, ['n2']) == {'n2': GRID['n2']}
+    assert 'masks' not in store.get_version(version_id, include_cells=False)
+    assert store.get_version(version_id + 1) is None
+
+
+def test_latest_and_covering_versions(store):
+    first = save(store)
+    second = save(store)
+    other_ward = save(store, ward='w2')
+    assert store.latest_version('w1', '2025-03-01')['id'] == second
+    assert store.find_version_covering('w1', '2025-03-02')['id'] == second
+    assert store.find_version_covering('w2', '2025-03-02')['id'] == other_ward
+    assert store.find_version_covering('w1', '2025-04-01') is None
+    assert [v['id'] for v in store.list_versions(ward='w1')] == [second, first]
+
+
+def test_list_versions_limit_is_bounded(store):
+    for _ in range(3):
+        save(store)
+    assert len(store.list_versions(limit=2)) == 2
+    assert len(store.list_versions(limit=MAX_LIST_VERSIONS)) == 3
+    for bad_limit in (0, -1, MAX_LIST_VERSIONS + 1, True, '5'):
+        with pytest.raises(ValueError):
+            store.list_versions(limit=bad_limit)
+
+
+def test_diff_versions(store):
+    changed = {nurse_id: dict(shifts) for nurse_id, shifts in GRID.items()}
+    changed['n1']['2025-03-03'] = [1]
+    changed['n2']['2025-03-02'] = []
+    old, new = store.get_version(save(store)), store.get_version(save(store, grid=changed))
+    assert diff_versions(old, new) == [
+        {'nurseId': 'n1', 'date': '2025-03-03', 'from': [], 'to': [1]},
+        {'nurseId': 'n2', 'date': '2025-03-02', 'from': [1], 'to': []},
+    ]
+
+
+def test_month_stats_update_year_totals_by_difference(store):
+    store.record_month_stats('w1', 2025, 1, 1, {'n1': {'total': 20, 'night': 5}, 'n2': {'total': 18}})
+    store.record_month_stats('w1', 2025, 2, 2, {'n1': {'total': 19}})
+    store.record_month_stats('w1', 2025, 1, 3, {'n1': {'total': 21, 'night': 4}})
+    assert store.get_year_stats('w1', 2025)['n1']['total'] == 40
+    assert store.get_year_stats('w1', 2025)['n1']['night'] == 4
+    assert store.get_year_stats('w1', 2025)['n2']['total'] == 0
+    assert 'n2' not in store.get_month_stats('w1', 2025, 1)
+
+
+def test_month_stats_partial_update_keeps_other_nurses(store):
+    store.record_month_stats('w1', 2025, 1, 1, {'n1': {'total': 20}, 'n2': {'total': 18}})
+    store.record_month_stats('w1', 2025, 1, 2, {'n1': {'total': 19}}, replace_all=False)
+    assert store.get_month_stats('w1', 2025, 1)['n2']['total'] == 18
+    assert store.get_year_stats('w1', 2025)['n1']['total'] == 19
+
+
+def test_derived_version_requires_latest_published_base(store):
+    base_id = save(store)
+    store.publish_version(base_id, 2025, 3, {})
+    save(store)
+    base = store.get_version(base_id)
+    derived_id = store.save_derived_version(base, GRID, {'source': 'swap'}, 2025, 3, {'n1': {'total': 1}})
+    assert derived_id is not None
+    assert store.get_month_stats('w1', 2025, 3)['n1']['total'] == 1
+    assert store.save_derived_version(base, GRID, {'source': 'swap'}, 2025, 3, {'n1': {'total': 2}}) is None
+    assert store.get_month_stats('w1', 2025, 3)['n1']['total'] == 1
+
+
+def test_publish_version_records_stats_and_marks_latest_published(store):
+    published = save(store)
+    draft = save(store)
+    assert store.publish_version(published, 2025, 3, {'n1': {'total': 4}})
+    assert store.latest_version('w1', '2025-03-01')['id'] == draft
+    assert store.latest_version('w1', '2025-03-01', published_only=True)['id'] == published
+    assert store.find_version_covering('w1', '2025-03-02', published_only=True)['id'] == published
+    assert store.get_month_stats('w1', 2025, 3)['n1']['total'] == 4
+    assert not store.publish_version(draft + 1, 2025, 3, {})
@@ -0,0 +1,47 @@
+from conftest import small_payload
+
+
+def generate(server, payload):
+    body, status_code = server.solve_schedule_request(payload)
+    assert status_code == 200, body
+    return body
+
+
+def test_drafts_do_not_touch_aggregates(server_app):
+    body = generate(server_app, small_payload())
+    assert server_app.schedule_store.get_month_stats('w1', 2025, 3) == {}
+    assert server_app.schedule_store.get_version(body['scheduleVersionId'])['publishedAt'] is None
+
+
+def test_publish_records_month_stats(server_app):
+    payload = small_payload(monthly_soft_requests={'n1': [{'type': 'no_specific_days', 'value': ['4'], 'is_high_priority': True}]})
+    first = generate(server_app, payload)
+    generate(server_app, dict(payload, warmStart=False))
+    client = server_app.app.test_client()
+    response = client.post(f"/schedule-versions/{first['scheduleVersionId']}/publish")
+    assert response.status_code == 200
+    stats = server_app.schedule_store.get_month_stats('w1', 2025, 3)
+    assert set(stats) == {f'n{i}' for i in range(1, 6)}
+    for nurse_id, counts in first['shiftsCount'].items():
+        assert stats[nurse_id]['total'] == counts['total']
+        assert stats[nurse_id]['daysOff'] == counts['daysOff']
+    assert stats['n1']['requestsTotal'] == 1
+    assert server_app.schedule_store.get_year_stats('w1', 2025)['n1']['total'] == first['shiftsCount']['n1']['total']
+    assert client.post('/schedule-versions/999/publish').status_code == 404
+
+
+def test_aggregate_endpoints(server_app):
+    store = server_app.schedule_store
+    days = ['2025-03-03']
+    for month, totals in ((3, {'n1': 5, 'n2': 3}), (4, {'n1': 2})):
+        version_id = store.save_version('w1', days[0], days[0], f'h{month}', ['n1', 'n2'], days, {'n1': {}, 'n2': {}}, {}, {})
+        store.publish_version(version_id, 2025, month, {nid: {'total': total} for nid, total in totals.items()})
+    client = server_app.app.test_client()
+
+    monthly = client.get('/aggregates/monthly?ward=w1&year=2025&month=3').get_json()
+    assert {nid: stats['total'] for nid, stats in monthly['nurses'].items()} == {'n1': 5, 'n2': 3}
+    assert monthly['summary']['total'] == {'min': 3, 'max': 5, 'sum': 8}
+    yearly = client.get('/aggregates/yearly?ward=w1&year=2025&nurseId=n1').get_json()
+    assert yearly['nurses']['n1']['total'] == 7
+    assert client.get('/aggregates/monthly?year=2025&month=3').status_code == 400
+    assert client.get('/aggregates/yearly?ward=w1&year=abc').status_code == 400
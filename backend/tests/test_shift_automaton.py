@@ -0,0 +1,74 @@
+import itertools
+
+from ortools.sat.python import cp_model
+
+from conftest import small_payload
+from shift_automaton import DAY_LABELS, LABEL_SHIFTS, add_consecutive_automaton, build_automaton, start_state
+
+MAX_SHIFTS, MAX_OFF, MAX_SAME = 4, 2, 2
+
+
+def reference_ok(labels, consecutive=0, last_afternoon=False):
+    """Straight scan of the consecutive rules the automaton encodes."""
+    off_run, runs = 0, [0, 0, 0]
+    for label in labels:
+        morning, afternoon, night = LABEL_SHIFTS[label]
+        if last_afternoon and night: return False
+        count = morning + afternoon + night
+        consecutive, off_run = (consecutive + count, 0) if count else (0, off_run + 1)
+        runs = [run + 1 if has else 0 for run, has in zip(runs, (morning, afternoon, night))]
+        if consecutive > MAX_SHIFTS or off_run > MAX_OFF or max(runs) > MAX_SAME: return False
+        last_afternoon = afternoon
+    return True
+
+
+def accepts(start, labels):
+    start_id, _, transitions = build_automaton(start, MAX_SHIFTS, MAX_OFF, MAX_SAME)
+    table = {(state_id, label): next_id for state_id, label, next_id in transitions}
+    state_id = start_id
+    for label in labels:
+        state_id = table.get((state_id, label))
+        if state_id is None: return False
+    return True
+
+
+def test_automaton_matches_reference_rules():
+    fresh = start_state({}, MAX_SHIFTS, MAX_SAME)
+    after_run = start_state({'was_off_last_day': False, 'consecutive_shifts': 3, 'last_day_shifts': [2],
+                             'last_shift_types_count': {'2': 1}}, MAX_SHIFTS, MAX_SAME)
+    for labels in itertools.product(DAY_LABELS, repeat=5):
+        assert accepts(fresh, labels) == reference_ok(labels), labels
+        assert accepts(after_run, labels) == reference_ok(labels, consecutive=3, last_afternoon=True), labels
+
+
+def solve_fixed(labels):
+    model = cp_model.CpModel()
+    day_shifts = []
+    for d, label in enumerate(labels):
+        booleans = [model.NewBoolVar(f's{d}_{s}') for s in range(3)]
+        for var, has in zip(booleans, LABEL_SHIFTS[label]):
+            model.Add(var == int(has))
+        day_shifts.append(booleans)
+    ends_at_max = add_consecutive_automaton(model, 'n0', day_shifts, start_state({}, MAX_SHIFTS, MAX_SAME), MAX_SHIFTS, MAX_OFF, MAX_SAME)
+    solver = cp_model.CpSolver()
+    status = solver.Solve(model)
+    return status, solver.Value(ends_at_max) if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None
+
+
+def test_add_consecutive_automaton_constrains_model():
+    assert solve_fixed([1, 0, 1, 2, 2]) == (cp_model.OPTIMAL, 0)
+    # Two shifts from the double then two more end the month at the limit.
+    assert solve_fixed([0, 5, 1, 3]) == (cp_model.OPTIMAL, 1)
+    assert solve_fixed([2, 3])[0] == cp_model.INFEASIBLE
+    assert solve_fixed([0, 0, 0])[0] == cp_model.INFEASIBLE
+
+
+def test_automaton_encoding_solves_like_linear(server_app):
+    payload = small_payload(maxConsecutiveShiftsWorked=MAX_SHIFTS)
+    linear, linear_status = server_app.solve_schedule_request(dict(payload, consecutiveEncoding='linear', warmStart=False))
+    automaton, automaton_status = server_app.solve_schedule_request(dict(payload, consecutiveEncoding='automaton', warmStart=False))
+    assert linear_status == automaton_status == 200
+    for nurse_id, schedule in automaton['nurseSchedules'].items():
+        # Shift ids add up to the day label (afternoon 2 + night 3 = the double).
+        labels = [sum(schedule['shifts'][day_iso]) for day_iso in automaton['days']]
+        assert reference_ok(labels), (nurse_id, labels)
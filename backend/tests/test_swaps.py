@@ -0,0 +1,145 @@
+import datetime
+
+from conftest import small_payload
+from schedule_store import shifts_to_mask
+from swap_checker import ScheduleIndex
+
+DAYS = [(datetime.date(2025, 3, 3) + datetime.timedelta(days=d)).isoformat() for d in range(7)]
+GRID = {
+    'n1': dict(zip(DAYS, [[2], [], [1], [], [2], [], [1]])),
+    'n2': dict(zip(DAYS, [[], [1], [], [2], [], [1], []])),
+}
+# n1 takes n2's morning on 03-04 and gives up its morning on 03-05.
+SWAP = {'requesterId': 'n1', 'requesterDate': '2025-03-05', 'requesterShifts': [1],
+        'targetId': 'n2', 'targetDate': '2025-03-04', 'targetShifts': [1]}
+DEFAULT_STATE = {'last_day_shifts': [], 'consecutive_shifts': 0, 'was_off_last_day': True, 'last_shift_types_count': {}}
+# Previous month ended with 4 shifts in a row, the last one a night.
+WORKED_FOUR = {'last_day_shifts': [3], 'consecutive_shifts': 4, 'was_off_last_day': False, 'last_shift_types_count': {'1': 0, '2': 0, '3': 1}}
+
+
+def version_params(previous_states=None, approved_hard_requests=(), nurse_hard_constraints=None):
+    return {
+        'maxConsecutiveShiftsWorked': 5, 'holidays': [], 'ruleProfile': {}, 'govNurseIds': [],
+        'previousStates': previous_states or {'n1': DEFAULT_STATE, 'n2': DEFAULT_STATE},
+        'nurseHardConstraints': nurse_hard_constraints or {'n1': [], 'n2': []},
+        'approvedHardRequests': [list(r) for r in approved_hard_requests],
+    }
+
+
+def save_version(store, params, publish=True):
+    version_id = store.save_version('w1', DAYS[0], DAYS[-1], 'h', ['n1', 'n2'], DAYS, GRID, params, {})
+    if publish:
+        store.publish_version(version_id, 2025, 3, {})
+    return version_id
+
+
+def make_index(previous_states=None):
+    days = [datetime.date.fromisoformat(day_iso) for day_iso in DAYS]
+    masks = {nid: [shifts_to_mask(GRID[nid][day_iso]) for day_iso in DAYS] for nid in GRID}
+    rules = {'max_consecutive_shifts': 5, 'max_consecutive_same_shift': 2, 'max_consecutive_off_days': 2,
+             'min_off_days_in_window': 0, 'window_size_for_min_off': 7}
+    return ScheduleIndex(['n1', 'n2'], days, masks, set(), set(), rules, previous_states)
+
+
+def test_check_swaps_counts_previous_month_run():
+    assert make_index().check_swaps([SWAP])['feasible']
+    violations = make_index({'n1': WORKED_FOUR}).check_swaps([SWAP])['violations']
+    assert [(v['nurseId'], v['date'], v['rule']) for v in violations] == [('n1', '2025-03-04', 'max_consecutive_shifts')]
+
+
+def test_check_swaps_rejects_shift_not_held():
+    swap = dict(SWAP, requesterShifts=[3])
+    rules = {v['rule'] for v in make_index().check_swaps([swap])['violations']}
+    assert 'shift_not_held' in rules
+
+
+def test_apply_swaps_matches_rebuilt_index():
+    index = make_index({'n1': WORKED_FOUR})
+    index.apply_swaps([SWAP])
+    swapped = {nid: dict(shifts) for nid, shifts in GRID.items()}
+    swapped['n1'].update({'2025-03-04': [1], '2025-03-05': []})
+    swapped['n2'].update({'2025-03-04': [], '2025-03-05': [1]})
+    days = [datetime.date.fromisoformat(day_iso) for day_iso in DAYS]
+    rebuilt = ScheduleIndex(['n1', 'n2'], days, {nid: [shifts_to_mask(swapped[nid][d]) for d in DAYS] for nid in swapped},
+                            set(), set(), index.rules, {'n1': WORKED_FOUR})
+    assert index.rows == rebuilt.rows
+    assert index.states == rebuilt.states
+
+
+def test_feasible_partners_are_all_feasible():
+    index = make_index({'n1': WORKED_FOUR})
+    partners, _ = index.feasible_partners('n1', '2025-03-05')
+    assert partners
+    assert {'targetId': 'n2', 'targetDate': '2025-03-04', 'targetShifts': [1]} not in partners
+    for partner in partners:
+        swap = dict(SWAP, targetId=partner['targetId'], targetDate=partner['targetDate'], targetShifts=partner['targetShifts'])
+        assert index.check_swaps([swap])['feasible']
+
+
+def test_swap_api_uses_stored_previous_month_state(server_app):
+    version_id = save_version(server_app.schedule_store, version_params({'n1': WORKED_FOUR, 'n2': DEFAULT_STATE}))
+    # A newer draft must not be what swaps are checked against.
+    save_version(server_app.schedule_store, version_params(), publish=False)
+    client = server_app.app.test_client()
+
+    check = client.post('/swaps/check', json=dict(SWAP, ward='w1')).get_json()
+    assert check['versionId'] == version_id
+    assert not check['feasible']
+    assert check['violations'][0]['rule'] == 'max_consecutive_shifts'
+
+    response = client.post('/swaps/apply', json=dict(SWAP, ward='w1', versionId=version_id))
+    assert response.status_code == 409
+    assert response.get_json()['violations'][0]['rule'] == 'max_consecutive_shifts'
+    response = client.post('/swaps/apply', json=dict(SWAP, ward='w1', versionId=version_id, force=True))
+    assert response.status_code == 409
+
+
+def test_swap_apply_requires_version_id(server_app):
+    save_version(server_app.schedule_store, version_params())
+    response = server_app.app.test_client().post('/swaps/apply', json=dict(SWAP, ward='w1'))
+    assert response.status_code == 400
+
+
+def test_swap_apply_uses_stored_hard_requests(server_app):
+    version_id = save_version(server_app.schedule_store, version_params(approved_hard_requests=[('n2', '2025-03-05')]))
+    response = server_app.app.test_client().post('/swaps/apply', json=dict(SWAP, ward='w1', versionId=version_id))
+    assert response.status_code == 409
+    assert [v['rule'] for v in response.get_json()['violations']] == ['hard_off_day']
+
+
+def test_swap_apply_saves_derived_version(server_app):
+    version_id = save_version(server_app.schedule_store, version_params())
+    response = server_app.app.test_client().post('/swaps/apply', json=dict(SWAP, ward='w1', versionId=version_id))
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    assert body['baseVersionId'] == version_id
+    assert {(c['nurseId'], c['date'], tuple(c['to'])) for c in body['changes']} == {
+        ('n1', '2025-03-04', (1,)), ('n1', '2025-03-05', ()), ('n2', '2025-03-04', ()), ('n2', '2025-03-05', (1,))}
+    new_version = server_app.schedule_store.get_version(body['scheduleVersionId'])
+    assert new_version['params']['previousStates'] == version_params()['previousStates']
+
+
+def test_swap_check_rejects_versions_without_stored_state(server_app):
+    params = version_params()
+    del params['previousStates']
+    version_id = save_version(server_app.schedule_store, params)
+    response = server_app.app.test_client().post('/swaps/check', json=dict(SWAP, ward='w1', versionId=version_id))
+    assert response.status_code == 409
+
+
+def test_solve_stores_swap_check_state(server_app):
+    previous_days = ['2025-03-01', '2025-03-02']
+    payload = small_payload(
+        nurses=[{'id': f'n{i}', 'isGovernmentOfficial': False,
+                 'constraints': [{'type': 'no_night_shifts', 'strength': 'hard'}, {'type': 'no_mondays', 'strength': 'soft'}] if i == 1 else []}
+                for i in range(1, 6)],
+        previousMonthSchedule={'days': previous_days, 'nurseSchedules': {'n1': {'shifts': {'2025-03-01': [1], '2025-03-02': [3]}}}},
+    )
+    body, status_code = server_app.solve_schedule_request(payload)
+    assert status_code == 200, body
+    params = server_app.schedule_store.get_version(body['scheduleVersionId'])['params']
+    assert params['previousStates']['n1']['consecutive_shifts'] == 2
+    assert params['previousStates']['n1']['last_day_shifts'] == [3]
+    assert params['previousStates']['n2']['was_off_last_day'] is True
+    assert params['nurseHardConstraints']['n1'] == [{'type': 'no_night_shifts', 'strength': 'hard'}]
+    assert params['approvedHardRequests'] == []
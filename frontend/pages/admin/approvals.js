@@ -184,12 +184,70 @@ export default function AdminApprovals() {
 
     setProcessing(true);
     try {
+      const swapRequest = swapRequests.find(r => r.id === requestId);
+      if (!swapRequest) {
+        alert('ไม่พบคำขอแลกเวรนี้ กรุณาโหลดหน้าใหม่');
+        return;
+      }
+
+      // The swap is checked against the schedule version that was saved for this month.
+      const [swapYear, swapMonth] = swapRequest.requesterDate.split('-').map(Number);
+      const scheduleRef = doc(db, 'schedules', `${swapRequest.ward}_${swapYear}_${swapMonth}`);
+      const scheduleSnap = await getDoc(scheduleRef);
+      const scheduleVersionId = scheduleSnap.exists() ? scheduleSnap.data().scheduleVersionId : null;
+
+      let response = null;
+      if (scheduleVersionId != null) {
+        try {
+          response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/swaps/apply`, {
+            method: 'POST',
+            headers: {
+              'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+              swapRequestId: requestId,
+              ward: swapRequest.ward,
+              versionId: scheduleVersionId,
+              requesterId: swapRequest.requesterId,
+              requesterDate: swapRequest.requesterDate,
+              requesterShifts: swapRequest.requesterShifts || [],
+              targetId: swapRequest.targetId,
+              targetDate: swapRequest.targetDate,
+              targetShifts: swapRequest.targetShifts || []
+            })
+          });
+        } catch (error) {
+          console.error('Error applying swap to schedule store:', error);
+          alert('ไม่สามารถติดต่อเซิร์ฟเวอร์เพื่อตรวจสอบการแลกเวรได้ กรุณาลองใหม่อีกครั้ง');
+          return;
+        }
+      }
+
+      // Only a missing stored schedule may be approved without the server-side rule check.
+      if (response === null || response.status === 404) {
+        if (!confirm('ไม่พบตารางเวรที่บันทึกไว้ในระบบสำหรับช่วงวันที่นี้ จึงไม่สามารถตรวจสอบกฎการแลกเวรได้ ต้องการอนุมัติต่อหรือไม่?')) return;
+      } else if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        const details = (data.violations || []).map(v => `- ${v.date}: ${v.message}`).join('\n');
+        alert(`ไม่สามารถอนุมัติการแลกเวรได้: ${data.error || `HTTP ${response.status}`}${details ? '\n' + details : ''}`);
+        return;
+      }
+
       await updateDoc(doc(db, 'swapRequests', requestId), {
         status: 'approved',
         approvedBy: userData.id,
         approvedAt: new Date()
       });
 
+      if (response !== null && response.ok) {
+        const applied = await response.json();
+        const scheduleUpdate = { scheduleVersionId: applied.scheduleVersionId };
+        for (const change of applied.changes || []) {
+          scheduleUpdate[`nurseSchedules.${change.nurseId}.shifts.${change.date}`] = change.to;
+        }
+        await updateDoc(scheduleRef, scheduleUpdate);
+      }
+
       alert('อนุมัติการแลกเวรสำเร็จ');
       loadSwapRequests();
     } catch (error) {
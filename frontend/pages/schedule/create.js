@@ -30,6 +30,7 @@ export default function CreateSchedule() {
   });
 
   const [holidays, setHolidays] = useState([]);
+  const [capacityAnalysis, setCapacityAnalysis] = useState(null);
 
   useEffect(() => {
     if (userData?.ward) {
@@ -37,6 +38,37 @@ export default function CreateSchedule() {
     }
   }, [userData, formData.year, formData.month]);
 
+  // Re-check the settings against nurse supply while they are edited; the check builds no solver model.
+  useEffect(() => {
+    if (loading || nurses.length === 0) return;
+    const controller = new AbortController();
+    const timer = setTimeout(async () => {
+      try {
+        const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/analyze-schedule-input`, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({
+            ...buildRequestBody(),
+            approvedHardRequests: hardRequests.map(r => ({ nurseId: r.nurseId, date: r.date }))
+          }),
+          signal: controller.signal
+        });
+        setCapacityAnalysis(response.ok ? await response.json() : null);
+      } catch (error) {
+        if (error.name !== 'AbortError') {
+          console.error('Error analyzing schedule input:', error);
+          setCapacityAnalysis(null);
+        }
+      }
+    }, 400);
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [loading, nurses, formData, holidays, hardRequests, previousSchedule]);
+
   const loadInitialData = async () => {
     setLoading(true);
     try {
@@ -170,6 +202,33 @@ export default function CreateSchedule() {
     }
   };
 
+  const buildRequestBody = () => {
+    const days = getMonthDays();
+    return {
+      nurses: nurses.map(n => ({
+        id: n.id,
+        isGovernmentOfficial: n.isGovernmentOfficial || false,
+        constraints: n.constraints || []
+      })),
+      schedule: {
+        startDate: days[0].date,
+        endDate: days[days.length - 1].date
+      },
+      requiredNursesMorning: formData.requiredNursesMorning,
+      requiredNursesAfternoon: formData.requiredNursesAfternoon,
+      requiredNursesNight: formData.requiredNursesNight,
+      maxConsecutiveShiftsWorked: formData.maxConsecutiveShiftsWorked,
+      targetOffDays: formData.targetOffDays,
+      solverTimeLimit: formData.solverTimeLimit,
+      monthly_soft_requests: softRequests,
+      carry_over_flags: carryOverFlags,
+      holidays: holidays,
+      previousMonthSchedule: previousSchedule,
+      ward: userData.ward,
+      useStoredFairnessHistory: true
+    };
+  };
+
   const handleGenerateSchedule = async () => {
     if (nurses.length === 0) {
       alert('ไม่พบพยาบาลในวอร์ดนี้');
@@ -189,31 +248,7 @@ export default function CreateSchedule() {
 
     setGenerating(true);
     try {
-      const days = getMonthDays();
-      const startDate = days[0].date;
-      const endDate = days[days.length - 1].date;
-
-      const requestBody = {
-        nurses: nurses.map(n => ({
-          id: n.id,
-          isGovernmentOfficial: n.isGovernmentOfficial || false,
-          constraints: n.constraints || []
-        })),
-        schedule: {
-          startDate,
-          endDate
-        },
-        requiredNursesMorning: formData.requiredNursesMorning,
-        requiredNursesAfternoon: formData.requiredNursesAfternoon,
-        requiredNursesNight: formData.requiredNursesNight,
-        maxConsecutiveShiftsWorked: formData.maxConsecutiveShiftsWorked,
-        targetOffDays: formData.targetOffDays,
-        solverTimeLimit: formData.solverTimeLimit,
-        monthly_soft_requests: softRequests,
-        carry_over_flags: carryOverFlags,
-        holidays: holidays,
-        previousMonthSchedule: previousSchedule
-      };
+      const requestBody = buildRequestBody();
 
       const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/generate-schedule`, {
         method: 'POST',
@@ -257,6 +292,7 @@ export default function CreateSchedule() {
         days: scheduleResult.days,
         fairnessReport: scheduleResult.fairnessReport,
         nextCarryOverFlags: scheduleResult.nextCarryOverFlags,
+        scheduleVersionId: scheduleResult.scheduleVersionId ?? null,
         createdBy: userData.id,
         createdAt: new Date(),
         parameters: {
@@ -268,7 +304,21 @@ export default function CreateSchedule() {
         }
       });
 
-      alert('บันทึกตารางเวรสำเร็จ');
+      // Only saved schedules count towards the monthly and yearly nurse statistics.
+      let savedMessage = 'บันทึกตารางเวรสำเร็จ';
+      if (scheduleResult.scheduleVersionId != null) {
+        try {
+          const publishResponse = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/schedule-versions/${scheduleResult.scheduleVersionId}/publish`, {
+            method: 'POST'
+          });
+          if (!publishResponse.ok) throw new Error(`HTTP ${publishResponse.status}`);
+        } catch (error) {
+          console.error('Error publishing schedule version:', error);
+          savedMessage = 'บันทึกตารางเวรแล้ว แต่ไม่สามารถอัปเดตสถิติเวรของพยาบาลได้: ' + error.message;
+        }
+      }
+
+      alert(savedMessage);
       setShowResult(false);
       setScheduleResult(null);
     } catch (error) {
@@ -574,11 +624,38 @@ export default function CreateSchedule() {
                   </div>
                 </div>
 
+                {capacityAnalysis && capacityAnalysis.errors.length > 0 && (
+                  <div className="capacity-notice errors">
+                    <p className="capacity-title">ไม่สามารถจัดตารางเวรได้ด้วยการตั้งค่านี้</p>
+                    <ul>
+                      {capacityAnalysis.errors.slice(0, 5).map((issue, i) => (
+                        <li key={i}>{issue.message}</li>
+                      ))}
+                    </ul>
+                    {capacityAnalysis.errors.length > 5 && (
+                      <p className="capacity-more">และอีก {capacityAnalysis.errors.length - 5} รายการ</p>
+                    )}
+                  </div>
+                )}
+                {capacityAnalysis && capacityAnalysis.warnings.length > 0 && (
+                  <div className="capacity-notice warnings">
+                    <p className="capacity-title">ข้อควรระวัง</p>
+                    <ul>
+                      {capacityAnalysis.warnings.slice(0, 5).map((issue, i) => (
+                        <li key={i}>{issue.message}</li>
+                      ))}
+                    </ul>
+                    {capacityAnalysis.warnings.length > 5 && (
+                      <p className="capacity-more">และอีก {capacityAnalysis.warnings.length - 5} รายการ</p>
+                    )}
+                  </div>
+                )}
+
                 <div className="action-buttons">
                   <button 
                     className="btn btn-primary large"
                     onClick={handleGenerateSchedule}
-                    disabled={generating || loading}
+                    disabled={generating || loading || (capacityAnalysis && !capacityAnalysis.feasible)}
                   >
                     {generating ? 'กำลังสร้างตารางเวร...' : 'สร้างตารางเวร'}
                   </button>
@@ -826,6 +903,40 @@ export default function CreateSchedule() {
             justify-content: center;
           }
                 
+          .capacity-notice {
+            padding: 16px;
+            border-radius: 8px;
+            margin-bottom: 24px;
+            font-size: 14px;
+          }
+                
+          .capacity-notice.errors {
+            background: #fff5f5;
+            border: 1px solid #feb2b2;
+            color: #c53030;
+          }
+                
+          .capacity-notice.warnings {
+            background: #fffaf0;
+            border: 1px solid #fbd38d;
+            color: #c05621;
+          }
+                
+          .capacity-title {
+            font-weight: 600;
+            margin-bottom: 8px;
+          }
+                
+          .capacity-notice ul {
+            margin: 0;
+            padding-left: 20px;
+          }
+                
+          .capacity-more {
+            margin-top: 8px;
+            opacity: 0.8;
+          }
+                
           .btn.large {
             padding: 16px 40px;
             font-size: 16px;